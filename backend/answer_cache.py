@@ -0,0 +1,166 @@
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+# Words that usually point back into the conversation ("what did he do
+# next?"). A question containing them depends on history, so a cached answer
+# to the same words in another conversation may not fit.
+REFERENTIAL_WORDS = {
+    "he", "she", "him", "her", "his", "hers", "they", "them", "their", "theirs",
+    "it", "its", "that", "this", "those", "these", "there", "then", "else",
+}
+
+
+def depends_on_history(message: str, history) -> bool:
+    """Whether the answer to message likely depends on the chat history"""
+    if not history:
+        return False
+    words = set(re.findall(r"[a-z']+", message.lower()))
+    return bool(words & REFERENTIAL_WORDS)
+
+
+class _Scope:
+    """Answers for one (mode, character) pair, with their query vectors in one matrix"""
+
+    def __init__(self, dim: int, capacity: int = 256):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.expires = np.zeros(capacity, dtype=np.float64)
+        self.valid = np.zeros(capacity, dtype=bool)
+        self.payloads = [None] * capacity
+        self.free = list(range(capacity - 1, -1, -1))
+        self.used = 0  # rows [0, used) have ever been written
+
+    def allocate(self, max_capacity: int) -> Optional[int]:
+        if not self.free:
+            capacity = len(self.vectors)
+            if capacity >= max_capacity:
+                return None
+            new_capacity = min(capacity * 2, max_capacity)
+            self.vectors = np.vstack([self.vectors, np.zeros((new_capacity - capacity, self.vectors.shape[1]), dtype=np.float32)])
+            self.expires = np.concatenate([self.expires, np.zeros(new_capacity - capacity)])
+            self.valid = np.concatenate([self.valid, np.zeros(new_capacity - capacity, dtype=bool)])
+            self.payloads.extend([None] * (new_capacity - capacity))
+            self.free = list(range(new_capacity - 1, capacity - 1, -1))
+        slot = self.free.pop()
+        self.used = max(self.used, slot + 1)
+        return slot
+
+    def release(self, slot: int) -> None:
+        self.valid[slot] = False
+        self.payloads[slot] = None
+        self.free.append(slot)
+
+
+class SemanticAnswerCache:
+    """Answer cache keyed on question similarity within a (mode, character) scope.
+
+    A lookup scores the query vector against every cached question vector of
+    the scope with one matrix-vector product, so it stays cheap with tens of
+    thousands of entries. Entries expire after ``ttl`` seconds, and once
+    ``max_entries`` are cached the least recently used one is evicted.
+
+    Like TwoTierCache, the cache has a ``version`` that is part of every
+    scope key; setting a new one (the index was re-ingested) drops every
+    answer, and answers of requests still in flight under the old version
+    are not stored.
+    """
+
+    def __init__(self, max_entries: int = 20000, ttl: float = 3600, threshold: float = 0.95):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self._scopes: Dict[Tuple, _Scope] = {}
+        self._lru: "OrderedDict[Tuple, None]" = OrderedDict()
+        self.version = "0"
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def set_version(self, version: str) -> None:
+        if version != self.version:
+            self.version = version
+            self.clear()
+
+    def scope_key(self, mode: str, character: Optional[str]) -> Tuple:
+        return (self.version, mode, character if mode == "character" else None)
+
+    def _normalize(self, vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _drop(self, scope_key: Tuple, slot: int) -> None:
+        self._scopes[scope_key].release(slot)
+        self._lru.pop((scope_key, slot), None)
+
+    def lookup(self, scope_key: Tuple, vector) -> Optional[Dict]:
+        """Best cached answer above the similarity threshold, or None"""
+        scope = self._scopes.get(scope_key)
+        if scope is None or scope.used == 0:
+            self.misses += 1
+            return None
+
+        query = self._normalize(vector)
+        scores = scope.vectors[:scope.used] @ query
+        scores[~scope.valid[:scope.used]] = -np.inf
+        while True:
+            slot = int(np.argmax(scores))
+            if scores[slot] < self.threshold:
+                self.misses += 1
+                return None
+            if scope.expires[slot] >= time.monotonic():
+                break
+            # Expired: free it and try the next best candidate
+            self._drop(scope_key, slot)
+            self.expirations += 1
+            scores[slot] = -np.inf
+
+        self._lru.move_to_end((scope_key, slot))
+        self.hits += 1
+        return dict(scope.payloads[slot], similarity=float(scores[slot]))
+
+    def store(self, scope_key: Tuple, vector, payload: Dict) -> None:
+        if scope_key[0] != self.version:
+            return
+        vector = self._normalize(vector)
+        scope = self._scopes.get(scope_key)
+        if scope is None:
+            scope = self._scopes[scope_key] = _Scope(len(vector))
+
+        while len(self._lru) >= self.max_entries:
+            (old_scope, old_slot), _ = self._lru.popitem(last=False)
+            self._scopes[old_scope].release(old_slot)
+            self.evictions += 1
+
+        slot = scope.allocate(self.max_entries)
+        if slot is None:
+            return
+        scope.vectors[slot] = vector
+        scope.expires[slot] = time.monotonic() + self.ttl
+        scope.valid[slot] = True
+        scope.payloads[slot] = payload
+        self._lru[(scope_key, slot)] = None
+        self.stores += 1
+
+    def clear(self) -> None:
+        self._scopes.clear()
+        self._lru.clear()
+
+    def stats(self) -> Dict:
+        return {
+            "entries": len(self._lru),
+            "scopes": len(self._scopes),
+            "version": self.version,
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
@@ -0,0 +1,330 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import logging
+from typing import AsyncIterator, Dict, List, Optional
+
+import numpy as np
+
+from cache import normalize_query
+from limits import RateLimiter, StageOverloaded, limiter
+from llm import generate_async, LLMError
+from models import BatchChatItem
+from rag import (
+    EMBEDDING_EXECUTOR, encode_batch, embedding_cache, retrieval_cache, retrieval_cache_key, retrieval_scope,
+    get_vector_store_async, query_index, query_index_many, compose_prompt, CONTEXT_CANDIDATES,
+    CHARACTER_CONTEXT_CANDIDATES, answer_cache, ANSWER_CACHE_ENABLED,
+)
+from telemetry import configure_logging, counter, span
+
+logger = logging.getLogger(__name__)
+
+# Questions are prepared in waves of this size: one forward pass for their
+# embeddings and one multi-query (or a burst of concurrent queries) for their
+# context. The next wave is prepared while the LLM works through this one.
+BATCH_ENCODE_SIZE = int(os.getenv("BATCH_ENCODE_SIZE", "256"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "10000"))
+# Single vector queries in flight at once, for stores without multi-query
+BATCH_VECTOR_CONCURRENCY = int(os.getenv("BATCH_VECTOR_CONCURRENCY", "8"))
+# LLM calls in flight, and started per second (0: no limit), per batch. Set
+# these to what the provider account allows.
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "8"))
+BATCH_RATE_LIMIT = float(os.getenv("BATCH_RATE_LIMIT", "0"))
+# Attempts, with exponential backoff, when the shared llm stage is full
+BATCH_OVERLOAD_RETRIES = 5
+
+BATCH_ITEMS = counter("batch_items", "Batch items answered, by result (llm, cache, error)", ("result",))
+
+
+async def embed_many(texts: List[str]) -> List[np.ndarray]:
+    """Query embeddings for many texts: cached ones from the embedding cache,
+    the rest encoded BATCH_ENCODE_SIZE per forward pass"""
+    keys = [embedding_cache.key(normalize_query(t)) for t in texts]
+    vectors = await embedding_cache.get_many(keys)
+    missing: Dict[str, str] = {}
+    for key, text, vector in zip(keys, texts, vectors):
+        if vector is None:
+            missing.setdefault(key, text)
+
+    encoded = {}
+    pending = list(missing.items())
+    loop = asyncio.get_running_loop()
+    for start in range(0, len(pending), BATCH_ENCODE_SIZE):
+        part = pending[start:start + BATCH_ENCODE_SIZE]
+        async with limiter("embedding").slot():
+            matrix = await loop.run_in_executor(EMBEDDING_EXECUTOR, encode_batch, [text for _, text in part])
+        encoded.update(zip((key for key, _ in part), matrix))
+    await embedding_cache.set_many(list(encoded.items()))
+    return [vector if vector is not None else encoded[key] for key, vector in zip(keys, vectors)]
+
+
+async def retrieve_many(items: List[BatchChatItem], vectors: List[np.ndarray], top_k: int) -> List[List[Dict]]:
+    """Context chunks for many queries: cached results from the retrieval
+    cache, the rest in one multi-query per retrieval scope (character) when
+    the store supports it, otherwise as concurrent single queries"""
+    store = await get_vector_store_async()  # loading it sets the retrieval cache version
+    if store is None:
+        logger.warning("Vector store not available, answering batch without context")
+        return [[] for _ in items]
+
+    scopes = [retrieval_scope(store, item.mode, item.character) for item in items]
+    limits = [min(top_k, CHARACTER_CONTEXT_CANDIDATES) if scope else top_k for scope in scopes]
+    keys = [retrieval_cache_key(item.message, k, scope) for item, k, scope in zip(items, limits, scopes)]
+    results = await retrieval_cache.get_many(keys)
+    missing: Dict[str, int] = {}
+    for i, (key, chunks) in enumerate(zip(keys, results)):
+        if chunks is None:
+            missing.setdefault(key, i)
+    if not missing:
+        return results
+
+    found: Dict[str, object] = {}
+    if store.multi_query:
+        groups: Dict[Optional[str], List[str]] = {}
+        for key, i in missing.items():
+            groups.setdefault(scopes[i], []).append(key)
+        for scope, group in groups.items():
+            rows = [missing[key] for key in group]
+            try:
+                async with limiter("vector").slot():
+                    chunk_lists = await asyncio.to_thread(
+                        query_index_many, [vectors[i] for i in rows], limits[rows[0]], True, scope)
+            except StageOverloaded:
+                raise
+            except Exception as e:
+                chunk_lists = [e] * len(rows)
+            found.update(zip(group, chunk_lists))
+    else:
+        slots = asyncio.Semaphore(BATCH_VECTOR_CONCURRENCY)
+
+        async def single(i):
+            async with slots, limiter("vector").slot():
+                return await asyncio.to_thread(query_index, vectors[i], limits[i], True, scopes[i])
+
+        found = dict(zip(missing, await asyncio.gather(*(single(i) for i in missing.values()),
+                                                        return_exceptions=True)))
+
+    fresh = {}
+    for key, chunks in found.items():
+        if isinstance(chunks, BaseException):
+            if not isinstance(chunks, Exception):
+                raise chunks
+            logger.error("Error retrieving chunks: %s", chunks)
+            found[key] = []
+        else:
+            fresh[key] = chunks
+    await retrieval_cache.set_many(list(fresh.items()))
+    return [chunks if chunks is not None else found[key] for key, chunks in zip(keys, results)]
+
+
+async def _prepare_wave(wave: List[BatchChatItem], bypass_cache: bool) -> List[Dict]:
+    """Embeddings, context and prompts for one wave of items"""
+    texts = [item.message for item in wave]
+    try:
+        with span("batch_embed"):
+            vectors = await _with_backoff(lambda: embed_many(texts))
+        with span("batch_retrieval"):
+            chunk_lists = await _with_backoff(lambda: retrieve_many(wave, vectors, CONTEXT_CANDIDATES))
+    except Exception as e:
+        # Same as /chat: without retrieval the question is answered without context
+        logger.error("Error retrieving context for batch: %s", e)
+        vectors, chunk_lists = [None] * len(wave), [[] for _ in wave]
+
+    prepared = []
+    for item, vector, chunks in zip(wave, vectors, chunk_lists):
+        job = {"vector": vector, "prompt": None, "prompt_stats": None, "scope": None, "cached": None}
+        if ANSWER_CACHE_ENABLED and not bypass_cache and vector is not None:
+            job["scope"] = answer_cache.scope_key(item.mode, item.character)
+            job["cached"] = answer_cache.lookup(job["scope"], vector)
+            # Let interactive requests in between lookups
+            await asyncio.sleep(0)
+        prepared.append(job)
+
+    # Prompts only for the misses, packed on a worker thread so a wave
+    # doesn't stall /chat traffic on the event loop
+    misses = [(item, job, chunks) for item, job, chunks in zip(wave, prepared, chunk_lists) if job["cached"] is None]
+    with span("batch_prompt"):
+        await asyncio.to_thread(_compose_prompts, misses)
+    return prepared
+
+
+def _compose_prompts(misses: List) -> None:
+    for item, job, chunks in misses:
+        prompt, passages, stats = compose_prompt(item.message, [], item.mode, item.character, chunks or None, job["vector"])
+        job.update({
+            "prompt": prompt,
+            "confidence": max((c.get("similarity_score", 0.0) for c in chunks), default=0.0),
+            "sources": [
+                {"title": p.document_title, "source": p.page_label, "isWebSource": False} for p in passages
+            ] if chunks else None,
+            "prompt_stats": stats,
+        })
+
+
+async def _with_backoff(call):
+    """Await call(), retrying while a shared stage is full: batch work waits
+    for interactive traffic rather than failing or skipping context"""
+    for attempt in range(BATCH_OVERLOAD_RETRIES):
+        try:
+            return await call()
+        except StageOverloaded:
+            if attempt == BATCH_OVERLOAD_RETRIES - 1:
+                raise
+            await asyncio.sleep(0.5 * 2 ** attempt)
+
+
+def _result(index: int, item: BatchChatItem, job: Dict, response: str, cached: bool = False,
+            error: Optional[str] = None, latency: Optional[float] = None) -> Dict:
+    source = job["cached"] if cached else job
+    return {
+        "index": index,
+        "id": item.id,
+        "response": response,
+        "character": item.character if item.mode == "character" else None,
+        "confidenceScore": source["confidence"],
+        "sources": source["sources"],
+        "promptStats": job["prompt_stats"],
+        "cached": cached,
+        "error": error,
+        "latency_ms": round(latency * 1000, 1) if latency is not None else None,
+    }
+
+
+async def run_batch(items: List[BatchChatItem], concurrency: Optional[int] = None, rate_limit: Optional[float] = None,
+                    bypass_cache: bool = False) -> AsyncIterator[Dict]:
+    """Answer many independent questions, yielding each result as it completes.
+
+    Items are stateless: no session history is read or written. Results come
+    back in completion order and carry their ``index`` (and ``id``); a final
+    ``{"summary": ...}`` record follows the last one. Stopping iteration early
+    cancels the outstanding work.
+    """
+    concurrency = max(1, min(concurrency or BATCH_LLM_CONCURRENCY, limiter("llm").max_concurrency))
+    rate = RateLimiter(BATCH_RATE_LIMIT if rate_limit is None else rate_limit, burst=concurrency)
+    # Bounded, so waves are only prepared a little ahead of the LLM
+    jobs: asyncio.Queue = asyncio.Queue(maxsize=BATCH_ENCODE_SIZE)
+    results: asyncio.Queue = asyncio.Queue()
+    started = time.perf_counter()
+
+    async def produce():
+        try:
+            for start in range(0, len(items), BATCH_ENCODE_SIZE):
+                wave = items[start:start + BATCH_ENCODE_SIZE]
+                for offset, job in enumerate(await _prepare_wave(wave, bypass_cache)):
+                    index = start + offset
+                    if job["cached"] is not None:
+                        await results.put(_result(index, items[index], job, job["cached"]["response"], cached=True))
+                    else:
+                        await jobs.put((index, job))
+        except Exception as e:
+            await results.put(e)  # surfaced to the caller instead of stalling it
+        for _ in range(concurrency):
+            await jobs.put(None)
+
+    async def work():
+        while True:
+            entry = await jobs.get()
+            if entry is None:
+                return
+            index, job = entry
+            await rate.acquire()
+            call_started = time.perf_counter()
+            try:
+                with span("llm"):
+                    # No hedging: a hedge is a second provider call the rate limit didn't pay for
+                    response = await _with_backoff(lambda: generate_async(job["prompt"], hedge=False))
+            except Exception as e:
+                if not isinstance(e, (LLMError, StageOverloaded)):
+                    logger.error("Error answering batch item %d: %s", index, e)
+                await results.put(_result(index, items[index], job, str(e), error=str(e),
+                                          latency=time.perf_counter() - call_started))
+                continue
+            if job["scope"] is not None:
+                answer_cache.store(job["scope"], job["vector"], {
+                    "response": response, "confidence": job["confidence"], "sources": job["sources"],
+                })
+            await results.put(_result(index, items[index], job, response,
+                                      latency=time.perf_counter() - call_started))
+
+    tasks = [asyncio.create_task(produce())] + [asyncio.create_task(work()) for _ in range(concurrency)]
+    counts = {"llm": 0, "cache": 0, "error": 0}
+    try:
+        for _ in range(len(items)):
+            result = await results.get()
+            if isinstance(result, Exception):
+                raise result
+            kind = "error" if result["error"] else "cache" if result["cached"] else "llm"
+            counts[kind] += 1
+            BATCH_ITEMS.inc(kind)
+            yield result
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    elapsed = time.perf_counter() - started
+    yield {"summary": {
+        "items": len(items),
+        "answered": counts["llm"],
+        "cached": counts["cache"],
+        "errors": counts["error"],
+        "concurrency": concurrency,
+        "rate_limit": rate.rate,
+        "rate_limited_s": round(rate.waited, 2),
+        "duration_s": round(elapsed, 2),
+        "items_per_s": round(len(items) / elapsed, 2) if elapsed > 0 else None,
+    }}
+
+
+def read_items(path: str, mode: str, character: Optional[str]) -> List[BatchChatItem]:
+    """Items from a JSONL file of {"message", "mode", "character", "id"}
+    objects, or from plain text with one question per line"""
+    stream = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    items = []
+    with stream:
+        for number, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                record = json.loads(line)
+                record.setdefault("mode", mode)
+                record.setdefault("character", character)
+                record.setdefault("id", str(number))
+                items.append(BatchChatItem(**record))
+            else:
+                items.append(BatchChatItem(message=line, mode=mode, character=character, id=str(number)))
+    return items
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Answer a file of questions in-process and write the results as NDJSON (same records as /chat/batch)")
+    parser.add_argument("input", help="JSONL of {message, mode, character, id} or one question per line; - for stdin")
+    parser.add_argument("-o", "--output", default="-", help="NDJSON output file (default stdout)")
+    parser.add_argument("--mode", default="ai", help="mode for items that don't set one")
+    parser.add_argument("--character", help="character for items that don't set one")
+    parser.add_argument("--concurrency", type=int, default=BATCH_LLM_CONCURRENCY, help="LLM calls in flight")
+    parser.add_argument("--rate-limit", type=float, default=BATCH_RATE_LIMIT, help="LLM calls per second, 0 for no limit")
+    parser.add_argument("--bypass-cache", action="store_true", help="don't answer from the semantic answer cache")
+    args = parser.parse_args()
+
+    configure_logging()
+    items = read_items(args.input, args.mode, args.character)
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        async for result in run_batch(items, args.concurrency, args.rate_limit, args.bypass_cache):
+            if "summary" in result:
+                print(json.dumps(result["summary"]), file=sys.stderr)
+                continue
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,116 @@
+import asyncio
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+
+class EmbeddingBatcher:
+    """Coalesces concurrent encode requests into one forward pass.
+
+    The first queued text opens a batch; the batch is sent to ``encode_fn`` once
+    ``max_batch_size`` texts are collected or ``max_wait_ms`` has passed,
+    whichever comes first. While a batch is being encoded new requests keep
+    queueing, so under load batches grow on their own without extra waiting.
+    """
+
+    def __init__(self, encode_fn: Callable[[List[str]], np.ndarray], executor=None,
+                 max_batch_size: int = 32, max_wait_ms: float = 5.0, stats_window: int = 1000):
+        self.encode_fn = encode_fn
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+        self.batches = 0
+        self.items = 0
+        self.max_seen_batch = 0
+        self._batch_sizes = deque(maxlen=stats_window)
+        self._queue_waits = deque(maxlen=stats_window)
+        self._encode_times = deque(maxlen=stats_window)
+
+    def _ensure_started(self) -> None:
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def encode(self, text: str) -> np.ndarray:
+        """Encode one text, sharing a forward pass with concurrent callers"""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future, time.perf_counter()))
+        return await future
+
+    async def encode_many(self, texts: List[str]) -> List[np.ndarray]:
+        """Encode several texts; they are batched together with everyone else's"""
+        return list(await asyncio.gather(*(self.encode(t) for t in texts)))
+
+    async def _collect(self) -> list:
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # Take whatever is already queued without waiting
+            while len(batch) < self.max_batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            remaining = deadline - time.perf_counter()
+            if len(batch) >= self.max_batch_size or remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            # Callers that gave up (cancelled) don't need encoding
+            batch = [item for item in batch if not item[1].done()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            texts = [text for text, _, _ in batch]
+            try:
+                vectors = await loop.run_in_executor(self.executor, self.encode_fn, texts)
+                if len(vectors) != len(batch):
+                    # Rows can't be matched to texts; fail every caller rather
+                    # than hang the unmatched ones or hand out wrong vectors
+                    raise RuntimeError(f"Encoder returned {len(vectors)} vectors for {len(batch)} texts")
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+
+            for (_, future, _), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(vector)
+
+            self.batches += 1
+            self.items += len(batch)
+            self.max_seen_batch = max(self.max_seen_batch, len(batch))
+            self._batch_sizes.append(len(batch))
+            self._encode_times.append(finished - started)
+            self._queue_waits.extend(started - enqueued for _, _, enqueued in batch)
+
+    def stats(self) -> Dict:
+        waits = np.array(self._queue_waits) * 1000 if self._queue_waits else np.zeros(1)
+        encodes = np.array(self._encode_times) * 1000 if self._encode_times else np.zeros(1)
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "avg_batch_size": float(np.mean(self._batch_sizes)) if self._batch_sizes else 0.0,
+            "max_seen_batch_size": self.max_seen_batch,
+            "queue_wait_ms_p50": float(np.percentile(waits, 50)),
+            "queue_wait_ms_p99": float(np.percentile(waits, 99)),
+            "encode_ms_p50": float(np.percentile(encodes, 50)),
+            "encode_ms_p99": float(np.percentile(encodes, 99)),
+        }
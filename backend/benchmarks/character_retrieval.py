@@ -0,0 +1,106 @@
+"""Character-scoped retrieval: how much of the retrieved context is about the
+persona's character, and what the search costs, with CHARACTER_RETRIEVAL
+off, filter and boost at several top_k.
+
+Builds a synthetic local index whose passages each follow one or two
+characters (tagged with the entity index, as ingestion does) and asks
+persona-style questions for every character in the registry. "on-character"
+is the share of retrieved chunks that mention the character. Run from
+backend/:
+
+    python -m benchmarks.character_retrieval --pages 400 --top-k 4,8,12
+"""
+import argparse
+import random
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+from benchmarks.e2e import EVENTS, NAMES, PLACES, VERBS
+from benchmarks.load_test import percentile
+from characters import character_registry
+from embeddings import get_embedder
+from vector_store import LocalVectorStore, write_local_index
+
+QUESTIONS = [
+    "What did you feel about {event}?",
+    "Tell me about your time in {place}.",
+    "Why did you act as you did during {event}?",
+    "Who did you trust the most?",
+]
+
+
+def character_pages(pages: int, seed: int = 0, chars_per_page: int = 2500) -> List[str]:
+    """Pages that each follow one main character, with others appearing now and then"""
+    rng = random.Random(seed)
+    out = []
+    for _ in range(pages):
+        lead = rng.choice(NAMES)
+        sentences = []
+        while sum(len(s) + 1 for s in sentences) < chars_per_page:
+            other = rng.choice(NAMES) if rng.random() < 0.3 else "the elders"
+            sentences.append(f"{lead} {rng.choice(VERBS)} {rng.choice(EVENTS)} in {rng.choice(PLACES)} with {other}.")
+        out.append(" ".join(sentences))
+    return out
+
+
+def build(pages: List[str], path: Path, embedder) -> None:
+    chunks, metadata = [], []
+    for page_num, text in enumerate(pages, start=1):
+        for start in range(0, len(text), 900):
+            chunk = text[start:start + 1000]
+            metadata.append({"text": chunk, "chunk_id": len(chunks), "page_number": page_num,
+                             "characters": character_registry.mentions(chunk)})
+            chunks.append(chunk)
+    vectors = embedder.encode(chunks, batch_size=64)
+    signatures = {name: character_registry.signature(name) for name in character_registry.profiles()}
+    write_local_index(path, [f"c-{i}" for i in range(len(chunks))], vectors, metadata, entity_signatures=signatures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=400)
+    parser.add_argument("--top-k", default="4,8,12")
+    parser.add_argument("--queries-per-character", type=int, default=20)
+    parser.add_argument("--boost", type=float, default=0.05)
+    parser.add_argument("--embedding-backend", default="hash", help="hash runs offline; torch/onnx use the real model")
+    args = parser.parse_args()
+
+    embedder = get_embedder(args.embedding_backend)
+    workdir = Path(tempfile.mkdtemp(prefix="character-bench-"))
+    try:
+        build(character_pages(args.pages), workdir / "index", embedder)
+        store = LocalVectorStore(workdir / "index")
+        sizes = {name: len(rows) for name, rows in store.entity_rows.items()}
+        print(f"{len(store)} chunks; entity index sizes: " + ", ".join(f"{n} {c}" for n, c in sorted(sizes.items())))
+
+        rng = random.Random(1)
+        queries = []
+        for name in character_registry.profiles():
+            for _ in range(args.queries_per_character):
+                # Persona questions rarely name the character; the persona does
+                queries.append((name, rng.choice(QUESTIONS).format(event=rng.choice(EVENTS), place=rng.choice(PLACES))))
+        vectors = embedder.encode([q for _, q in queries], batch_size=64)
+
+        print(f"\n{'strategy':<8} {'top_k':>5} {'on-character':>13} {'p50 ms':>8} {'p95 ms':>8}")
+        for top_k in [int(k) for k in args.top_k.split(",")]:
+            for strategy, character, boost in (("off", False, 0.0), ("filter", True, 0.0), ("boost", True, args.boost)):
+                on_character, latencies = [], []
+                for (name, _), vector in zip(queries, vectors):
+                    started = time.perf_counter()
+                    matches = store.query(vector, top_k, character=name if character else None, boost=boost)
+                    latencies.append(time.perf_counter() - started)
+                    if matches:
+                        on_character.append(np.mean([name in m["metadata"]["characters"] for m in matches]))
+                print(f"{strategy:<8} {top_k:>5} {np.mean(on_character):>12.1%} "
+                      f"{percentile(latencies, 50) * 1000:>8.2f} {percentile(latencies, 95) * 1000:>8.2f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
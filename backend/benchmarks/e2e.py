@@ -0,0 +1,501 @@
+"""End-to-end benchmark of ingestion and /chat against local stand-ins.
+
+Everything runs on this machine:
+
+- a synthetic corpus, written as a PDF and ingested with chunk_and_ingest.py
+  into a local memory-mapped index (VECTOR_BACKEND=local)
+- stub Together and Cohere servers with configurable latency and token rate
+  (stub_llm.py)
+- Redis at --redis-url if it answers. Otherwise fakeredis's TCP server if it
+  is installed, otherwise no Redis at all, which exercises the local
+  fallbacks.
+- embeddings from --embedding-backend; the default "hash" needs no model
+  download
+
+The API runs in this process under uvicorn, and /chat is driven with a mix
+of repeated, paraphrased, follow-up and in-character questions at each
+concurrency level. Reported per level: throughput, end-to-end
+p50/p95/p99, and the same percentiles per pipeline stage. Results are
+written as JSON (with the git commit) so runs can be compared:
+
+    python -m benchmarks.e2e --levels 1,4,16 --duration 20
+    python -m benchmarks.e2e --levels 1,4,16 --compare data/benchmarks/e2e-<commit>.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from functools import wraps
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+
+from benchmarks.load_test import QUESTIONS, CHARACTERS, percentile
+from benchmarks.stub_llm import serve_in_thread
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_OUT_DIR = BACKEND_DIR / "data" / "benchmarks"
+
+FOLLOW_UPS = [
+    "What happened after that?",
+    "Why did he do that?",
+    "Tell me more about her.",
+    "What did they do next?",
+    "Was that the right thing to do?",
+]
+PARAPHRASE_PREFIXES = ["", "Can you tell me ", "I'd like to know ", "Quick question: ", "Explain "]
+PARAPHRASE_SUFFIXES = ["", " Please explain.", " Briefly.", " In simple words."]
+DEFAULT_MIX = "repeat=0.4,paraphrase=0.3,followup=0.2,character=0.1"
+
+# Synthetic corpus vocabulary: enough structure for chunking, overlap and
+# retrieval to behave like prose
+NAMES = ["Arjuna", "Karna", "Krishna", "Bhishma", "Draupadi", "Yudhishthira", "Duryodhana", "Drona", "Kunti",
+         "Bhima", "Nakula", "Sahadeva", "Gandhari", "Dhritarashtra", "Vidura", "Shakuni", "Abhimanyu"]
+PLACES = ["Hastinapura", "Indraprastha", "Kurukshetra", "the forest of Kamyaka", "Virata's court", "the Ganga",
+          "the palace of lac", "Dvaraka"]
+EVENTS = ["the game of dice", "the exile", "the great war", "the svayamvara", "the burning of Khandava",
+          "the vow of celibacy", "the battle formation", "the coronation"]
+VERBS = ["spoke of", "remembered", "questioned", "argued about", "prepared for", "grieved over", "swore an oath on",
+         "laughed at", "was troubled by"]
+
+
+def synthetic_pages(pages: int, seed: int = 0, chars_per_page: int = 2500) -> List[str]:
+    rng = random.Random(seed)
+    out = []
+    for _ in range(pages):
+        sentences = []
+        while sum(len(s) + 1 for s in sentences) < chars_per_page:
+            sentences.append(
+                f"{rng.choice(NAMES)} {rng.choice(VERBS)} {rng.choice(EVENTS)} in {rng.choice(PLACES)}, "
+                f"and {rng.choice(NAMES)} {rng.choice(VERBS)} it with {rng.choice(NAMES)}."
+            )
+        out.append(" ".join(sentences))
+    return out
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(pages: List[str], path: Path, line_chars: int = 95) -> None:
+    """Write a plain-text PDF (Helvetica, one text block per page)"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_refs = []
+    for text in pages:
+        lines, line = [], ""
+        for word in text.split():
+            if len(line) + len(word) + 1 > line_chars:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}" if line else word
+        lines.append(line)
+        body = "BT /F1 9 Tf 11 TL 40 800 Td " + " ".join(f"({_pdf_escape(l)}) '" for l in lines) + " ET"
+        objects.append(f"<< /Length {len(body.encode('latin-1'))} >>\nstream\n{body}\nendstream")
+        content_ref = len(objects)
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_ref} 0 R >>")
+        page_refs.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{r} 0 R' for r in page_refs)}] /Count {len(page_refs)} >>"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    path.write_bytes(bytes(out))
+
+
+STAGE_LINE = re.compile(r"^\s*(\w+):\s+(\d+) (\w+)\s+([\d.]+)s busy\s+([\d.]+)")
+
+
+def run_ingestion(pdf: Path, workdir: Path, backend: str, label: str) -> Dict:
+    """Run chunk_and_ingest.py into a local index; returns timings and stage throughput"""
+    env = dict(os.environ, LOCAL_INDEX_DIR=str(workdir / "index"))
+    command = [sys.executable, "chunk_and_ingest.py", "--pdf", str(pdf), "--title", "Mahabharata",
+               "--targets", "local", "--manifest", str(workdir / "ingest_manifest.json"),
+               "--embedding-backend", backend]
+    started = time.perf_counter()
+    proc = subprocess.run(command, cwd=BACKEND_DIR, env=env, capture_output=True, text=True)
+    wall = time.perf_counter() - started
+    if proc.returncode != 0:
+        return {"run": label, "ok": False, "error": (proc.stderr or proc.stdout).strip().splitlines()[-1:]}
+    stages = {}
+    for line in proc.stdout.splitlines():
+        match = STAGE_LINE.match(line)
+        if match:
+            stages[match.group(1)] = {"items": int(match.group(2)), "unit": match.group(3),
+                                      "busy_s": float(match.group(4)), "per_s": float(match.group(5))}
+    return {"run": label, "ok": True, "wall_s": wall, "stages": stages}
+
+
+def build_index_directly(pages: List[str], workdir: Path, backend: str) -> None:
+    """Fallback when the ingestion script can't run here (e.g. pdfplumber missing)"""
+    from characters import character_registry
+    from embeddings import get_embedder
+    from vector_store import write_local_index
+
+    chunks, metadata = [], []
+    for page_num, text in enumerate(pages, start=1):
+        for start in range(0, len(text), 900):
+            chunk = text[start:start + 1000]
+            metadata.append({"text": chunk, "summary": chunk[:200], "chunk_id": len(chunks), "doc_id": "synthetic",
+                             "page_number": page_num, "document_title": "Mahabharata", "source": "Mahabharata",
+                             "characters": character_registry.mentions(chunk)})
+            chunks.append(chunk)
+    vectors = get_embedder(backend).encode(chunks, batch_size=64)
+    signatures = {name: character_registry.signature(name) for name in character_registry.profiles()}
+    write_local_index(workdir / "index", [f"c-{i}" for i in range(len(chunks))], vectors, metadata,
+                      entity_signatures=signatures)
+
+
+def redis_reachable(url: str) -> bool:
+    import redis
+    try:
+        return bool(redis.Redis.from_url(url, socket_connect_timeout=0.5).ping())
+    except Exception:
+        return False
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_redis(url: str):
+    """Returns (REDIS_URL to use, description)"""
+    if redis_reachable(url):
+        return url, f"redis at {url}"
+    try:
+        from fakeredis import TcpFakeServer
+    except ImportError:
+        return "redis://127.0.0.1:1/0", "none (local fallbacks)"
+    port = free_port()
+    server = TcpFakeServer(("127.0.0.1", port))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"redis://127.0.0.1:{port}/0", "fakeredis"
+
+
+class StageTimer:
+    """Wraps pipeline functions and records how long each call took"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def reset(self) -> None:
+        self.samples = defaultdict(list)
+
+    def wrap(self, module, name: str, stage: str) -> None:
+        fn = getattr(module, name)
+        samples = lambda: self.samples[stage]
+
+        if asyncio.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    samples().append(time.perf_counter() - start)
+        else:
+            @wraps(fn)
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    samples().append(time.perf_counter() - start)
+        setattr(module, name, timed)
+
+    def summary(self) -> Dict:
+        return {stage: latency_summary(values) for stage, values in sorted(self.samples.items())}
+
+
+def latency_summary(values: List[float]) -> Dict:
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+    }
+
+
+def instrument(timer: StageTimer) -> None:
+    import main
+    import rag
+
+    timer.wrap(main, "get_history_async", "history_read")
+    timer.wrap(main, "retrieve_with_vector_async", "retrieval")
+    timer.wrap(rag, "embed_query_async", "embed")
+    timer.wrap(rag, "query_index", "vector_search")
+    timer.wrap(main, "compose_prompt", "prompt")
+    timer.wrap(main, "generate_async", "llm")
+    timer.wrap(main, "add_to_history_async", "history_write")
+
+
+def use_stub_http_providers(together_url: str, cohere_url: str) -> None:
+    """Stand-ins for the SDK-backed providers when together/cohere aren't
+    installed: same routing, breaker and stats, plain httpx to the stubs"""
+    import llm
+    from resources import Component
+
+    class StubTogether(llm.LLMProvider):
+        name, display_name = "together", "Together"
+
+        async def _generate(self, prompt: str) -> str:
+            response = await self.client.post("/chat/completions", json={
+                "model": llm.TOGETHER_MODEL, "messages": [{"role": "user", "content": prompt}],
+                "max_tokens": llm.MAX_TOKENS})
+            response.raise_for_status()
+            return response.json()["choices"][0]["message"]["content"]
+
+    class StubCohere(llm.LLMProvider):
+        name, display_name = "cohere", "Cohere"
+
+        async def _generate(self, prompt: str) -> str:
+            response = await self.client.post("/v1/generate", json={"model": llm.COHERE_MODEL, "prompt": prompt})
+            response.raise_for_status()
+            return response.json()["generations"][0]["text"]
+
+    def client(base_url):
+        return Component(f"stub:{base_url}", lambda: httpx.AsyncClient(base_url=base_url, timeout=60))
+
+    llm.PROVIDERS[:] = [
+        StubTogether(client(together_url), "TOGETHER_API_KEY", True, timeout=llm.together_provider.timeout),
+        StubCohere(client(cohere_url), "COHERE_API_KEY", True, timeout=llm.cohere_provider.timeout),
+    ]
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {kind: float(weight) for kind, weight in (part.split("=") for part in spec.split(",") if part)}
+    unknown = set(mix) - {"repeat", "paraphrase", "followup", "character"}
+    if unknown:
+        raise ValueError(f"Unknown query kinds: {', '.join(sorted(unknown))}")
+    return mix
+
+
+class VirtualUser:
+    """One chat user: keeps a session for a few turns, then starts a new one"""
+
+    def __init__(self, rng: random.Random, mix: Dict[str, float]):
+        self.rng = rng
+        self.kinds, self.weights = zip(*mix.items())
+        self.session_id = None
+        self.turns_left = 0
+        self.turns_taken = 0
+        self.character = None
+
+    def next_request(self) -> Dict:
+        if self.turns_left <= 0:
+            self.session_id = str(uuid.uuid4())
+            self.turns_left = self.rng.randint(1, 6)
+            self.turns_taken = 0
+            self.character = None
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        if kind == "followup" and self.turns_taken == 0:
+            kind = "repeat"  # nothing to follow up on yet
+        self.turns_left -= 1
+        self.turns_taken += 1
+        question = self.rng.choice(QUESTIONS)
+        if kind == "paraphrase":
+            question = (self.rng.choice(PARAPHRASE_PREFIXES)
+                        + (question[0].lower() + question[1:] if question else question)
+                        + self.rng.choice(PARAPHRASE_SUFFIXES)).strip()
+        elif kind == "followup":
+            question = self.rng.choice(FOLLOW_UPS)
+        elif kind == "character":
+            self.character = self.character or self.rng.choice(CHARACTERS)
+        request = {"message": question, "mode": "ai", "session_id": self.session_id}
+        if self.character:
+            request.update(mode="character", character=self.character)
+        return request
+
+
+async def run_level(url: str, concurrency: int, duration: float, mix: Dict[str, float], timer: StageTimer,
+                    seed: int) -> Dict:
+    timer.reset()
+    latencies, statuses = [], defaultdict(int)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async def user_loop(user: VirtualUser, client: httpx.AsyncClient, deadline: float):
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                status = (await client.post("/chat", json=user.next_request())).status_code
+            except httpx.HTTPError:
+                status = "error"
+            statuses[str(status)] += 1
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+
+    async with httpx.AsyncClient(base_url=url, timeout=120, limits=limits) as client:
+        started = time.perf_counter()
+        deadline = started + duration
+        await asyncio.gather(*(user_loop(VirtualUser(random.Random(seed + i), mix), client, deadline)
+                               for i in range(concurrency)))
+        wall = time.perf_counter() - started
+        server_stats = (await client.get("/stats")).json()
+
+    return {
+        "concurrency": concurrency,
+        "duration_s": wall,
+        "requests": sum(statuses.values()),
+        "ok": len(latencies),
+        "statuses": dict(statuses),
+        "rps": len(latencies) / wall if wall else 0.0,
+        "latency": latency_summary(latencies),
+        "stages": timer.summary(),
+        "server": {key: server_stats.get(key) for key in ("caches", "prompt", "llm", "history")},
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def print_level(row: Dict) -> None:
+    lat = row["latency"]
+    print(f"\n{row['concurrency']} clients: {row['ok']} ok of {row['requests']} ({row['statuses']}), "
+          f"{row['rps']:.1f} req/s, p50 {lat['p50_ms']:.0f} ms  p95 {lat['p95_ms']:.0f} ms  p99 {lat['p99_ms']:.0f} ms")
+    for stage, s in row["stages"].items():
+        print(f"    {stage:<14} {s['count']:>7}  p50 {s['p50_ms']:8.1f}  p95 {s['p95_ms']:8.1f}  p99 {s['p99_ms']:8.1f} ms")
+
+
+def compare(current: Dict, baseline_path: Path) -> None:
+    baseline = json.loads(baseline_path.read_text())
+    old = {row["concurrency"]: row for row in baseline.get("chat", [])}
+    print(f"\nvs {baseline_path.name} (commit {baseline.get('commit')}):")
+    for row in current["chat"]:
+        before = old.get(row["concurrency"])
+        if not before:
+            continue
+        def delta(new, prev):
+            return f"{(new - prev) / prev * 100:+.0f}%" if prev else "n/a"
+        print(f"  {row['concurrency']:>4} clients: req/s {before['rps']:.1f} -> {row['rps']:.1f} ({delta(row['rps'], before['rps'])}), "
+              f"p95 {before['latency']['p95_ms']:.0f} -> {row['latency']['p95_ms']:.0f} ms "
+              f"({delta(row['latency']['p95_ms'], before['latency']['p95_ms'])})")
+
+
+async def bench_chat(args, url: str, timer: StageTimer) -> List[Dict]:
+    rows = []
+    for level in (int(x) for x in args.levels.split(",") if x):
+        row = await run_level(url, level, args.duration, parse_mix(args.mix), timer, args.seed)
+        print_level(row)
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", default="1,4,16", help="comma separated client counts")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per level")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weights of repeat/paraphrase/followup/character queries")
+    parser.add_argument("--pages", type=int, default=200, help="pages in the synthetic corpus")
+    parser.add_argument("--embedding-backend", default="hash", choices=["hash", "torch", "onnx", "onnx-int8"])
+    parser.add_argument("--skip-ingestion", action="store_true", help="build the index directly instead")
+    parser.add_argument("--redis-url", default="redis://127.0.0.1:6379/15")
+    parser.add_argument("--llm-ttft", type=float, default=0.3, help="stub LLM seconds to first token")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=60.0)
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0, help="fraction of primary LLM calls failing")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="results file (default data/benchmarks/e2e-<commit>-<time>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="e2e-bench-"))
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": {"platform": platform.platform(), "cpus": os.cpu_count()},
+        "args": vars(args),
+    }
+
+    # Corpus and ingestion
+    pages = synthetic_pages(args.pages, args.seed)
+    os.environ["EMBEDDING_BACKEND"] = args.embedding_backend
+    ingestion = []
+    if not args.skip_ingestion:
+        pdf = workdir / "mahabharata.pdf"
+        write_pdf(pages, pdf)
+        ingestion.append(run_ingestion(pdf, workdir, args.embedding_backend, "full"))
+        if ingestion[-1]["ok"]:
+            ingestion.append(run_ingestion(pdf, workdir, args.embedding_backend, "unchanged re-run"))
+        for run in ingestion:
+            print(f"ingestion ({run['run']}): " + (f"{run['wall_s']:.1f} s, " + ", ".join(
+                f"{name} {s['per_s']:.0f} {s['unit']}/s" for name, s in run["stages"].items())
+                if run["ok"] else f"failed: {run['error']}"))
+    if not (workdir / "index" / "manifest.json").exists():
+        print("Building the local index directly")
+        build_index_directly(pages, workdir, args.embedding_backend)
+    results["ingestion"] = ingestion
+
+    # Services
+    together_port, cohere_port, api_port = free_port(), free_port(), free_port()
+    behavior = {"ttft": args.llm_ttft, "tokens_per_second": args.llm_tokens_per_second, "jitter": 0.2}
+    from benchmarks.stub_llm import StubBehavior
+    serve_in_thread("together", together_port, StubBehavior(failure_rate=args.llm_failure_rate, **behavior))
+    serve_in_thread("cohere", cohere_port, StubBehavior(**behavior))
+    redis_url, redis_description = start_redis(args.redis_url)
+    print(f"Redis: {redis_description}")
+    os.environ.update({
+        "VECTOR_BACKEND": "local",
+        "LOCAL_INDEX_DIR": str(workdir / "index"),
+        "REDIS_URL": redis_url,
+        "TOGETHER_API_KEY": "stub", "COHERE_API_KEY": "stub",
+        "TOGETHER_BASE_URL": f"http://127.0.0.1:{together_port}/v1",
+        "COHERE_BASE_URL": f"http://127.0.0.1:{cohere_port}",
+        "STARTUP_WARMUP": "blocking",
+    })
+    results["services"] = {"redis": redis_description, "llm_stub": behavior, "embedding_backend": args.embedding_backend}
+
+    import llm
+    if not (llm.TOGETHER_AVAILABLE and llm.COHERE_AVAILABLE):
+        print("together/cohere SDKs not installed: using plain HTTP providers against the stubs")
+        use_stub_http_providers(f"http://127.0.0.1:{together_port}/v1", f"http://127.0.0.1:{cohere_port}")
+        results["services"]["llm_client"] = "httpx"
+    timer = StageTimer()
+    instrument(timer)
+
+    import uvicorn
+    import main as api
+    server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=api_port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+    results["chat"] = asyncio.run(bench_chat(args, f"http://127.0.0.1:{api_port}", timer))
+    server.should_exit = True
+
+    out = Path(args.out) if args.out else DEFAULT_OUT_DIR / f"e2e-{results['commit']}-{int(time.time())}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(results, indent=2))
+    print(f"\nResults written to {out}")
+    if args.compare:
+        compare(results, Path(args.compare))
+
+
+if __name__ == "__main__":
+    main()
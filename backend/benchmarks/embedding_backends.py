@@ -0,0 +1,48 @@
+"""Latency and throughput of each embedding backend on CPU.
+
+Measures single-query latency (batch of 1, as on the /chat path) and bulk
+throughput (as during ingestion) for every backend. Run from backend/:
+
+    python -m benchmarks.embedding_backends --backends torch,onnx,onnx-int8 --threads 4
+"""
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.embedding_parity import BUILTIN_PASSAGES, BUILTIN_QUERIES
+from embeddings import get_embedder
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", default="torch,onnx,onnx-int8")
+    parser.add_argument("--threads", type=int, default=None, help="intra-op threads per backend")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--bulk", type=int, default=1024, help="passages encoded for the throughput run")
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    passages = (BUILTIN_PASSAGES * (args.bulk // len(BUILTIN_PASSAGES) + 1))[:args.bulk]
+    print(f"{'backend':>10} {'p50 ms':>8} {'p95 ms':>8} {'q/s (b=1)':>10} {'passages/s':>11}")
+    for backend in args.backends.split(","):
+        embedder = get_embedder(backend, threads=args.threads)
+        embedder.encode(BUILTIN_QUERIES)  # warm-up
+
+        latencies = []
+        for i in range(args.queries):
+            start = time.perf_counter()
+            embedder.encode([BUILTIN_QUERIES[i % len(BUILTIN_QUERIES)]])
+            latencies.append(time.perf_counter() - start)
+        ms = np.array(latencies) * 1000
+
+        start = time.perf_counter()
+        embedder.encode(passages, batch_size=args.batch_size)
+        bulk_rate = len(passages) / (time.perf_counter() - start)
+
+        print(f"{backend:>10} {np.percentile(ms, 50):>8.2f} {np.percentile(ms, 95):>8.2f} "
+              f"{1000 / ms.mean():>10.1f} {bulk_rate:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
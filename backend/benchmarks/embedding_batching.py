@@ -0,0 +1,71 @@
+"""Query-embedding throughput with and without cross-request micro-batching.
+
+Simulates N concurrent chat sessions, each encoding a stream of queries, first
+with one forward pass per query (the old path) and then through
+EmbeddingBatcher. Reports embeddings/s and per-query latency. Run from backend/:
+
+    python -m benchmarks.embedding_batching --sessions 50 --queries 20
+"""
+import argparse
+import asyncio
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from batcher import EmbeddingBatcher
+from embeddings import get_embedder
+from benchmarks.load_test import QUESTIONS
+
+
+async def run_sessions(encode_one, sessions: int, queries: int):
+    latencies = []
+
+    async def session():
+        for _ in range(queries):
+            text = random.choice(QUESTIONS) + f" ({random.randint(0, 10**6)})"
+            start = time.perf_counter()
+            await encode_one(text)
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(session() for _ in range(sessions)))
+    wall = time.perf_counter() - started
+    ms = np.array(latencies) * 1000
+    return len(latencies) / wall, np.percentile(ms, 50), np.percentile(ms, 99)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default=None, help="torch, onnx or onnx-int8 (default: EMBEDDING_BACKEND)")
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=20, help="queries per session")
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--window-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    model = get_embedder(args.backend)
+    model.encode(["warm up"])
+    executor = ThreadPoolExecutor(max_workers=1)
+    loop = asyncio.get_running_loop()
+
+    async def unbatched(text):
+        return await loop.run_in_executor(executor, lambda: model.encode([text])[0])
+
+    batcher = EmbeddingBatcher(lambda texts: model.encode(texts, batch_size=len(texts)), executor=executor,
+                               max_batch_size=args.max_batch, max_wait_ms=args.window_ms)
+
+    print(f"{args.sessions} sessions x {args.queries} queries")
+    print(f"{'mode':>10} {'emb/s':>8} {'p50 ms':>9} {'p99 ms':>9}")
+    for name, fn in (("batch=1", unbatched), ("batched", batcher.encode)):
+        rate, p50, p99 = await run_sessions(fn, args.sessions, args.queries)
+        print(f"{name:>10} {rate:>8.1f} {p50:>9.1f} {p99:>9.1f}")
+
+    stats = batcher.stats()
+    print(f"avg batch {stats['avg_batch_size']:.1f}, max batch {stats['max_seen_batch_size']}, "
+          f"queue wait p99 {stats['queue_wait_ms_p99']:.1f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
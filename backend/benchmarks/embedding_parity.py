@@ -0,0 +1,118 @@
+"""Parity check of an optimized embedding backend against the PyTorch model.
+
+Encodes the same passages and queries with both backends and checks
+  - cosine agreement between corresponding vectors, and
+  - overlap of the top-k passages retrieved for each query.
+Exits non-zero when either falls below its threshold, so it can gate a
+backend switch in CI (tests/test_embedding_parity.py runs the same check
+on the built-in set). Passages come from a local index if one exists,
+otherwise from a small built-in set. Run from backend/:
+
+    python -m benchmarks.embedding_parity --backend onnx-int8
+"""
+import argparse
+import sys
+from typing import Dict, List
+
+import numpy as np
+
+from embeddings import get_embedder
+from vector_store import DEFAULT_LOCAL_INDEX_DIR, normalize_rows
+
+BUILTIN_PASSAGES = [
+    "Karna was the son of Kunti and the sun god Surya, raised by the charioteer Adhiratha.",
+    "Bhishma vowed lifelong celibacy so that his father Shantanu could marry Satyavati.",
+    "At Kurukshetra Arjuna laid down his bow, and Krishna answered him with the Bhagavad Gita.",
+    "Draupadi was won by Arjuna at her swayamvara and became the wife of all five Pandavas.",
+    "Yudhishthira lost his kingdom, his brothers and Draupadi in the game of dice with Shakuni.",
+    "Drona taught archery to the Kuru princes and asked Ekalavya for his thumb as fee.",
+    "Duryodhana refused to give the Pandavas even five villages, and war became inevitable.",
+    "Abhimanyu entered the chakravyuha formation but did not know how to come out of it.",
+    "Bhima killed Duryodhana with a blow of his mace to the thigh on the last day of the war.",
+    "Gandhari blindfolded herself for life when she married the blind king Dhritarashtra.",
+    "The Pandavas spent their thirteenth year of exile in disguise at the court of King Virata.",
+    "Ashwatthama attacked the sleeping Pandava camp at night after the war had ended.",
+]
+BUILTIN_QUERIES = [
+    "Who was Karna's father?",
+    "What vow did Bhishma take?",
+    "Why did Arjuna refuse to fight?",
+    "How did Draupadi marry the Pandavas?",
+    "What happened in the game of dice?",
+    "Who taught archery to the princes?",
+    "Where did the Pandavas hide in their last year of exile?",
+    "What did Ashwatthama do after the war?",
+]
+
+
+def load_passages(limit: int):
+    try:
+        from vector_store import LocalVectorStore
+
+        store = LocalVectorStore(DEFAULT_LOCAL_INDEX_DIR)
+        passages = [m["text"] for m in store.metadata[:limit] if m and m.get("text")]
+        if passages:
+            return passages
+    except Exception:
+        pass
+    return BUILTIN_PASSAGES
+
+
+def compare(reference, candidate, passages, queries, top_k: int = 5) -> Dict:
+    """Per-vector cosines and mean top-k retrieval overlap of two embedders"""
+    ref_p = normalize_rows(reference.encode(passages))
+    ref_q = normalize_rows(reference.encode(queries))
+    cand_p = normalize_rows(candidate.encode(passages))
+    cand_q = normalize_rows(candidate.encode(queries))
+
+    cosines = np.concatenate([(ref_p * cand_p).sum(axis=1), (ref_q * cand_q).sum(axis=1)])
+    k = min(top_k, len(passages))
+    ref_top = np.argsort(-(ref_q @ ref_p.T), axis=1)[:, :k]
+    cand_top = np.argsort(-(cand_q @ cand_p.T), axis=1)[:, :k]
+    overlap = float(np.mean([len(set(a) & set(b)) / k for a, b in zip(ref_top, cand_top)]))
+    return {"cosines": cosines, "overlap": overlap, "k": k}
+
+
+def parity_failures(result: Dict, min_cosine: float = 0.98, min_mean_cosine: float = 0.99,
+                    min_overlap: float = 0.9) -> List[str]:
+    cosines, overlap, k = result["cosines"], result["overlap"], result["k"]
+    failures = []
+    if cosines.min() < min_cosine:
+        failures.append(f"min cosine {cosines.min():.4f} < {min_cosine}")
+    if cosines.mean() < min_mean_cosine:
+        failures.append(f"mean cosine {cosines.mean():.4f} < {min_mean_cosine}")
+    if overlap < min_overlap:
+        failures.append(f"top-{k} overlap {overlap:.3f} < {min_overlap}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", default="onnx-int8", help="backend to compare with torch")
+    parser.add_argument("--passages", type=int, default=2000, help="max passages taken from the local index")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--min-cosine", type=float, default=0.98, help="minimum per-vector cosine")
+    parser.add_argument("--min-mean-cosine", type=float, default=0.99)
+    parser.add_argument("--min-overlap", type=float, default=0.9, help="minimum mean top-k overlap")
+    args = parser.parse_args()
+
+    passages = load_passages(args.passages)
+    queries = BUILTIN_QUERIES
+    reference = get_embedder("torch")
+    candidate = get_embedder(args.backend)
+    result = compare(reference, candidate, passages, queries, args.top_k)
+    cosines = result["cosines"]
+
+    print(f"{candidate.name} vs {reference.name} on {len(passages)} passages, {len(queries)} queries")
+    print(f"cosine: mean {cosines.mean():.5f}, min {cosines.min():.5f}")
+    print(f"top-{result['k']} overlap: {result['overlap']:.3f}")
+
+    failures = parity_failures(result, args.min_cosine, args.min_mean_cosine, args.min_overlap)
+    if failures:
+        print("FAIL: " + "; ".join(failures))
+        sys.exit(1)
+    print("PASS")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Per-turn session history overhead: the original sync helpers vs HistoryStore.
+
+A turn is one history read followed by storing the user message and the
+answer. The original helpers do that in five blocking Redis calls (lrange,
+then rpush + ltrim per message); HistoryStore does one pipelined read and one
+pipelined write. Also reports how large the history handed to compose_prompt
+grows over a long session with and without rolling summarization. Needs a
+running Redis (keys are written under history:bench-*). Run from backend/:
+
+    python -m benchmarks.history --redis-url redis://localhost:6379/0 --turns 500
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+import redis
+import redis.asyncio as aioredis
+
+from benchmarks.load_test import QUESTIONS, percentile
+from history_store import HistoryStore, SUMMARY_PREFIX, estimate_tokens
+
+ANSWER = ("Karna was the son of Kunti and the sun god Surya, born before her marriage to Pandu. "
+          "Raised by the charioteer Adhiratha, he became Duryodhana's closest friend. ") * 3
+
+
+def legacy_turn(client: redis.Redis, session_id: str, message: str):
+    # Same calls as the removed utils.get_history / add_to_history helpers
+    key = f"history:{session_id}"
+    history = [h.decode() for h in client.lrange(key, -10, -1)]
+    for entry in (f"User: {message}", f"Bot: {ANSWER}"):
+        client.rpush(key, entry)
+        client.ltrim(key, -50, -1)
+    return history
+
+
+async def store_turn(store: HistoryStore, session_id: str, message: str):
+    history = await store.get(session_id)
+    await store.append(session_id, f"User: {message}", f"Bot: {ANSWER}")
+    return history
+
+
+def prompt_history_tokens(history) -> int:
+    """Tokens of the history compose_prompt includes: any summary plus the last five messages"""
+    summary = history[:1] if history and history[0].startswith(SUMMARY_PREFIX) else []
+    return sum(estimate_tokens(h) for h in summary + history[len(summary):][-5:])
+
+
+def report(name: str, latencies, prompt_tokens):
+    print(f"{name:<28} p50 {percentile(latencies, 50) * 1000:7.2f} ms  p95 {percentile(latencies, 95) * 1000:7.2f} ms  "
+          f"p99 {percentile(latencies, 99) * 1000:7.2f} ms  history tokens at end {prompt_tokens}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--redis-url", default="redis://localhost:6379/0")
+    parser.add_argument("--turns", type=int, default=500)
+    parser.add_argument("--session-turns", type=int, default=50, help="turns per session before starting a new one")
+    args = parser.parse_args()
+
+    sync_client = redis.Redis.from_url(args.redis_url)
+    async_client = aioredis.Redis.from_url(args.redis_url)
+    prefix = f"bench-{uuid.uuid4().hex[:8]}"
+    keys = set()
+
+    def session(kind: str, i: int) -> str:
+        sid = f"{prefix}-{kind}-{i // args.session_turns}"
+        keys.update([f"history:{sid}", f"history:{sid}:summary", f"history:{sid}:lock"])
+        return sid
+
+    latencies, history = [], []
+    for i in range(args.turns):
+        start = time.perf_counter()
+        history = legacy_turn(sync_client, session("legacy", i), QUESTIONS[i % len(QUESTIONS)])
+        latencies.append(time.perf_counter() - start)
+    report("original (5 sync calls)", latencies, prompt_history_tokens(history))
+
+    for name, summarize in (("HistoryStore", False), ("HistoryStore + summaries", True)):
+        store = HistoryStore(async_client, summarize=summarize)
+        latencies = []
+        for i in range(args.turns):
+            start = time.perf_counter()
+            history = await store_turn(store, session(f"store{int(summarize)}", i), QUESTIONS[i % len(QUESTIONS)])
+            latencies.append(time.perf_counter() - start)
+        await asyncio.gather(*store._tasks)
+        report(f"{name} (2 pipelined)", latencies, prompt_history_tokens(history))
+        if store.stats()["redis_errors"]:
+            print(f"  warning: {store.stats()['redis_errors']} Redis errors, results include the local fallback")
+
+    keys = sorted(keys)
+    for start in range(0, len(keys), 500):
+        sync_client.delete(*keys[start:start + 500])
+    await async_client.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
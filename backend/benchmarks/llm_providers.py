@@ -0,0 +1,114 @@
+"""LLM provider routing under healthy, slow-tail, failing and hanging providers.
+
+Starts local Together and Cohere stubs (see stub_llm.py), points the real SDK
+clients at them and sends requests through llm.generate_async, reporting
+latency percentiles, errors and each provider's counters per scenario. Run
+from the backend directory (needs the together and cohere SDKs installed):
+
+    python -m benchmarks.llm_providers --requests 200 --concurrency 8
+"""
+import argparse
+import asyncio
+import os
+import time
+from typing import Dict, List
+
+import httpx
+
+from benchmarks.load_test import percentile
+from benchmarks.stub_llm import serve_in_thread
+
+# name, Together behaviour, Cohere behaviour, hedging
+SCENARIOS = [
+    ("healthy", {}, {}, False),
+    ("slow tail", {"slow_rate": 0.1, "slow_factor": 15}, {}, False),
+    ("slow tail + hedging", {"slow_rate": 0.1, "slow_factor": 15}, {}, True),
+    ("primary failing", {"failure_rate": 1.0}, {}, False),
+    ("primary hanging", {"ttft": 120.0}, {}, False),
+]
+BASELINE = {"ttft": 0.2, "tokens_per_second": 400.0, "failure_rate": 0.0, "jitter": 0.2, "slow_rate": 0.0,
+            "slow_factor": 10.0}
+
+
+async def run_scenario(llm, requests: int, concurrency: int) -> Dict:
+    latencies: List[float] = []
+    errors = 0
+    queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(i)
+
+    async def worker():
+        nonlocal errors
+        while not queue.empty():
+            queue.get_nowait()
+            start = time.perf_counter()
+            try:
+                await llm.generate_async("Why did Arjuna refuse to fight?")
+                latencies.append(time.perf_counter() - start)
+            except llm.LLMError:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+    return {
+        "ok": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / wall if wall else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--together-port", type=int, default=9001)
+    parser.add_argument("--cohere-port", type=int, default=9002)
+    parser.add_argument("--timeout", type=float, default=5.0, help="per-provider timeout")
+    args = parser.parse_args()
+
+    serve_in_thread("together", args.together_port)
+    serve_in_thread("cohere", args.cohere_port)
+    # Must be set before llm is imported: clients and timeouts are configured from env
+    os.environ.update({
+        "TOGETHER_API_KEY": "stub", "COHERE_API_KEY": "stub",
+        "TOGETHER_BASE_URL": f"http://127.0.0.1:{args.together_port}/v1",
+        "COHERE_BASE_URL": f"http://127.0.0.1:{args.cohere_port}",
+        "TOGETHER_TIMEOUT": str(args.timeout), "COHERE_TIMEOUT": str(args.timeout),
+    })
+    import llm
+
+    print(f"{'scenario':<22} {'ok':>5} {'err':>4} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+          f"  together (ok/fail/timeout/skipped)  cohere ok  hedges won")
+    async with httpx.AsyncClient() as control:
+        for name, together_behavior, cohere_behavior, hedging in SCENARIOS:
+            await control.post(f"http://127.0.0.1:{args.together_port}/_control", json={**BASELINE, **together_behavior})
+            await control.post(f"http://127.0.0.1:{args.cohere_port}/_control", json={**BASELINE, **cohere_behavior})
+            llm.HEDGING_ENABLED = hedging
+            for provider in llm.PROVIDERS:
+                provider.breaker = llm.CircuitBreaker(provider.breaker.failure_threshold, provider.breaker.reset_timeout)
+                provider.stats = llm.ProviderStats()
+            if hedging:
+                # Hedge deadlines come from observed latency, so seed it outside
+                # the measurement and keep only the latency window
+                await run_scenario(llm, llm.HEDGE_MIN_SAMPLES * 2, args.concurrency)
+                for provider in llm.PROVIDERS:
+                    seeded, provider.stats = provider.stats, llm.ProviderStats()
+                    provider.stats._latencies = seeded._latencies
+
+            row = await run_scenario(llm, args.requests, args.concurrency)
+            together = llm.together_provider.stats
+            cohere = llm.cohere_provider.stats
+            print(
+                f"{name:<22} {row['ok']:>5} {row['errors']:>4} {row['rps']:>7.1f} {row['p50_ms']:>8.0f} "
+                f"{row['p95_ms']:>8.0f} {row['p99_ms']:>8.0f}  "
+                f"{together.successes:>8}/{together.failures}/{together.timeouts}/{together.rejected:<14} "
+                f"{cohere.successes:>9}  {cohere.hedges_won:>10}"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,108 @@
+"""Closed-loop load test for the /chat endpoint.
+
+Runs N concurrent clients against a running API for a fixed duration at each
+concurrency level and reports requests/s, latency percentiles and how many
+requests were shed with a 429. Run from the backend directory:
+
+    python -m benchmarks.load_test --url http://localhost:8000 --levels 1,2,4,8,16,32
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from typing import Dict, List
+
+import httpx
+
+QUESTIONS = [
+    "Who was Karna's father?",
+    "What is dharma?",
+    "Why did Arjuna refuse to fight at Kurukshetra?",
+    "How did Draupadi marry the five Pandavas?",
+    "What vow did Bhishma take?",
+    "Who taught archery to the Kuru princes?",
+    "What happened in the game of dice?",
+    "Why did Yudhishthira go to the forest?",
+]
+CHARACTERS = ["Karna", "Krishna", "Arjuna", "Draupadi", "Bhishma"]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[rank]
+
+
+def random_request() -> Dict:
+    if random.random() < 0.5:
+        return {"message": random.choice(QUESTIONS), "mode": "ai", "session_id": str(uuid.uuid4())}
+    return {
+        "message": random.choice(QUESTIONS),
+        "mode": "character",
+        "character": random.choice(CHARACTERS),
+        "session_id": str(uuid.uuid4()),
+    }
+
+
+async def client_loop(client: httpx.AsyncClient, path: str, deadline: float, results: Dict):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            resp = await client.post(path, json=random_request())
+            status = resp.status_code
+        except httpx.HTTPError:
+            status = None
+        elapsed = time.perf_counter() - start
+        if status == 200:
+            results["latencies"].append(elapsed)
+        elif status == 429:
+            results["shed"] += 1
+        else:
+            results["errors"] += 1
+
+
+async def run_level(url: str, path: str, concurrency: int, duration: float, timeout: float) -> Dict:
+    results = {"latencies": [], "shed": 0, "errors": 0}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        started = time.perf_counter()
+        deadline = started + duration
+        await asyncio.gather(*(client_loop(client, path, deadline, results) for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+
+    latencies = results["latencies"]
+    return {
+        "concurrency": concurrency,
+        "ok": len(latencies),
+        "shed": results["shed"],
+        "errors": results["errors"],
+        "rps": len(latencies) / wall if wall else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--path", default="/chat")
+    parser.add_argument("--levels", default="1,2,4,8,16,32", help="comma separated client counts")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per level")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    print(f"{'clients':>8} {'ok':>6} {'429':>5} {'err':>5} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for level in (int(x) for x in args.levels.split(",") if x):
+        row = await run_level(args.url, args.path, level, args.duration, args.timeout)
+        print(
+            f"{row['concurrency']:>8} {row['ok']:>6} {row['shed']:>5} {row['errors']:>5} "
+            f"{row['rps']:>8.2f} {row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
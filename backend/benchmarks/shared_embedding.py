@@ -0,0 +1,150 @@
+"""Memory and throughput of N API workers with their own embedding model versus
+the same workers sharing one embedding_server.py process.
+
+Each worker is a separate process that encodes queries the way rag.py does
+(concurrent sessions through an EmbeddingBatcher), either with a model it
+loaded itself or through a RemoteEmbedder. Reported per mode: total
+proportional set size (PSS, so pages shared between processes are counted
+once) of the workers plus the server, embeddings/s across all workers,
+per-query latency and the server's average batch size. Run from backend/:
+
+    python -m benchmarks.shared_embedding --embedding-backend onnx --workers 4 --duration 20
+
+The "hash" backend runs offline and shows the IPC overhead only; the memory
+and oversubscription effects need a real model (torch, onnx, onnx-int8).
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from benchmarks.load_test import QUESTIONS, percentile
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def pss_mib(pid: int) -> float:
+    """Proportional set size of a process (RSS where smaps_rollup is missing)"""
+    for path, field in ((f"/proc/{pid}/smaps_rollup", "Pss:"), (f"/proc/{pid}/status", "VmRSS:")):
+        try:
+            with open(path) as f:
+                for line in f:
+                    if line.startswith(field):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+    return 0.0
+
+
+def worker(mode: str, backend: str, threads, socket_path: str, sessions: int, duration: float, start, results):
+    from batcher import EmbeddingBatcher
+
+    if mode == "shared":
+        from embedding_server import RemoteEmbedder
+        embedder = RemoteEmbedder(socket_path)
+    else:
+        from embeddings import get_embedder
+        embedder = get_embedder(backend, threads=threads)
+    embedder.encode(["query: warm up"], batch_size=1)
+    results.put(("ready", os.getpid()))
+    start.wait()
+
+    async def run():
+        # As in rag.py: one encode thread, batches of up to 32 within 5 ms
+        batcher = EmbeddingBatcher(lambda texts: embedder.encode(texts, batch_size=len(texts)),
+                                   executor=ThreadPoolExecutor(max_workers=1), max_batch_size=32, max_wait_ms=5)
+        latencies = []
+        deadline = time.perf_counter() + duration
+
+        async def session():
+            while time.perf_counter() < deadline:
+                text = f"query: {random.choice(QUESTIONS)} ({random.randint(0, 10**6)})"
+                started = time.perf_counter()
+                await batcher.encode(text)
+                latencies.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(session() for _ in range(sessions)))
+        return latencies
+
+    results.put(("done", os.getpid(), asyncio.run(run())))
+
+
+def start_server(backend: str, threads, socket_path: str) -> subprocess.Popen:
+    command = [sys.executable, "embedding_server.py", "--socket", socket_path, "--embedding-backend", backend]
+    if threads:
+        command += ["--threads", str(threads)]
+    server = subprocess.Popen(command, cwd=BACKEND_DIR, stdout=subprocess.DEVNULL)
+    from embedding_server import RemoteEmbedder
+    deadline = time.monotonic() + 600
+    while True:
+        try:
+            RemoteEmbedder(socket_path)
+            return server
+        except OSError:
+            if server.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError("embedding server did not start")
+            time.sleep(0.2)
+
+
+def run_mode(mode: str, args, socket_path: str) -> dict:
+    server = start_server(args.embedding_backend, args.server_threads, socket_path) if mode == "shared" else None
+    context = multiprocessing.get_context("spawn")
+    start, results = context.Event(), context.Queue()
+    processes = [context.Process(target=worker, args=(mode, args.embedding_backend, args.threads_per_worker,
+                                                      socket_path, args.sessions, args.duration, start, results))
+                 for _ in range(args.workers)]
+    try:
+        for process in processes:
+            process.start()
+        pids = [results.get()[1] for _ in processes]
+        started = time.perf_counter()
+        start.set()
+        time.sleep(args.duration * 0.9)
+        # Measured under load, when activations and thread pools are allocated
+        memory = sum(pss_mib(pid) for pid in pids) + (pss_mib(server.pid) if server else 0.0)
+        latencies = [latency for _ in processes for latency in results.get()[2]]
+        wall = time.perf_counter() - started
+        batch = None
+        if server is not None:
+            from embedding_server import RemoteEmbedder
+            batch = RemoteEmbedder(socket_path).stats()["avg_batch_size"]
+        return {"memory": memory, "rate": len(latencies) / wall, "p50": percentile(latencies, 50),
+                "p99": percentile(latencies, 99), "batch": batch}
+    finally:
+        for process in processes:
+            process.join(timeout=30)
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--embedding-backend", default="hash", help="hash runs offline; torch/onnx use the real model")
+    parser.add_argument("--workers", type=int, default=4, help="API worker processes")
+    parser.add_argument("--sessions", type=int, default=16, help="concurrent sessions per worker")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per mode")
+    parser.add_argument("--threads-per-worker", type=int, default=None,
+                        help="model threads in each worker in per-worker mode (default: all cores)")
+    parser.add_argument("--server-threads", type=int, default=None, help="model threads of the server (default: all cores)")
+    args = parser.parse_args()
+
+    socket_path = os.path.join(tempfile.mkdtemp(prefix="embed-bench-"), "embed.sock")
+    print(f"{args.workers} workers x {args.sessions} sessions, {args.embedding_backend} backend, {os.cpu_count()} cores")
+    print(f"\n{'mode':<11} {'PSS MiB':>9} {'emb/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'avg batch':>10}")
+    for mode in ("per-worker", "shared"):
+        row = run_mode(mode, args, socket_path)
+        batch = f"{row['batch']:.1f}" if row["batch"] is not None else "-"
+        print(f"{mode:<11} {row['memory']:>9.0f} {row['rate']:>9.0f} {row['p50'] * 1000:>8.2f} "
+              f"{row['p99'] * 1000:>8.2f} {batch:>10}")
+
+
+if __name__ == "__main__":
+    main()
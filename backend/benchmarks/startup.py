@@ -0,0 +1,56 @@
+"""Import time of the API module and time until its components are ready.
+
+Each measurement runs in a fresh interpreter so nothing is already cached in
+sys.modules. Also lists the slowest imports from ``python -X importtime``.
+Run from backend/ (compare against an older checkout to see the change):
+
+    python -m benchmarks.startup --runs 5
+"""
+import argparse
+import re
+import statistics
+import subprocess
+import sys
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+READY_SNIPPET = (
+    "import time; t = time.perf_counter(); import main, rag; i = time.perf_counter() - t; "
+    "rag.warm_up(); print(i, time.perf_counter() - t)"
+)
+
+
+def run(snippet: str, *flags: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *flags, "-c", snippet], capture_output=True, text=True, check=True)
+
+
+def last_line_floats(output: str):
+    return [float(x) for x in output.strip().splitlines()[-1].split()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    parser.add_argument("--skip-ready", action="store_true", help="don't measure warm-up (no model download)")
+    args = parser.parse_args()
+
+    imports = [last_line_floats(run(IMPORT_SNIPPET).stdout)[0] for _ in range(args.runs)]
+    print(f"import main: median {statistics.median(imports) * 1000:.0f} ms over {args.runs} runs")
+
+    if not args.skip_ready:
+        import_s, ready_s = last_line_floats(run(READY_SNIPPET).stdout)
+        print(f"import + warm_up(): {ready_s:.2f} s (import {import_s * 1000:.0f} ms)")
+
+    # -X importtime writes "import time: self [us] | cumulative | package" to stderr
+    rows = []
+    for line in run("import main", "-X", "importtime").stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)", line)
+        if match and len(match.group(3)) <= 2:  # top-level imports only
+            rows.append((int(match.group(2)), match.group(4)))
+    print(f"\nslowest top-level imports (cumulative):")
+    for cumulative_us, module in sorted(rows, reverse=True)[:args.top]:
+        print(f"{cumulative_us / 1000:>9.1f} ms  {module}")
+
+
+if __name__ == "__main__":
+    main()
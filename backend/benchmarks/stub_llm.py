@@ -0,0 +1,181 @@
+"""Local stand-ins for the Together and Cohere HTTP APIs.
+
+They answer the endpoints the SDKs call (Together ``/v1/chat/completions``,
+Cohere ``/v1/generate``, both plain and streaming) with canned text, after a
+configurable time-to-first-token, token rate and failure rate. Point the app at
+them with TOGETHER_BASE_URL / COHERE_BASE_URL:
+
+    python -m benchmarks.stub_llm --provider together --port 9001 --ttft 0.3
+    TOGETHER_BASE_URL=http://127.0.0.1:9001/v1 TOGETHER_API_KEY=stub uvicorn main:app
+
+Behaviour can be changed while running with ``POST /_control`` (same fields
+as StubBehavior), which is how the provider benchmark degrades one provider.
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+ANSWER = (
+    "Arjuna hesitated on the battlefield of Kurukshetra because he saw his teachers, "
+    "cousins and elders arrayed against him. Krishna answered his doubts with the "
+    "teachings that became the Bhagavad Gita."
+)
+
+
+@dataclass
+class StubBehavior:
+    ttft: float = 0.2  # seconds before the first token (or the whole answer)
+    tokens_per_second: float = 200.0
+    failure_rate: float = 0.0  # fraction of requests answered with a 503
+    jitter: float = 0.0  # +/- fraction applied to ttft
+    slow_rate: float = 0.0  # fraction of requests whose ttft is multiplied by slow_factor
+    slow_factor: float = 10.0
+
+
+def _tokens():
+    return [word + " " for word in ANSWER.split()]
+
+
+def create_app(provider: str, behavior: StubBehavior = None) -> FastAPI:
+    behavior = behavior or StubBehavior()
+    app = FastAPI()
+    app.state.behavior = behavior
+    app.state.requests = 0
+
+    async def wait_first_token():
+        b = app.state.behavior
+        delay = b.ttft * (1 + random.uniform(-b.jitter, b.jitter))
+        if random.random() < b.slow_rate:
+            delay *= b.slow_factor
+        await asyncio.sleep(max(0.0, delay))
+
+    def should_fail() -> bool:
+        return random.random() < app.state.behavior.failure_rate
+
+    async def token_gap():
+        await asyncio.sleep(1 / max(app.state.behavior.tokens_per_second, 1e-6))
+
+    @app.post("/_control")
+    async def control(request: Request):
+        for field, value in (await request.json()).items():
+            setattr(app.state.behavior, field, value)
+        return asdict(app.state.behavior)
+
+    @app.get("/_stats")
+    async def stats():
+        return {"requests": app.state.requests, "behavior": asdict(app.state.behavior)}
+
+    if provider == "together":
+        @app.post("/v1/chat/completions")
+        async def chat_completions(request: Request):
+            body = await request.json()
+            app.state.requests += 1
+            if should_fail():
+                await wait_first_token()
+                return JSONResponse({"error": {"message": "stub overloaded"}}, status_code=503)
+            completion_id = f"stub-{uuid.uuid4().hex[:12]}"
+            created = int(time.time())
+
+            if not body.get("stream"):
+                await wait_first_token()
+                tokens = _tokens()
+                await asyncio.sleep(len(tokens) / max(app.state.behavior.tokens_per_second, 1e-6))
+                return {
+                    "id": completion_id, "object": "chat.completion", "created": created, "model": body.get("model"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)},
+                                 "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+                }
+
+            async def events():
+                await wait_first_token()
+                for token in _tokens():
+                    chunk = {
+                        "id": completion_id, "object": "chat.completion.chunk", "created": created,
+                        "model": body.get("model"),
+                        "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+                    }
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                    await token_gap()
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+    elif provider == "cohere":
+        @app.post("/v1/generate")
+        async def generate(request: Request):
+            body = await request.json()
+            app.state.requests += 1
+            if should_fail():
+                await wait_first_token()
+                return JSONResponse({"message": "stub overloaded"}, status_code=503)
+            generation_id = str(uuid.uuid4())
+
+            if not body.get("stream"):
+                await wait_first_token()
+                tokens = _tokens()
+                await asyncio.sleep(len(tokens) / max(app.state.behavior.tokens_per_second, 1e-6))
+                return {"id": generation_id, "prompt": body.get("prompt"),
+                        "generations": [{"id": generation_id, "text": "".join(tokens)}], "meta": {}}
+
+            async def events():
+                await wait_first_token()
+                tokens = _tokens()
+                for token in tokens:
+                    yield json.dumps({"event_type": "text-generation", "text": token, "is_finished": False}) + "\n"
+                    await token_gap()
+                yield json.dumps({
+                    "event_type": "stream-end", "is_finished": True, "finish_reason": "COMPLETE",
+                    "response": {"id": generation_id, "generations": [{"id": generation_id, "text": "".join(tokens)}]},
+                }) + "\n"
+
+            return StreamingResponse(events(), media_type="application/stream+json")
+
+    else:
+        raise ValueError(f"Unknown provider '{provider}' (expected together or cohere)")
+
+    return app
+
+
+def serve_in_thread(provider: str, port: int, behavior: StubBehavior = None):
+    """Run a stub on 127.0.0.1:port in a daemon thread; returns the uvicorn server"""
+    import uvicorn
+
+    config = uvicorn.Config(create_app(provider, behavior), host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--provider", choices=["together", "cohere"], required=True)
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--ttft", type=float, default=0.2)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--slow-rate", type=float, default=0.0)
+    parser.add_argument("--slow-factor", type=float, default=10.0)
+    args = parser.parse_args()
+
+    behavior = StubBehavior(ttft=args.ttft, tokens_per_second=args.tokens_per_second, failure_rate=args.failure_rate,
+                            jitter=args.jitter, slow_rate=args.slow_rate, slow_factor=args.slow_factor)
+    uvicorn.run(create_app(args.provider, behavior), host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Pinecone query payloads with the chunk text in Pinecone metadata versus in
+the local chunk store.
+
+A stub of Pinecone's /query endpoint serves a synthetic corpus (metadata
+shaped like chunk_and_ingest.py's) over HTTP on this machine, and sends each
+response through a simulated link of --bandwidth-mbps with --rtt-ms round
+trips. The retrieval path queries it through PineconeVectorStore the way
+/chat does (top_k candidates with their vectors, for MMR), in three layouts:
+
+- full+values: full metadata and vectors in every response (before)
+- full:        full metadata, no vectors (MMR would have to be turned off)
+- slim+store:  IDs and scores only, hydrated from the chunk store (after)
+
+Reported per layout: response bytes per query, p50/p95 retrieval latency
+and the share of it spent hydrating from the chunk store. Run from backend/:
+
+    python -m benchmarks.vector_payload --chunks 20000 --top-k 12 --bandwidth-mbps 100
+"""
+import argparse
+import asyncio
+import json
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+from benchmarks.e2e import free_port, synthetic_pages
+from benchmarks.load_test import percentile
+from characters import character_registry
+from chunk_store import ChunkStore, ChunkStoreWriter
+from vector_store import PineconeVectorStore, normalize_rows
+
+SLIM_FIELDS = ("doc_id", "characters")
+
+
+def synthetic_chunks(count: int, dim: int, seed: int = 0):
+    """(ids, normalized vectors, full metadata) for ``count`` chunks"""
+    text = " ".join(synthetic_pages(count // 2 + 1, seed=seed))
+    ids, metadata = [], []
+    for position in range(count):
+        chunk = text[position * 900:position * 900 + 1000]
+        ids.append(f"c-{position:032x}")
+        metadata.append({
+            "text": chunk, "summary": chunk[:200].strip() + "...", "section": f"Section {position + 1}",
+            "chunk_id": position, "doc_id": "mahabharata", "source": "Mahabharata",
+            "page_number": position // 3 + 1, "document_title": "Mahabharata", "chunk_length": len(chunk),
+            "embedding_model": "intfloat/e5-base-v2", "characters": character_registry.mentions(chunk),
+        })
+    vectors = normalize_rows(np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32))
+    return ids, vectors, metadata
+
+
+def create_app(ids, vectors, metadata, bandwidth_mbps: float, rtt_ms: float):
+    """Stub of Pinecone's /query: exact cosine search, metadata per layout"""
+    from fastapi import FastAPI, Request, Response
+
+    app = FastAPI()
+    layouts = {
+        "full": metadata,
+        "slim": [{field: m[field] for field in SLIM_FIELDS} for m in metadata],
+    }
+
+    @app.post("/{layout}/query")
+    async def query(layout: str, request: Request):
+        body = await request.json()
+        scores = vectors @ np.asarray(body["vector"], dtype=np.float32)
+        rows = np.argsort(-scores)[:body["topK"]]
+        matches = []
+        for row in rows:
+            match = {"id": ids[row], "score": float(scores[row])}
+            if body.get("includeValues"):
+                match["values"] = vectors[row].tolist()
+            if body.get("includeMetadata"):
+                match["metadata"] = layouts[layout][row]
+            matches.append(match)
+        payload = json.dumps({"matches": matches, "namespace": ""}).encode("utf-8")
+        # The simulated link: one round trip plus the time the bytes take on the wire
+        await asyncio.sleep(rtt_ms / 1000 + len(payload) * 8 / (bandwidth_mbps * 1e6))
+        return Response(payload, media_type="application/json")
+
+    return app
+
+
+class HttpIndex:
+    """Just enough of the Pinecone Index interface for PineconeVectorStore"""
+
+    def __init__(self, client: httpx.Client, url: str):
+        self.client = client
+        self.url = url
+        self.response_bytes = []
+
+    def query(self, vector, top_k, include_metadata, include_values, **kwargs):
+        response = self.client.post(self.url, json={"vector": vector, "topK": top_k, "includeMetadata": include_metadata,
+                                                    "includeValues": include_values, **kwargs})
+        response.raise_for_status()
+        self.response_bytes.append(len(response.content))
+        return response.json()
+
+
+class TimedChunkStore:
+    """Wraps a ChunkStore to time the hydration step"""
+
+    def __init__(self, store: ChunkStore):
+        self.store = store
+        self.seconds = []
+
+    @property
+    def version(self):
+        return self.store.version
+
+    def get_many(self, ids, include_values=False):
+        started = time.perf_counter()
+        records = self.store.get_many(ids, include_values)
+        self.seconds.append(time.perf_counter() - started)
+        return records
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--top-k", type=int, default=12, help="CONTEXT_CANDIDATES")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--bandwidth-mbps", type=float, default=100.0)
+    parser.add_argument("--rtt-ms", type=float, default=2.0)
+    args = parser.parse_args()
+
+    ids, vectors, metadata = synthetic_chunks(args.chunks, args.dim)
+    workdir = Path(tempfile.mkdtemp(prefix="payload-bench-"))
+    try:
+        writer = ChunkStoreWriter(workdir / "chunks")
+        writer.add(ids, vectors, metadata)
+        writer.close()
+        chunk_store = TimedChunkStore(ChunkStore(workdir / "chunks"))
+        print(f"{args.chunks} chunks; chunk store {sum(f.stat().st_size for f in (workdir / 'chunks').iterdir()) / 2**20:.1f} MiB")
+
+        port = free_port()
+        config = uvicorn.Config(create_app(ids, vectors, metadata, args.bandwidth_mbps, args.rtt_ms),
+                                host="127.0.0.1", port=port, log_level="warning")
+        server = uvicorn.Server(config)
+        threading.Thread(target=server.run, daemon=True).start()
+        while not server.started:
+            time.sleep(0.05)
+
+        queries = normalize_rows(np.random.default_rng(1).standard_normal((args.queries, args.dim)))
+        print(f"\n{'layout':<12} {'bytes/query':>12} {'p50 ms':>8} {'p95 ms':>8} {'hydrate p50 ms':>15}")
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}") as client:
+            for label, layout, include_values, store in (("full+values", "full", True, None),
+                                                         ("full", "full", False, None),
+                                                         ("slim+store", "slim", True, chunk_store)):
+                index = HttpIndex(client, f"/{layout}/query")
+                vector_store = PineconeVectorStore(index, "bench", chunk_store=store)
+                vector_store.query(queries[0], args.top_k, include_values=include_values)  # connection warm-up
+                index.response_bytes.clear()
+                chunk_store.seconds.clear()
+                latencies = []
+                for query in queries:
+                    started = time.perf_counter()
+                    matches = vector_store.query(query, args.top_k, include_values=include_values)
+                    latencies.append(time.perf_counter() - started)
+                    assert len(matches) == args.top_k and all(m["metadata"]["text"] for m in matches)
+                hydrate = f"{percentile(chunk_store.seconds, 50) * 1000:.3f}" if store is not None else "-"
+                print(f"{label:<12} {np.mean(index.response_bytes):>12,.0f} {percentile(latencies, 50) * 1000:>8.2f} "
+                      f"{percentile(latencies, 95) * 1000:>8.2f} {hydrate:>15}")
+        server.should_exit = True
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Recall@k and latency of approximate (IVF) local search against exact search.
+
+By default builds a synthetic clustered corpus shaped like e5-base-v2 output;
+pass --index to measure an index written by chunk_and_ingest.py instead
+(its own vectors, perturbed, are used as queries). Run from backend/:
+
+    python -m benchmarks.vector_search --rows 200000 --nlist 512 --nprobe 4,8,16,32
+"""
+import argparse
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from vector_store import LocalVectorStore, build_ivf, normalize_rows, write_local_index
+
+
+def synthetic_corpus(rows: int, dim: int, clusters: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = normalize_rows(rng.standard_normal((clusters, dim)))
+    assignment = rng.integers(0, clusters, size=rows)
+    return normalize_rows(centers[assignment] + 0.35 * rng.standard_normal((rows, dim)) / np.sqrt(dim) * 8)
+
+
+def make_queries(store: LocalVectorStore, count: int, seed: int = 1) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(store), size=count, replace=False)
+    base = np.asarray(store.vectors[np.sort(rows)], dtype=np.float32)
+    return normalize_rows(base + 0.05 * rng.standard_normal(base.shape).astype(np.float32))
+
+
+def timed_search(store: LocalVectorStore, queries: np.ndarray, top_k: int, nprobe=None):
+    results, latencies = [], []
+    for q in queries:
+        start = time.perf_counter()
+        rows, _ = store.search(q, top_k, nprobe=nprobe)
+        latencies.append(time.perf_counter() - start)
+        results.append(set(rows.tolist()))
+    return results, np.array(latencies) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", help="existing local index directory")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--clusters", type=int, default=1000)
+    parser.add_argument("--dtype", default="float32", choices=["float32", "float16"])
+    parser.add_argument("--nlist", type=int, default=256)
+    parser.add_argument("--nprobe", default="4,8,16,32")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = None
+    if args.index:
+        path = Path(args.index)
+        store = LocalVectorStore(path)
+        if not store.manifest.get("nlist"):
+            print("Index has no IVF lists; copying it and building them for the benchmark")
+            workdir = Path(tempfile.mkdtemp(prefix="ivf-bench-"))
+            shutil.copytree(path, workdir, dirs_exist_ok=True)
+            path = workdir
+            build_ivf(path, args.nlist)
+    else:
+        workdir = Path(tempfile.mkdtemp(prefix="ivf-bench-"))
+        path = workdir
+        print(f"Building synthetic index: {args.rows} x {args.dim} {args.dtype}, nlist={args.nlist}")
+        vectors = synthetic_corpus(args.rows, args.dim, args.clusters)
+        write_local_index(path, [f"v{i}" for i in range(args.rows)], vectors, [None] * args.rows,
+                          dtype=args.dtype, nlist=args.nlist)
+        del vectors
+
+    try:
+        exact = LocalVectorStore(path, mode="exact")
+        ivf = LocalVectorStore(path, mode="ivf")
+        queries = make_queries(exact, min(args.queries, len(exact)))
+
+        truth, exact_ms = timed_search(exact, queries, args.top_k)
+        print(f"{'mode':>12} {'recall@' + str(args.top_k):>10} {'p50 ms':>8} {'p95 ms':>8} {'qps':>8}")
+        print(f"{'exact':>12} {1.0:>10.3f} {np.percentile(exact_ms, 50):>8.2f} "
+              f"{np.percentile(exact_ms, 95):>8.2f} {1000 / exact_ms.mean():>8.0f}")
+
+        for nprobe in (int(x) for x in args.nprobe.split(",") if x):
+            found, ivf_ms = timed_search(ivf, queries, args.top_k, nprobe=nprobe)
+            recall = np.mean([len(f & t) / len(t) for f, t in zip(found, truth) if t])
+            print(f"{'ivf/' + str(nprobe):>12} {recall:>10.3f} {np.percentile(ivf_ms, 50):>8.2f} "
+                  f"{np.percentile(ivf_ms, 95):>8.2f} {1000 / ivf_ms.mean():>8.0f}")
+    finally:
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
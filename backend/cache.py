@@ -0,0 +1,220 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+_MISSING = object()
+
+
+def normalize_query(query: str) -> str:
+    """Case-fold, collapse whitespace and drop trailing punctuation"""
+    return re.sub(r"\s+", " ", query).strip().casefold().rstrip("?!. ")
+
+
+def cache_key(*parts) -> str:
+    return hashlib.sha1("\x1f".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    """Thread-safe in-process LRU with a per-entry TTL"""
+
+    def __init__(self, max_size: int = 1000, ttl: Optional[float] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: str, default=None):
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict:
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class TwoTierCache:
+    """In-process LRU in front of a shared Redis tier.
+
+    Local hits never leave the process; local misses fall through to Redis and
+    Redis hits are copied back into the LRU. Redis errors are counted and
+    treated as misses so an outage only costs hit rate. ``version`` is part of
+    every key, so bumping it (new model or re-ingested index) orphans old
+    entries, which then age out through their TTLs.
+    """
+
+    def __init__(self, name: str, local: LRUCache, redis_client=None, redis_ttl: int = 3600,
+                 dumps: Callable[[Any], bytes] = None, loads: Callable[[bytes], Any] = None):
+        self.name = name
+        self.local = local
+        self.redis = redis_client
+        self.redis_ttl = redis_ttl
+        self.dumps = dumps or (lambda v: json.dumps(v).encode("utf-8"))
+        self.loads = loads or (lambda b: json.loads(b))
+        self.version = "0"
+        self.redis_hits = 0
+        self.redis_misses = 0
+        self.redis_errors = 0
+
+    def set_version(self, version: str) -> None:
+        if version != self.version:
+            self.version = version
+            self.local.clear()
+
+    def key(self, *parts) -> str:
+        """Versioned cache key for the given parts"""
+        return f"cache:{self.name}:{self.version}:{cache_key(*parts)}"
+
+    async def get(self, key: str):
+        value = self.local.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if self.redis is None:
+            return None
+        try:
+            raw = await self.redis.get(key)
+        except Exception:
+            self.redis_errors += 1
+            return None
+        if raw is None:
+            self.redis_misses += 1
+            return None
+        self.redis_hits += 1
+        value = self.loads(raw)
+        self.local.set(key, value)
+        return value
+
+    async def set(self, key: str, value) -> None:
+        self.local.set(key, value)
+        if self.redis is None:
+            return
+        try:
+            await self.redis.set(key, self.dumps(value), ex=self.redis_ttl)
+        except Exception:
+            self.redis_errors += 1
+
+    async def get_many(self, keys: List[str]) -> List[Any]:
+        """get() for many keys, with the local misses fetched in one MGET"""
+        values = [self.local.get(key, _MISSING) for key in keys]
+        missing = [i for i, value in enumerate(values) if value is _MISSING]
+        if missing and self.redis is not None:
+            try:
+                raws = await self.redis.mget([keys[i] for i in missing])
+            except Exception:
+                self.redis_errors += 1
+                raws = [None] * len(missing)
+            for i, raw in zip(missing, raws):
+                if raw is None:
+                    self.redis_misses += 1
+                    continue
+                self.redis_hits += 1
+                values[i] = self.loads(raw)
+                self.local.set(keys[i], values[i])
+        return [None if value is _MISSING else value for value in values]
+
+    async def set_many(self, items: List[Tuple[str, Any]]) -> None:
+        """set() for many entries in one pipelined round-trip"""
+        for key, value in items:
+            self.local.set(key, value)
+        if self.redis is None or not items:
+            return
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key, value in items:
+                    pipe.set(key, self.dumps(value), ex=self.redis_ttl)
+                await pipe.execute()
+        except Exception:
+            self.redis_errors += 1
+
+    def stats(self) -> Dict:
+        return {
+            "version": self.version,
+            "local": self.local.stats(),
+            "redis": {
+                "enabled": self.redis is not None,
+                "hits": self.redis_hits,
+                "misses": self.redis_misses,
+                "errors": self.redis_errors,
+            },
+        }
+
+
+def dump_vector(vector) -> bytes:
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def load_vector(raw: bytes) -> np.ndarray:
+    return np.frombuffer(raw, dtype=np.float32)
+
+
+def dump_chunks(chunks: List[Dict]) -> bytes:
+    """Retrieved chunks as JSON, with their ``embedding`` arrays appended as
+    one raw float32 matrix instead of JSON number lists"""
+    vectors = [chunk.get("embedding") for chunk in chunks]
+    with_vectors = bool(chunks) and all(v is not None for v in vectors)
+    header = json.dumps({
+        "chunks": [{k: v for k, v in chunk.items() if k != "embedding"} for chunk in chunks],
+        "dim": len(vectors[0]) if with_vectors else 0,
+    }).encode("utf-8")
+    matrix = np.stack(vectors).astype(np.float32).tobytes() if with_vectors else b""
+    return len(header).to_bytes(4, "big") + header + matrix
+
+
+def load_chunks(raw: bytes) -> List[Dict]:
+    size = int.from_bytes(raw[:4], "big")
+    header = json.loads(raw[4:4 + size])
+    chunks = header["chunks"]
+    if header["dim"]:
+        matrix = np.frombuffer(raw[4 + size:], dtype=np.float32).reshape(len(chunks), header["dim"])
+        for chunk, vector in zip(chunks, matrix):
+            chunk["embedding"] = vector
+    return chunks
@@ -0,0 +1,143 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CHARACTER_PROFILES_PATH = Path(os.getenv("CHARACTER_PROFILES_PATH", Path(__file__).parent / "character_profiles.json"))
+# Seconds between checks of the profiles file for changes
+CHARACTER_RELOAD_INTERVAL = float(os.getenv("CHARACTER_RELOAD_INTERVAL", "2"))
+
+# Used when character_profiles.json is missing or unreadable
+FALLBACK_PROFILES = {
+    "Karna": {
+        "persona_prompt": "Respond as Karna: noble, generous, proud, and fiercely loyal to Duryodhana.",
+        "traits": ["Generous", "Loyal", "Courageous", "Proud"],
+        "summary": "Karna, son of Kunti and Surya, is known for his unwavering loyalty and generosity."
+    },
+    "Krishna": {
+        "persona_prompt": "Respond as Krishna: wise, compassionate, strategic, and divine guide.",
+        "traits": ["Wise", "Compassionate", "Strategic", "Divine"],
+        "summary": "Krishna, the divine guide, is known for his wisdom and compassion."
+    },
+    "Arjuna": {
+        "persona_prompt": "Respond as Arjuna: skilled archer, devoted student, conflicted warrior.",
+        "traits": ["Skilled", "Devoted", "Conflicted", "Noble"],
+        "summary": "Arjuna, the great archer, is known for his skill and moral dilemmas."
+    },
+    "Draupadi": {
+        "persona_prompt": "Respond as Draupadi: strong, intelligent, proud, and seeking justice.",
+        "traits": ["Strong", "Intelligent", "Proud", "Justice-seeking"],
+        "summary": "Draupadi, the queen of the Pandavas, is known for her strength and quest for justice."
+    },
+    "Bhishma": {
+        "persona_prompt": "Respond as Bhishma: wise grandfather, bound by vows, tragic figure.",
+        "traits": ["Wise", "Honorable", "Bound by duty", "Tragic"],
+        "summary": "Bhishma, the grand patriarch, is known for his wisdom and unwavering commitment to his vows."
+    },
+    "Yudhishthira": {
+        "persona_prompt": "Respond as Yudhishthira: righteous king, follower of dharma, sometimes conflicted.",
+        "traits": ["Righteous", "Dharmic", "Just", "Sometimes naive"],
+        "summary": "Yudhishthira, the eldest Pandava, is known for his commitment to dharma and righteousness."
+    },
+    "Duryodhana": {
+        "persona_prompt": "Respond as Duryodhana: proud prince, jealous of Pandavas, believes in his righteousness.",
+        "traits": ["Proud", "Jealous", "Strong-willed", "Ambitious"],
+        "summary": "Duryodhana, the Kaurava prince, is known for his pride and rivalry with the Pandavas."
+    }
+}
+
+
+class CharacterRegistry:
+    """Character profiles, loaded once and reloaded when the file changes.
+
+    Besides the persona prompts it matches a character's name and
+    ``aliases`` in text, which ingestion uses to record the characters each
+    chunk mentions. ``signature`` changes whenever a character's names do, so
+    an entity index built from an older alias list can be recognised as stale.
+    """
+
+    def __init__(self, path=CHARACTER_PROFILES_PATH, reload_interval: float = CHARACTER_RELOAD_INTERVAL):
+        self.path = Path(path)
+        self.reload_interval = reload_interval
+        self._profiles: Optional[Dict] = None
+        self._mtime = None
+        self._checked = 0.0
+        self._pattern = None
+        self._alias_owner: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.reloads = 0
+
+    def _file_mtime(self):
+        try:
+            return self.path.stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def _load(self, mtime) -> None:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                profiles = json.load(f)
+            if not profiles:
+                raise ValueError("no profiles")
+            logger.info("Loaded %d character profiles", len(profiles))
+        except (OSError, ValueError) as e:
+            if self._profiles is not None and mtime is not None:
+                # Mid-write or broken edit: keep serving the last good version
+                logger.warning("Could not reload %s (%s), keeping the loaded profiles", self.path.name, e)
+                return
+            logger.warning("Could not load %s (%s), using fallback profiles", self.path.name, e)
+            profiles = FALLBACK_PROFILES
+
+        owners = {}
+        for name, profile in profiles.items():
+            for alias in [name] + list(profile.get("aliases", [])):
+                owners.setdefault(alias.lower(), name)
+        # Longest first so a name is not matched by a shorter alias it contains
+        alternatives = sorted(owners, key=len, reverse=True)
+        self._pattern = re.compile(r"\b(" + "|".join(re.escape(a) for a in alternatives) + r")\b", re.IGNORECASE)
+        self._alias_owner = owners
+        self._profiles = profiles
+        self.reloads += 1
+
+    def profiles(self) -> Dict:
+        """Name -> profile, reloading first if the file changed"""
+        now = time.monotonic()
+        if self._profiles is None or now - self._checked >= self.reload_interval:
+            with self._lock:
+                if self._profiles is None or now - self._checked >= self.reload_interval:
+                    mtime = self._file_mtime()
+                    if self._profiles is None or mtime != self._mtime:
+                        self._load(mtime)
+                        self._mtime = mtime
+                    self._checked = now
+        return self._profiles
+
+    def get(self, name: Optional[str]) -> Optional[Dict]:
+        return self.profiles().get(name) if name else None
+
+    def listing(self) -> List[Dict]:
+        """What /characters returns"""
+        return [{"name": name, "description": profile.get("summary", "")} for name, profile in self.profiles().items()]
+
+    def aliases(self, name: str) -> List[str]:
+        profile = self.get(name) or {}
+        return [name] + list(profile.get("aliases", []))
+
+    def signature(self, name: str) -> str:
+        return hashlib.sha1("\x1f".join(sorted(a.lower() for a in self.aliases(name))).encode("utf-8")).hexdigest()[:12]
+
+    def mentions(self, text: str) -> List[str]:
+        """Characters named (or referred to by an alias) in text"""
+        self.profiles()
+        found = {self._alias_owner[m.lower()] for m in self._pattern.findall(text)}
+        return sorted(found)
+
+
+character_registry = CharacterRegistry()
@@ -1,11 +1,35 @@
 import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 import pdfplumber
 from dotenv import load_dotenv
-from pinecone import Pinecone, ServerlessSpec
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from sentence_transformers import SentenceTransformer
 import numpy as np
+from embeddings import get_embedder, EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND
+from vector_store import LocalIndexWriter, LocalVectorStore, read_partial_index, DEFAULT_LOCAL_INDEX_DIR
+from chunk_store import ChunkStore, ChunkStoreWriter, read_partial_chunk_store, DEFAULT_CHUNK_STORE_DIR
+from characters import character_registry
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 100
+# Text is split in windows of this many characters; only chunks that end well
+# before the window edge are emitted, the rest is carried into the next window
+SPLIT_WINDOW_CHARS = 20 * CHUNK_SIZE
+DATA_FOLDER = Path(__file__).parent / "data"
+# With slim Pinecone metadata only what query filters need goes to Pinecone;
+# text and the rest live in the chunk store
+SLIM_METADATA_FIELDS = ("doc_id", "characters")
+# Fields that depend on where a chunk sits in its document. They stay in the
+# chunk store and the local index but never go to Pinecone, so inserting a
+# chunk doesn't force a metadata update of every chunk after it
+POSITIONAL_METADATA_FIELDS = ("chunk_id", "section")
 
 # Load .env with explicit path
 env_path = Path(__file__).parent / '.env'
@@ -13,135 +37,686 @@ print(f"Loading .env from: {env_path}")
 print(f".env file exists: {env_path.exists()}")
 load_dotenv(dotenv_path=env_path, override=True)
 
-# Initialize Pinecone
-pinecone_api_key = os.getenv("PINECONE_API_KEY")
-if not pinecone_api_key:
-    print("ERROR: PINECONE_API_KEY is missing from .env")
-    exit(1)
-
-pc = Pinecone(api_key=pinecone_api_key)
-index_name = "mahabharat"
-
-# Ensure index exists with correct dimension (1024)
-try:
-    existing_indexes = [idx.name for idx in pc.list_indexes()]
-    if index_name not in existing_indexes:
-        print(f"Creating index '{index_name}' with dimension 1024...")
-        pc.create_index(
-            name=index_name,
-            dimension=1024,  # e5-base-v2 outputs 1024 dimensions
-            metric='cosine',
-            spec=ServerlessSpec(
-                cloud='aws',
-                region='us-east-1'
+
+class StageStats:
+    """Items processed and busy time for one pipeline stage"""
+
+    def __init__(self, name: str, unit: str):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.seconds = 0.0
+
+    def add(self, items: int, seconds: float) -> None:
+        self.items += items
+        self.seconds += seconds
+
+    def report(self) -> str:
+        rate = self.items / self.seconds if self.seconds else 0.0
+        return f"{self.name:>8}: {self.items:>8} {self.unit:<8} {self.seconds:>8.1f}s busy {rate:>10.1f} {self.unit}/s"
+
+
+def connect_pinecone(index_name: str, dimension: int):
+    from pinecone import Pinecone, ServerlessSpec
+
+    # Initialize Pinecone
+    pinecone_api_key = os.getenv("PINECONE_API_KEY")
+    if not pinecone_api_key:
+        print("ERROR: PINECONE_API_KEY is missing from .env")
+        exit(1)
+
+    pc = Pinecone(api_key=pinecone_api_key)
+
+    # Ensure index exists with the model's dimension
+    try:
+        existing_indexes = [idx.name for idx in pc.list_indexes()]
+        if index_name not in existing_indexes:
+            print(f"Creating index '{index_name}' with dimension {dimension}...")
+            pc.create_index(
+                name=index_name,
+                dimension=dimension,
+                metric='cosine',
+                spec=ServerlessSpec(
+                    cloud='aws',
+                    region='us-east-1'
+                )
             )
-        )
-        print("Index created successfully!")
-    else:
-        print(f"Index '{index_name}' already exists")
-except Exception as e:
-    print(f"Error with Pinecone: {e}")
-    exit(1)
-
-index = pc.Index(index_name)
-
-# Prepare data folder and PDF path
-data_folder = Path(__file__).parent / "data"
-data_folder.mkdir(exist_ok=True)
-pdf_path = data_folder / "mahabharata.pdf"
-if not pdf_path.exists():
-    print(f"Error: {pdf_path} not found. Please place your Mahabharata PDF in the data folder.")
-    exit(1)
-
-print("Extracting text from PDF...")
-text = ""
-page_metadata = []  # Store page info for better source citation
-
-with pdfplumber.open(pdf_path) as pdf:
-    total_pages = len(pdf.pages)
-    for i, page in enumerate(pdf.pages):
-        page_text = page.extract_text()
-        if page_text:
-            # Store page start position for source tracking
-            page_start = len(text)
-            text += page_text + "\n"
-            page_metadata.append({
-                'page_num': i + 1,
-                'start_char': page_start,
-                'end_char': len(text)
-            })
-        if i % 50 == 0:
-            print(f"Processed {i}/{total_pages} pages...")
-
-print(f"Extracted {len(text)} characters from PDF")
-
-# Enhanced chunking with better metadata
-print("Chunking text...")
-splitter = RecursiveCharacterTextSplitter(
-    chunk_size=1000, 
-    chunk_overlap=100,
-    separators=["\n\n", "\n", ". ", " ", ""]  # Better text splitting
-)
-chunks = splitter.split_text(text)
-print(f"Created {len(chunks)} chunks")
-
-# Initialize Sentence Transformers model (1024-dim)
-print("Loading sentence-transformers model (intfloat/e5-base-v2, 1024d)...")
-model = SentenceTransformer("intfloat/e5-base-v2")
-
-# Generate all embeddings in batches for efficiency
-print("Generating embeddings...")
-embeddings = model.encode(chunks, show_progress_bar=True, batch_size=32)
-
-# Function to find which page a chunk belongs to
-def get_chunk_page_info(chunk_text, original_text, page_metadata):
-    # Find the chunk position in original text
-    chunk_start = original_text.find(chunk_text)
-    if chunk_start == -1:
-        return {"page_num": "Unknown", "chapter": "Unknown"}
-    
-    # Find which page this chunk belongs to
-    for page_info in page_metadata:
-        if page_info['start_char'] <= chunk_start <= page_info['end_char']:
-            return {"page_num": page_info['page_num']}
-    
-    return {"page_num": "Unknown"}
-
-# Upload to Pinecone with enhanced metadata
-print("Uploading embeddings and metadata to Pinecone...")
-batch_size = 100
-vectors_to_upsert = []
-
-for i, (chunk, vector) in enumerate(zip(chunks, embeddings)):
+            print("Index created successfully!")
+        else:
+            print(f"Index '{index_name}' already exists")
+    except Exception as e:
+        print(f"Error with Pinecone: {e}")
+        exit(1)
+
+    return pc.Index(index_name)
+
+
+def extract_page_range(pdf_path: str, start: int, end: int):
+    """Extract text of pages [start, end) in a worker process"""
+    with pdfplumber.open(pdf_path) as pdf:
+        return [(i + 1, pdf.pages[i].extract_text() or "") for i in range(start, end)]
+
+
+def iter_pages(pdf_path: Path, workers: int, pages_per_task: int, stats: StageStats):
+    """Yield (page_num, text) in page order, extracting ahead across a process pool.
+
+    At most ``2 * workers`` page ranges are in flight, so memory stays bounded
+    however large the PDF is.
+    """
+    with pdfplumber.open(pdf_path) as pdf:
+        total_pages = len(pdf.pages)
+    print(f"Extracting text from {total_pages} pages with {workers} workers...")
+
+    ranges = [(s, min(s + pages_per_task, total_pages)) for s in range(0, total_pages, pages_per_task)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        next_range = 0
+        while next_range < len(ranges) or pending:
+            while next_range < len(ranges) and len(pending) < 2 * workers:
+                pending.append(pool.submit(extract_page_range, str(pdf_path), *ranges[next_range]))
+                next_range += 1
+            started = time.perf_counter()
+            pages = pending.popleft().result()
+            stats.add(len(pages), time.perf_counter() - started)
+            for page in pages:
+                yield page
+            print(f"Extracted {pages[-1][0]}/{total_pages} pages...")
+
+
+def iter_chunks(pages, splitter, stats: StageStats, page_aligned: bool = False):
+    """Yield (chunk_text, page_num) while tracking character offsets.
+
+    Pages are appended to a bounded window instead of one giant string. Each
+    chunk's global start offset comes from the splitter's start index, and its
+    page from a bisect over page start offsets, so repeated passages are
+    attributed to the page they actually came from.
+
+    With ``page_aligned`` every page is split on its own, so chunks never span
+    pages and an edit only changes the chunks of the pages it touches.
+    """
+    if page_aligned:
+        for page_num, page_text in pages:
+            if page_text:
+                started = time.perf_counter()
+                page_chunks = splitter.split_text(page_text)
+                stats.add(len(page_chunks), time.perf_counter() - started)
+                for chunk in page_chunks:
+                    yield chunk, page_num
+        return
+
+    page_starts = []  # global offset where each page's text begins
+    page_nums = []
+    window = ""  # text from global offset window_start onwards
+    window_start = 0
+    pending = []
+    pending_chars = 0
+
+    def page_for(offset: int):
+        idx = bisect_right(page_starts, offset) - 1
+        return page_nums[idx] if idx >= 0 else "Unknown"
+
+    def split(final: bool):
+        nonlocal window, window_start
+        started = time.perf_counter()
+        docs = splitter.create_documents([window])
+        emitted = []
+        carry_from = None
+        for doc in docs:
+            start = doc.metadata["start_index"]
+            if not final and start + len(doc.page_content) > len(window) - CHUNK_SIZE:
+                # Too close to the window edge; split again with more text
+                carry_from = start
+                break
+            emitted.append((doc.page_content, page_for(window_start + start)))
+        if carry_from is None:
+            window_start += len(window)
+            window = ""
+        else:
+            window_start += carry_from
+            window = window[carry_from:]
+        stats.add(len(emitted), time.perf_counter() - started)
+        return emitted
+
+    for page_num, page_text in pages:
+        if not page_text:
+            continue
+        page_starts.append(window_start + len(window) + pending_chars)
+        page_nums.append(page_num)
+        pending.append(page_text + "\n")
+        pending_chars += len(page_text) + 1
+        if len(window) + pending_chars >= SPLIT_WINDOW_CHARS:
+            window += "".join(pending)
+            pending, pending_chars = [], 0
+            yield from split(final=False)
+
+    window += "".join(pending)
+    if window:
+        yield from split(final=True)
+
+
+def iter_batches(items, size: int):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def normalize_chunk_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+def content_chunk_id(text: str, model_name: str = EMBEDDING_MODEL_NAME) -> str:
+    """Content-addressed vector ID: same text and model, same ID"""
+    digest = hashlib.sha256(f"{model_name}\x1f{normalize_chunk_text(text)}".encode("utf-8")).hexdigest()
+    return f"c-{digest[:32]}"
+
+
+def build_metadata(position: int, chunk: str, page_num, doc_id: str, title: str) -> dict:
     # Create enhanced summary
     summary = chunk[:200].strip()
     if len(chunk) > 200:
         summary += "..."
-    
-    # Get page information for source citation
-    page_info = get_chunk_page_info(chunk, text, page_metadata)
-    
+
     # Enhanced metadata for better source citation
-    metadata = {
+    return {
         "text": chunk,
         "summary": summary,
-        "section": f"Section {i+1}",
-        "chunk_id": i,
-        "source": "Mahabharata",
-        "page_number": page_info.get("page_num", "Unknown"),
-        "document_title": "Mahabharata",
+        "section": f"Section {position+1}",
+        "chunk_id": position,
+        "doc_id": doc_id,
+        "source": title,
+        "page_number": page_num,
+        "document_title": title,
         "chunk_length": len(chunk),
-        "embedding_model": "intfloat/e5-base-v2"
+        "embedding_model": EMBEDDING_MODEL_NAME,
+        # Entity index: characters named in the chunk, by name or alias
+        "characters": character_registry.mentions(chunk),
     }
-    
-    vectors_to_upsert.append((f"chunk-{i}", vector.tolist(), metadata))
-    
-    # Batch upsert for efficiency
-    if len(vectors_to_upsert) >= batch_size or i == len(chunks) - 1:
-        index.upsert(vectors=vectors_to_upsert)
-        print(f"Uploaded {i+1}/{len(chunks)} chunks...")
-        vectors_to_upsert = []
-
-print(f"Successfully ingested {len(chunks)} chunks into Pinecone index '{index_name}'")
-stats = index.describe_index_stats()
-print(f"Index now contains {stats['total_vector_count']} vectors")
+
+
+def pinecone_metadata(metadata: dict, mode: str) -> dict:
+    if mode == "full":
+        return {field: value for field, value in metadata.items() if field not in POSITIONAL_METADATA_FIELDS}
+    return {field: metadata[field] for field in SLIM_METADATA_FIELDS}
+
+
+def entity_signatures() -> dict:
+    return {name: character_registry.signature(name) for name in character_registry.profiles()}
+
+
+def entity_version() -> str:
+    """Changes whenever any character's aliases do"""
+    return hashlib.sha1(json.dumps(entity_signatures(), sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+class IngestManifest:
+    """Which chunk IDs each document contributed, plus in-progress checkpoints.
+
+    Layout of the JSON file::
+
+        {"documents": {doc_id: {
+            "source": ..., "title": ..., "status": "complete" | "in_progress",
+            "chunks": [[chunk_id, page_number], ...],   # last completed run, in order
+            "done": [chunk_id, ...],                     # handled so far in this run
+            "entities": ...,                             # alias version the chunks were tagged with
+            "pinecone_metadata": "slim" | "full",        # metadata layout of the Pinecone records
+            "pinecone_positions": bool                   # whether they still carry positional fields
+        }}}
+
+    It is rewritten atomically, so a crash leaves either the old or the new
+    version on disk.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.documents = {}
+        if path.exists():
+            with open(path, "r", encoding="utf-8") as f:
+                self.documents = json.load(f).get("documents", {})
+        self._last_save = 0.0
+
+    def save(self) -> None:
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"documents": self.documents}, f)
+        os.replace(tmp, self.path)
+        self._last_save = time.monotonic()
+
+    def checkpoint(self, every_seconds: float = 2.0) -> None:
+        if time.monotonic() - self._last_save >= every_seconds:
+            self.save()
+
+    def ids_of_other_documents(self, doc_id: str) -> set:
+        ids = set()
+        for other_id, doc in self.documents.items():
+            if other_id != doc_id:
+                ids.update(chunk_id for chunk_id, _ in doc.get("chunks", []))
+                ids.update(doc.get("done", []))
+        return ids
+
+
+class VectorSources:
+    """Already-computed vectors by chunk ID, from the previous local index or
+    chunk store and from rows salvaged out of an interrupted build"""
+
+    def __init__(self):
+        self._rows = {}
+
+    def add(self, ids, vectors, metadata=None) -> None:
+        for row, chunk_id in enumerate(ids):
+            # First source wins: the finished index carries metadata, salvage does not
+            self._rows.setdefault(chunk_id, (vectors, row, metadata[row] if metadata is not None else None))
+
+    def __contains__(self, chunk_id: str) -> bool:
+        return chunk_id in self._rows
+
+    def vector(self, chunk_id: str) -> np.ndarray:
+        vectors, row, _ = self._rows[chunk_id]
+        return np.asarray(vectors[row], dtype=np.float32)
+
+    def metadata(self, chunk_id: str):
+        return self._rows[chunk_id][2]
+
+
+class BoundedUploader:
+    """Runs index writes on a thread pool with at most max_in_flight outstanding.
+
+    ``on_done`` is called on the submitting thread, in submission order, with
+    the IDs of each finished call, which is what makes checkpoints safe.
+    """
+
+    def __init__(self, index, workers: int, max_in_flight: int, stats: StageStats, on_done=None):
+        self.index = index
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upsert")
+        self.max_in_flight = max_in_flight
+        self.in_flight = deque()
+        self.stats = stats
+        self.on_done = on_done
+
+    def _upsert(self, vectors):
+        started = time.perf_counter()
+        self.index.upsert(vectors=vectors)
+        self.stats.add(len(vectors), time.perf_counter() - started)
+
+    def _update(self, updates):
+        for chunk_id, metadata in updates:
+            self.index.update(id=chunk_id, set_metadata=metadata)
+
+    def _delete(self, ids):
+        self.index.delete(ids=ids)
+
+    def _finish_oldest(self) -> None:
+        future, ids = self.in_flight.popleft()
+        # Re-raises index errors instead of silently dropping batches
+        future.result()
+        if self.on_done is not None:
+            self.on_done(ids)
+
+    def _submit(self, fn, payload, ids) -> None:
+        while len(self.in_flight) >= self.max_in_flight:
+            self._finish_oldest()
+        self.in_flight.append((self.pool.submit(fn, payload), ids))
+
+    def submit(self, vectors) -> None:
+        self._submit(self._upsert, vectors, [v[0] for v in vectors])
+
+    def update_metadata(self, updates) -> None:
+        self._submit(self._update, updates, [u[0] for u in updates])
+
+    def delete(self, ids) -> None:
+        self._submit(self._delete, ids, [])
+
+    def drain(self) -> None:
+        while self.in_flight:
+            self._finish_oldest()
+
+    def close(self) -> None:
+        self.drain()
+        self.pool.shutdown()
+
+
+def _refresh_characters(metadata):
+    if metadata and "text" in metadata:
+        metadata = dict(metadata, characters=character_registry.mentions(metadata["text"]))
+    return metadata
+
+
+def copy_rows(writer, sources: VectorSources, ids, batch_size: int = 1024) -> None:
+    """Copy vectors (and their metadata, with the characters re-matched) of
+    other documents into a new local index or chunk store"""
+    for batch in iter_batches(ids, batch_size):
+        writer.add(batch, np.stack([sources.vector(i) for i in batch]),
+                   [_refresh_characters(sources.metadata(i)) for i in batch])
+
+
+def ingest_document(pdf_path: Path, doc_id: str, title: str, args, model, manifest: IngestManifest,
+                    uploader, local_writer, chunk_writer, local_sources: VectorSources, stats: dict) -> int:
+    """Ingest one PDF incrementally; returns the number of chunks it now has"""
+    doc = manifest.documents.get(doc_id, {})
+    previous = {chunk_id: page for chunk_id, page in doc.get("chunks", [])}
+    resumed = doc.get("status") == "in_progress"
+    # Aliases changed since the last run: every chunk's characters may have too
+    entities = entity_version()
+    entities_stale = bool(previous) and doc.get("entities") != entities
+    # Pinecone's update merges metadata fields and cannot drop them, so a
+    # layout change re-upserts every record (from existing vectors where possible);
+    # so do records written before positional fields were dropped
+    layout_changed = bool(previous) and (doc.get("pinecone_metadata", "full") != args.pinecone_metadata
+                                         or doc.get("pinecone_positions", True))
+    done = set(doc.get("done", [])) if resumed else set()
+    in_remote = set(previous) | done | manifest.ids_of_other_documents(doc_id)
+    if resumed:
+        print(f"Resuming interrupted ingestion of '{doc_id}' ({len(done)} chunks already written)")
+
+    manifest.documents[doc_id] = {
+        "source": str(pdf_path),
+        "title": title,
+        "status": "in_progress",
+        "chunks": doc.get("chunks", []),
+        "done": sorted(done),
+        "entities": doc.get("entities"),
+        "pinecone_metadata": doc.get("pinecone_metadata", "full"),
+        "pinecone_positions": doc.get("pinecone_positions", True),
+    }
+    manifest.save()
+
+    def mark_done(ids):
+        done.update(ids)
+        manifest.documents[doc_id]["done"] = list(done)
+        manifest.checkpoint()
+
+    if uploader is not None:
+        uploader.on_done = mark_done
+
+    # Enhanced chunking with better metadata
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        separators=["\n\n", "\n", ". ", " ", ""],  # Better text splitting
+        add_start_index=True
+    )
+    pages = iter_pages(pdf_path, args.workers, args.pages_per_task, stats["extract"])
+    chunks = iter_chunks(pages, splitter, stats["chunk"], args.page_aligned)
+
+    try:
+        current = []  # [chunk_id, page] in document order, unique IDs only
+        seen = set()
+        counts = {"embedded": 0, "upserted": 0, "updated": 0, "unchanged": 0}
+        pending_upsert, pending_update = [], []
+
+        for batch in iter_batches(chunks, args.embed_batch):
+            items = []
+            for text, page_num in batch:
+                chunk_id = content_chunk_id(text)
+                if chunk_id in seen:
+                    # Repeated passage: one vector already covers it
+                    continue
+                seen.add(chunk_id)
+                position = len(current)
+                current.append([chunk_id, page_num])
+                items.append((chunk_id, text, page_num, position))
+
+            needs_upsert = {}
+            for chunk_id, text, page_num, position in items:
+                if uploader is None or chunk_id in done:
+                    continue
+                if chunk_id not in in_remote or layout_changed:
+                    needs_upsert[chunk_id] = True
+                elif previous.get(chunk_id) != page_num or entities_stale:
+                    needs_upsert[chunk_id] = False  # vector exists, page changed or re-tagged
+
+            writers = [w for w in (local_writer, chunk_writer) if w is not None]
+            to_embed = [
+                (chunk_id, text) for chunk_id, text, _, _ in items
+                if chunk_id not in local_sources
+                and (needs_upsert.get(chunk_id) or any(chunk_id not in w.written for w in writers))
+            ]
+            vectors = {}
+            if to_embed:
+                encode_started = time.perf_counter()
+                embeddings = model.encode([text for _, text in to_embed], batch_size=len(to_embed))
+                stats["embed"].add(len(to_embed), time.perf_counter() - encode_started)
+                vectors = {chunk_id: vector for (chunk_id, _), vector in zip(to_embed, embeddings)}
+                counts["embedded"] += len(to_embed)
+
+            def vector_of(chunk_id):
+                return vectors[chunk_id] if chunk_id in vectors else local_sources.vector(chunk_id)
+
+            rows = {writer: ([], [], []) for writer in writers}
+            for chunk_id, text, page_num, position in items:
+                metadata = build_metadata(position, text, page_num, doc_id, title)
+                for writer, (ids, writer_vectors, writer_metadata) in rows.items():
+                    if chunk_id not in writer.written:
+                        ids.append(chunk_id)
+                        writer_vectors.append(vector_of(chunk_id))
+                        writer_metadata.append(metadata)
+                if chunk_id not in needs_upsert:
+                    if chunk_id not in vectors:
+                        counts["unchanged"] += 1
+                elif needs_upsert[chunk_id]:
+                    pending_upsert.append((chunk_id, vector_of(chunk_id).tolist(),
+                                           pinecone_metadata(metadata, args.pinecone_metadata)))
+                    counts["upserted"] += 1
+                else:
+                    pending_update.append((chunk_id, pinecone_metadata(metadata, args.pinecone_metadata)))
+                    counts["updated"] += 1
+
+            for writer, (ids, writer_vectors, writer_metadata) in rows.items():
+                if ids:
+                    writer.add(ids, np.stack(writer_vectors), writer_metadata)
+                    writer.flush()
+            while len(pending_upsert) >= args.upsert_batch:
+                uploader.submit(pending_upsert[:args.upsert_batch])
+                pending_upsert = pending_upsert[args.upsert_batch:]
+            while len(pending_update) >= args.upsert_batch:
+                uploader.update_metadata(pending_update[:args.upsert_batch])
+                pending_update = pending_update[args.upsert_batch:]
+            print(f"[{doc_id}] {len(current)} chunks processed...")
+
+        if uploader is not None:
+            if pending_upsert:
+                uploader.submit(pending_upsert)
+            if pending_update:
+                uploader.update_metadata(pending_update)
+            uploader.drain()
+
+            # Vectors this document no longer produces, unless another document shares them
+            current_ids = {chunk_id for chunk_id, _ in current}
+            stale = (set(previous) | done) - current_ids - manifest.ids_of_other_documents(doc_id)
+            for batch in iter_batches(sorted(stale), 1000):
+                uploader.delete(batch)
+            uploader.drain()
+            if stale:
+                print(f"[{doc_id}] deleted {len(stale)} stale vectors")
+    finally:
+        # Persist whatever finished, so an interrupted run resumes from here
+        manifest.save()
+
+    manifest.documents[doc_id] = {
+        "source": str(pdf_path),
+        "title": title,
+        "status": "complete",
+        "chunks": current,
+        "done": [],
+        "entities": entities,
+        "pinecone_metadata": args.pinecone_metadata if uploader is not None else doc.get("pinecone_metadata", "full"),
+        "pinecone_positions": False if uploader is not None else doc.get("pinecone_positions", True),
+    }
+    manifest.save()
+    print(f"[{doc_id}] {len(current)} chunks: {counts['embedded']} embedded, {counts['upserted']} upserted, "
+          f"{counts['updated']} metadata updates, {counts['unchanged']} unchanged")
+    return len(current)
+
+
+def swap_in(building_dir: Path, target_dir: Path) -> None:
+    """Replace target_dir with a freshly built directory"""
+    old_dir = target_dir.with_name(target_dir.name + ".old")
+    if target_dir.exists():
+        if old_dir.exists():
+            shutil.rmtree(old_dir)
+        target_dir.rename(old_dir)
+    building_dir.rename(target_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chunk PDFs, embed them and write the vector index incrementally")
+    parser.add_argument("--pdf", action="append",
+                        help="PDF to ingest; repeat to ingest several (default: data/mahabharata.pdf)")
+    parser.add_argument("--doc-id", action="append", help="document ID per --pdf (default: file stem)")
+    parser.add_argument("--title", action="append", help="document title per --pdf (default: Mahabharata / file stem)")
+    parser.add_argument("--manifest", default=str(DATA_FOLDER / "ingest_manifest.json"))
+    parser.add_argument("--targets", default=os.getenv("INGEST_TARGETS", "pinecone"),
+                        help='where to write vectors: "pinecone", "local" or "pinecone,local"')
+    parser.add_argument("--pinecone-metadata", default=os.getenv("INGEST_PINECONE_METADATA", "full"),
+                        choices=["slim", "full"],
+                        help="full: Pinecone keeps the text and the rest of the metadata; slim: Pinecone keeps "
+                             "only IDs and filter fields and the text is served from the chunk store, which "
+                             "must then be deployed (CHUNK_STORE_DIR) on every API host")
+    parser.add_argument("--embedding-backend", default=EMBEDDING_BACKEND, choices=["torch", "onnx", "onnx-int8", "hash"])
+    parser.add_argument("--page-aligned", action="store_true",
+                        help="never let chunks span pages, so edits re-embed only the pages they touch")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="PDF extraction processes")
+    parser.add_argument("--pages-per-task", type=int, default=25)
+    parser.add_argument("--embed-batch", type=int, default=64)
+    parser.add_argument("--upsert-batch", type=int, default=100)
+    parser.add_argument("--upsert-workers", type=int, default=4)
+    parser.add_argument("--max-in-flight", type=int, default=8, help="index writes outstanding at once")
+    args = parser.parse_args()
+
+    targets = {t.strip() for t in args.targets.split(",") if t.strip()}
+    print(f"Ingestion targets: {', '.join(sorted(targets))}")
+
+    # Prepare data folder and PDF paths
+    DATA_FOLDER.mkdir(exist_ok=True)
+    pdf_paths = [Path(p) for p in (args.pdf or [str(DATA_FOLDER / "mahabharata.pdf")])]
+    for pdf_path in pdf_paths:
+        if not pdf_path.exists():
+            print(f"Error: {pdf_path} not found. Please place your Mahabharata PDF in the data folder.")
+            exit(1)
+    doc_ids = args.doc_id or [p.stem for p in pdf_paths]
+    titles = args.title or ["Mahabharata" if p.stem == "mahabharata" else p.stem for p in pdf_paths]
+    if len(doc_ids) != len(pdf_paths) or len(titles) != len(pdf_paths):
+        print("Error: pass one --doc-id/--title per --pdf")
+        exit(1)
+
+    print(f"Loading embedding model ({EMBEDDING_MODEL_NAME}, {args.embedding_backend} backend)...")
+    model = get_embedder(args.embedding_backend)
+    dimension = model.dim
+
+    stats = {
+        "extract": StageStats("extract", "pages"),
+        "chunk": StageStats("chunk", "chunks"),
+        "embed": StageStats("embed", "vectors"),
+        "upsert": StageStats("upsert", "vectors"),
+    }
+    manifest = IngestManifest(Path(args.manifest))
+
+    index_name = "mahabharat"
+    index = None
+    uploader = None
+    if "pinecone" in targets:
+        index = connect_pinecone(index_name, dimension)
+        uploader = BoundedUploader(index, args.upsert_workers, args.max_in_flight, stats["upsert"])
+
+    # Chunks of the documents not being ingested, carried over into rebuilt local stores
+    ingesting = set(doc_ids)
+    other_ids = sorted({
+        chunk_id for other_id, doc in manifest.documents.items() if other_id not in ingesting
+        for chunk_id, _ in doc.get("chunks", [])
+    })
+
+    # The local index is rebuilt into a side directory and swapped in at the
+    # end; vectors are copied from the previous index (or from an interrupted
+    # build) whenever the chunk ID is already known, so only new text is embedded.
+    local_writer = None
+    local_sources = VectorSources()
+    if "local" in targets:
+        local_dir = Path(os.getenv("LOCAL_INDEX_DIR", str(DEFAULT_LOCAL_INDEX_DIR)))
+        building_dir = local_dir.with_name(local_dir.name + ".building")
+        salvage_dir = local_dir.with_name(local_dir.name + ".salvage")
+        if (local_dir / "manifest.json").exists():
+            previous_store = LocalVectorStore(local_dir)
+            local_sources.add(previous_store.ids, previous_store.vectors, previous_store.metadata)
+        if read_partial_index(building_dir) is not None:
+            if salvage_dir.exists():
+                shutil.rmtree(salvage_dir)
+            building_dir.rename(salvage_dir)
+        partial = read_partial_index(salvage_dir) if salvage_dir.exists() else None
+        if partial is not None:
+            print(f"Salvaged {len(partial[0])} vectors from an interrupted local index build")
+            local_sources.add(*partial)
+        local_writer = LocalIndexWriter(
+            building_dir,
+            dtype=os.getenv("LOCAL_INDEX_DTYPE", "float32"),
+            nlist=int(os.getenv("LOCAL_INDEX_NLIST", "0")),
+            model=EMBEDDING_MODEL_NAME,
+            entity_signatures=entity_signatures(),
+        )
+        missing = [i for i in other_ids if i not in local_sources]
+        if missing:
+            print(f"Warning: {len(missing)} chunks of other documents have no local vectors; re-ingest them with the local target")
+        copy_rows(local_writer, local_sources, [i for i in other_ids if i in local_sources])
+
+    # The chunk store that serves chunk text next to Pinecone is rebuilt the
+    # same way: records of other documents are copied from the previous store,
+    # and a resumed run reuses what the interrupted build already wrote
+    chunk_writer = None
+    if "pinecone" in targets:
+        chunk_dir = Path(os.getenv("CHUNK_STORE_DIR", str(DEFAULT_CHUNK_STORE_DIR)))
+        chunk_building_dir = chunk_dir.with_name(chunk_dir.name + ".building")
+        chunk_salvage_dir = chunk_dir.with_name(chunk_dir.name + ".salvage")
+        if (chunk_dir / "manifest.json").exists():
+            local_sources.add(*ChunkStore(chunk_dir).rows())
+        if read_partial_chunk_store(chunk_building_dir) is not None:
+            if chunk_salvage_dir.exists():
+                shutil.rmtree(chunk_salvage_dir)
+            chunk_building_dir.rename(chunk_salvage_dir)
+        partial = read_partial_chunk_store(chunk_salvage_dir) if chunk_salvage_dir.exists() else None
+        if partial is not None:
+            print(f"Salvaged {len(partial[0])} chunks from an interrupted chunk store build")
+            local_sources.add(*partial)
+        chunk_writer = ChunkStoreWriter(chunk_building_dir, dtype=os.getenv("CHUNK_STORE_VECTOR_DTYPE", "float32"))
+        carried = [i for i in other_ids if i in local_sources and local_sources.metadata(i) is not None]
+        if len(carried) < len(other_ids):
+            print(f"Warning: {len(other_ids) - len(carried)} chunks of other documents are not in the chunk store; "
+                  "re-ingest them to serve their text")
+        copy_rows(chunk_writer, local_sources, carried)
+
+    started = time.perf_counter()
+    total = 0
+    for pdf_path, doc_id, title in zip(pdf_paths, doc_ids, titles):
+        total += ingest_document(pdf_path, doc_id, title, args, model, manifest,
+                                 uploader, local_writer, chunk_writer, local_sources, stats)
+
+    if uploader is not None:
+        uploader.close()
+        print(f"Successfully ingested {total} chunks into Pinecone index '{index_name}'")
+        index_stats = index.describe_index_stats()
+        print(f"Index now contains {index_stats['total_vector_count']} vectors")
+    if chunk_writer is not None:
+        # Until the swap, queries that hit newly upserted chunks skip them
+        chunk_writer.close()
+        swap_in(chunk_building_dir, chunk_dir)
+        shutil.rmtree(chunk_salvage_dir, ignore_errors=True)
+        print(f"Successfully wrote {chunk_writer.count} chunks to chunk store at {chunk_dir}")
+    if local_writer is not None:
+        local_writer.close()
+        swap_in(building_dir, local_dir)
+        shutil.rmtree(salvage_dir, ignore_errors=True)
+        print(f"Successfully wrote {local_writer.count} vectors to local index at {local_dir}")
+
+    wall = time.perf_counter() - started
+    print(f"\nThroughput report ({wall:.1f}s wall clock)")
+    for stage in stats.values():
+        if stage.items:
+            print(stage.report())
+    print(f"{'overall':>8}: {stats['extract'].items / wall:.1f} pages/s, {total / wall:.1f} chunks/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_STORE_DIR = Path(__file__).parent / "data" / "chunks"
+# Seconds between checks for a re-ingested chunk store
+CHUNK_STORE_RELOAD_INTERVAL = float(os.getenv("CHUNK_STORE_RELOAD_INTERVAL", "5"))
+
+
+class ChunkStore:
+    """Chunk text, metadata and embeddings by chunk ID, read from memory-mapped files.
+
+    Lets the vector index carry only IDs and scores: ``get_many`` hydrates a
+    query's matches with one sorted pass over the record file and one fancy
+    index into the vector matrix. The files are opened read-only with
+    np.memmap, so every worker on the host shares the same page-cache pages.
+
+    Layout of the directory::
+
+        records.bin    metadata of every chunk as UTF-8 JSON, back to back
+        index.npy      (id, offset, length, row) sorted by id, for searchsorted
+        vectors.bin    row-aligned embedding matrix
+        manifest.json  count, dim, dtype, version; written last
+    """
+
+    def __init__(self, path=DEFAULT_CHUNK_STORE_DIR):
+        self.path = Path(path)
+        with open(self.path / "manifest.json", "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        count, dim = self.manifest["count"], self.manifest["dim"]
+        self.index = np.load(self.path / "index.npy")
+        size = (self.path / "records.bin").stat().st_size
+        # mmap cannot map an empty file
+        self.records = np.memmap(self.path / "records.bin", dtype=np.uint8, mode="r") if size else np.empty(0, np.uint8)
+        dtype = np.dtype(self.manifest["dtype"])
+        if count:
+            self.vectors = np.memmap(self.path / "vectors.bin", dtype=dtype, mode="r", shape=(count, dim))
+        else:
+            self.vectors = np.empty((0, dim), dtype=dtype)
+
+    @property
+    def version(self) -> str:
+        return self.manifest["version"]
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def _entries(self, ids: List[str]):
+        encoded = [i.encode("utf-8") for i in ids]
+        if not len(self.index):
+            return np.zeros(len(ids), dtype=bool), np.zeros(len(ids), dtype=self.index.dtype)
+        keys = np.array(encoded, dtype=self.index.dtype["id"])
+        positions = np.minimum(np.searchsorted(self.index["id"], keys), len(self.index) - 1)
+        # An ID longer than the widest stored one is truncated by the cast and must not match
+        fits = np.array([len(e) <= self.index.dtype["id"].itemsize for e in encoded])
+        found = (self.index["id"][positions] == keys) & fits
+        return found, self.index[positions]
+
+    def get_many(self, ids: List[str], include_values: bool = False) -> List[Optional[Dict]]:
+        """Metadata for each ID (None if unknown), in the given order; with
+        include_values also the stored embedding, under ``values``"""
+        if not ids:
+            return []
+        found, entries = self._entries(ids)
+        results: List[Optional[Dict]] = [None] * len(ids)
+        hits = np.flatnonzero(found)
+        # Read the records in file order so the pages are touched sequentially
+        for i in hits[np.argsort(entries["offset"][hits])]:
+            start, length = int(entries["offset"][i]), int(entries["length"][i])
+            results[i] = {"metadata": json.loads(self.records[start:start + length].tobytes())}
+        if include_values and len(hits):
+            rows = entries["row"][hits]
+            order = np.argsort(rows)
+            vectors = np.asarray(self.vectors[rows[order]], dtype=np.float32)
+            for i, vector in zip(hits[order], vectors):
+                results[i]["values"] = vector
+        return results
+
+    def rows(self):
+        """(ids, vectors, metadata) in row order, e.g. to copy into a new store"""
+        entries = self.index[np.argsort(self.index["row"])]
+        ids = [e.decode("utf-8") for e in entries["id"]]
+        metadata = [json.loads(self.records[int(o):int(o) + int(n)].tobytes())
+                    for o, n in zip(entries["offset"], entries["length"])]
+        return ids, self.vectors, metadata
+
+
+class ChunkStoreWriter:
+    """Streams chunk records into a ChunkStore directory.
+
+    Like LocalIndexWriter, the manifest is written last, so a half-written
+    store is unreadable rather than silently incomplete; until then
+    ``partial.json`` and an ``entries.jsonl`` log of the records written let
+    read_partial_chunk_store salvage the rows flushed by an interrupted run.
+    """
+
+    def __init__(self, path=DEFAULT_CHUNK_STORE_DIR, dtype: str = "float32"):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.dtype = np.dtype(dtype)
+        self.dim = None
+        self.count = 0
+        self.offset = 0
+        self._ids: List[str] = []
+        self._offsets: List[int] = []
+        self._lengths: List[int] = []
+        self.written = set()
+        manifest = self.path / "manifest.json"
+        if manifest.exists():
+            manifest.unlink()
+        self._records = open(self.path / "records.bin", "wb")
+        self._vectors = open(self.path / "vectors.bin", "wb")
+        self._entries = open(self.path / "entries.jsonl", "w", encoding="utf-8")
+
+    def add(self, ids: Iterable[str], vectors: np.ndarray, metadata: Iterable[Dict]) -> None:
+        """Append chunks; IDs already written are skipped"""
+        ids, metadata = list(ids), list(metadata)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            with open(self.path / "partial.json", "w", encoding="utf-8") as f:
+                json.dump({"dim": self.dim, "dtype": self.dtype.name}, f)
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dimensional vectors, got {vectors.shape[1]}")
+        keep = [i for i, chunk_id in enumerate(ids) if chunk_id not in self.written]
+        for i in keep:
+            record = json.dumps(metadata[i], ensure_ascii=False).encode("utf-8")
+            self._records.write(record)
+            self._ids.append(ids[i])
+            self._offsets.append(self.offset)
+            self._lengths.append(len(record))
+            self.offset += len(record)
+            self.written.add(ids[i])
+        if keep:
+            self._vectors.write(vectors[keep].astype(self.dtype).tobytes())
+        for n in range(self.count, self.count + len(keep)):
+            self._entries.write(json.dumps({"id": self._ids[n], "offset": self._offsets[n],
+                                            "length": self._lengths[n]}) + "\n")
+        self.count += len(keep)
+
+    def flush(self) -> None:
+        """Push buffered rows to disk so an interrupted run can salvage them"""
+        self._records.flush()
+        self._vectors.flush()
+        self._entries.flush()
+
+    def close(self) -> None:
+        self._records.close()
+        self._vectors.close()
+        self._entries.close()
+        for marker in ("entries.jsonl", "partial.json"):
+            if (self.path / marker).exists():
+                (self.path / marker).unlink()
+        width = max((len(i.encode("utf-8")) for i in self._ids), default=1)
+        index = np.zeros(self.count, dtype=[("id", f"S{width}"), ("offset", "<u8"), ("length", "<u4"), ("row", "<u4")])
+        index["id"] = [i.encode("utf-8") for i in self._ids]
+        index["offset"] = self._offsets
+        index["length"] = self._lengths
+        index["row"] = np.arange(self.count)
+        np.save(self.path / "index.npy", np.sort(index, order="id"))
+        manifest = {
+            "count": self.count,
+            "dim": self.dim or 0,
+            "dtype": self.dtype.name,
+            "version": f"{int(time.time())}-{uuid.uuid4().hex[:8]}",
+        }
+        with open(self.path / "manifest.json", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+
+
+def read_partial_chunk_store(path):
+    """Rows flushed by a ChunkStoreWriter that never reached close().
+
+    Returns (ids, vectors, metadata) covering only rows whose record and
+    vector were both fully written, or None if there is nothing to salvage.
+    """
+    path = Path(path)
+    if not (path / "partial.json").exists():
+        return None
+    with open(path / "partial.json", "r", encoding="utf-8") as f:
+        info = json.load(f)
+    dtype = np.dtype(info["dtype"])
+    records_size = (path / "records.bin").stat().st_size
+
+    entries = []
+    with open(path / "entries.jsonl", "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break
+            entry = json.loads(line)
+            if entry["offset"] + entry["length"] > records_size:
+                break
+            entries.append(entry)
+    rows = min(len(entries), (path / "vectors.bin").stat().st_size // (info["dim"] * dtype.itemsize))
+    if rows == 0:
+        return None
+    vectors = np.memmap(path / "vectors.bin", dtype=dtype, mode="r", shape=(rows, info["dim"]))
+    records = np.memmap(path / "records.bin", dtype=np.uint8, mode="r")
+    metadata = [json.loads(records[e["offset"]:e["offset"] + e["length"]].tobytes()) for e in entries[:rows]]
+    return [e["id"] for e in entries[:rows]], vectors, metadata
+
+
+class ReloadingChunkStore:
+    """The ChunkStore at ``path``, reopened when ingestion swaps in a new one.
+
+    Like CharacterRegistry, the manifest is checked at most every
+    ``reload_interval`` seconds. Each call works on one store snapshot, so a
+    lookup never mixes the files of two versions; the old store's maps stay
+    valid after its directory is removed. A store that can't be opened (the
+    swap is in progress) leaves the loaded one in place until the next check.
+    ``on_reload`` is called with the new store once it is being served. A
+    lookup racing the switch then caches new results under the old version,
+    which is never read again, and never old results under the new one.
+    """
+
+    def __init__(self, path=DEFAULT_CHUNK_STORE_DIR, reload_interval: float = CHUNK_STORE_RELOAD_INTERVAL,
+                 on_reload: Optional[Callable[[ChunkStore], None]] = None):
+        self.path = Path(path)
+        self.reload_interval = reload_interval
+        self.on_reload = on_reload
+        self._lock = threading.RLock()
+        self._manifest = self._manifest_stat()
+        self._store = ChunkStore(self.path)
+        self._checked = time.monotonic()
+        self.reloads = 0
+
+    def _manifest_stat(self):
+        try:
+            stat = (self.path / "manifest.json").stat()
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def current(self) -> ChunkStore:
+        now = time.monotonic()
+        if now - self._checked >= self.reload_interval:
+            with self._lock:
+                if now - self._checked >= self.reload_interval:
+                    self._checked = now
+                    manifest = self._manifest_stat()
+                    if manifest is not None and manifest != self._manifest:
+                        self._reload(manifest)
+        return self._store
+
+    def _reload(self, manifest) -> None:
+        try:
+            store = ChunkStore(self.path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Could not reload the chunk store at %s (%s), keeping the loaded one", self.path, e)
+            return
+        if store.version == self._store.version:
+            self._manifest = manifest
+            return
+        self._store = store
+        self._manifest = manifest
+        self.reloads += 1
+        logger.info("Chunk store reloaded (%d chunks, version %s)", len(store), store.version)
+        if self.on_reload is not None:
+            self.on_reload(store)
+
+    @property
+    def version(self) -> str:
+        return self.current().version
+
+    def __len__(self) -> int:
+        return len(self.current())
+
+    def get_many(self, ids: List[str], include_values: bool = False) -> List[Optional[Dict]]:
+        return self.current().get_many(ids, include_values)
+
+
+def chunk_store_from_env() -> Optional[ReloadingChunkStore]:
+    """The chunk store if one has been written (and CHUNK_STORE_ENABLED isn't false)"""
+    if os.getenv("CHUNK_STORE_ENABLED", "true").lower() != "true":
+        return None
+    path = Path(os.getenv("CHUNK_STORE_DIR", str(DEFAULT_CHUNK_STORE_DIR)))
+    if not (path / "manifest.json").exists():
+        return None
+    return ReloadingChunkStore(path)
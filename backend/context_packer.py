@@ -0,0 +1,296 @@
+import os
+import re
+import hashlib
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from resources import Component, register
+
+# Token counts use the tokenizer of the model that reads the prompt (Llama 3
+# for the default Together model). Until it is loaded, or if it can't be,
+# counts fall back to ~4 characters per token. It is only ever loaded by the
+# startup warm-up, never on the request path (it may have to be downloaded).
+PROMPT_TOKENIZER = os.getenv("PROMPT_TOKENIZER", "NousResearch/Meta-Llama-3-70B-Instruct")
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Chunks whose embeddings are at least this similar to a better-ranked one
+# are treated as repeats of the same passage
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.95"))
+# MMR trade-off: 1.0 ranks purely by relevance, lower values favour diversity
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+# A chunk that doesn't fit is cut to the remaining budget only if at least
+# this many tokens are left
+CONTEXT_MIN_PARTIAL_TOKENS = int(os.getenv("CONTEXT_MIN_PARTIAL_TOKENS", "80"))
+# Longest overlap looked for when joining adjacent chunks (ingestion uses 100)
+MAX_CHUNK_OVERLAP_CHARS = 400
+# Shorter shared text is taken for a coincidence (chunks split at a page
+# boundary or without overlap) and the chunks are joined with a space
+MIN_CHUNK_OVERLAP_CHARS = 20
+
+
+def _load_tokenizer():
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(PROMPT_TOKENIZER)
+
+
+tokenizer_component = register(Component("prompt_tokenizer", _load_tokenizer, required=False))
+
+
+def _estimate(text: str) -> int:
+    return max(1, len(text) // 4) if text else 0
+
+
+def _ready_tokenizer():
+    """The tokenizer if it has been loaded, without ever loading it"""
+    return tokenizer_component.get() if tokenizer_component.ready else None
+
+
+def count_tokens_many(texts: Sequence[str]) -> List[int]:
+    """Token counts for several texts in one tokenizer call"""
+    if not texts:
+        return []
+    tokenizer = _ready_tokenizer()
+    if tokenizer is None:
+        return [_estimate(t) for t in texts]
+    encoded = tokenizer(list(texts), add_special_tokens=False)["input_ids"]
+    return [len(ids) for ids in encoded]
+
+
+def count_tokens(text: str) -> int:
+    return count_tokens_many([text])[0] if text else 0
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to at most max_tokens, preferring a sentence boundary"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    tokenizer = _ready_tokenizer()
+    if tokenizer is not None:
+        ids = tokenizer(text, add_special_tokens=False)["input_ids"][:max_tokens]
+        cut = tokenizer.decode(ids)
+    else:
+        cut = text[:max_tokens * 4]
+    sentence_end = max(cut.rfind(". "), cut.rfind("? "), cut.rfind("! "))
+    if sentence_end > len(cut) // 2:
+        return cut[:sentence_end + 1]
+    return cut.rsplit(" ", 1)[0] + "..."
+
+
+def join_overlapping(left: str, right: str, max_overlap: int = MAX_CHUNK_OVERLAP_CHARS,
+                     min_overlap: int = MIN_CHUNK_OVERLAP_CHARS) -> str:
+    """Concatenate two consecutive chunks, dropping the text they share"""
+    for size in range(min(max_overlap, len(left), len(right)), max(min_overlap, 1) - 1, -1):
+        if left.endswith(right[:size]):
+            return left + right[size:]
+    return left + " " + right
+
+
+def _normalized_hash(text: str) -> str:
+    return hashlib.sha1(re.sub(r"\s+", " ", text.lower()).strip().encode("utf-8")).hexdigest()
+
+
+@dataclass
+class ContextItem:
+    """One passage in the prompt: a chunk, or a run of adjacent chunks merged"""
+    text: str
+    score: float
+    document_title: str
+    pages: List = field(default_factory=list)
+    chunk_ids: List = field(default_factory=list)
+    vector: Optional[np.ndarray] = None
+    tokens: int = 0
+    truncated: bool = False
+
+    @property
+    def page_label(self) -> str:
+        pages = [p for p in dict.fromkeys(self.pages) if p not in (None, "Unknown")]
+        if not pages:
+            return "Page Unknown"
+        if len(pages) == 1:
+            return f"Page {pages[0]}"
+        return f"Pages {pages[0]}-{pages[-1]}"
+
+
+def _chunk_text(chunk: Dict) -> str:
+    return chunk.get("text") or chunk.get("summary") or ""
+
+
+def merge_adjacent(chunks: List[Dict]) -> List[ContextItem]:
+    """Group retrieved chunks into items, merging consecutive chunk_ids of the
+    same document into a single passage with the overlap removed"""
+    groups: Dict = {}
+    singles = []
+    for chunk in chunks:
+        position = chunk.get("chunk_id")
+        document = chunk.get("doc_id") or chunk.get("document_title") or chunk.get("source")
+        if isinstance(position, (int, float)) and document is not None:
+            groups.setdefault(document, []).append(chunk)
+        else:
+            singles.append([chunk])
+
+    runs = list(singles)
+    for members in groups.values():
+        members.sort(key=lambda c: c["chunk_id"])
+        run = [members[0]]
+        for chunk in members[1:]:
+            if chunk["chunk_id"] == run[-1]["chunk_id"]:
+                continue  # the same chunk returned twice
+            if chunk["chunk_id"] == run[-1]["chunk_id"] + 1:
+                run.append(chunk)
+            else:
+                runs.append(run)
+                run = [chunk]
+        runs.append(run)
+
+    items = []
+    for run in runs:
+        text = _chunk_text(run[0])
+        for chunk in run[1:]:
+            text = join_overlapping(text, _chunk_text(chunk))
+        vectors = [c["embedding"] for c in run if c.get("embedding") is not None]
+        vector = None
+        if vectors:
+            vector = np.mean(np.asarray(vectors, dtype=np.float32), axis=0)
+            vector /= max(float(np.linalg.norm(vector)), 1e-12)
+        items.append(ContextItem(
+            text=text,
+            score=max(c.get("similarity_score", 0.0) for c in run),
+            document_title=run[0].get("document_title", "Mahabharata"),
+            pages=[c.get("page_number", "Unknown") for c in run],
+            chunk_ids=[c.get("chunk_id") for c in run],
+            vector=vector,
+        ))
+    items.sort(key=lambda item: item.score, reverse=True)
+    return items
+
+
+@dataclass
+class PackResult:
+    items: List[ContextItem]
+    stats: Dict
+
+
+def pack_context(chunks: List[Dict], query_vector=None, budget: int = CONTEXT_TOKEN_BUDGET,
+                 dedup_threshold: float = CONTEXT_DEDUP_THRESHOLD, mmr_lambda: float = CONTEXT_MMR_LAMBDA,
+                 min_partial_tokens: int = CONTEXT_MIN_PARTIAL_TOKENS) -> PackResult:
+    """Choose the passages to put in the prompt within ``budget`` tokens.
+
+    Adjacent chunks are merged, exact and near-duplicate passages (by
+    embedding similarity) dropped, and the rest picked greedily by maximal
+    marginal relevance until the budget is full. Without chunk embeddings the
+    selection falls back to relevance order.
+    """
+    candidates = merge_adjacent(chunks)
+    merged = len(chunks) - len(candidates)
+
+    # Exact repeats (e.g. the same passage ingested from two files)
+    seen, unique = set(), []
+    for item in candidates:
+        digest = _normalized_hash(item.text)
+        if item.text and digest not in seen:
+            seen.add(digest)
+            unique.append(item)
+    duplicates = len(candidates) - len(unique)
+    candidates = unique
+
+    has_vectors = bool(candidates) and all(item.vector is not None for item in candidates)
+    if has_vectors:
+        vectors = np.stack([item.vector for item in candidates])
+        similarity = vectors @ vectors.T
+        # Near-duplicates: drop a passage too similar to a better-ranked one
+        keep = []
+        for i in range(len(candidates)):
+            if not keep or similarity[i, keep].max() < dedup_threshold:
+                keep.append(i)
+        duplicates += len(candidates) - len(keep)
+        candidates = [candidates[i] for i in keep]
+        vectors = vectors[keep]
+        similarity = similarity[np.ix_(keep, keep)]
+        if query_vector is not None:
+            query = np.asarray(query_vector, dtype=np.float32)
+            relevance = vectors @ (query / max(float(np.linalg.norm(query)), 1e-12))
+        else:
+            relevance = np.array([item.score for item in candidates], dtype=np.float32)
+    else:
+        relevance = np.array([item.score for item in candidates], dtype=np.float32)
+
+    for item, tokens in zip(candidates, count_tokens_many([item.text for item in candidates])):
+        item.tokens = tokens
+
+    # Greedy MMR: relevance minus similarity to what is already selected
+    n = len(candidates)
+    selected: List[int] = []
+    redundancy = np.zeros(n, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    remaining = budget
+    truncated = 0
+    while available.any() and remaining > 0:
+        if has_vectors and selected:
+            mmr = mmr_lambda * relevance - (1 - mmr_lambda) * redundancy
+        else:
+            mmr = relevance.copy()
+        mmr[~available] = -np.inf
+        best = int(np.argmax(mmr))
+        available[best] = False
+
+        item = candidates[best]
+        if item.tokens > remaining:
+            if remaining < min_partial_tokens:
+                continue
+            item.text = truncate_to_tokens(item.text, remaining)
+            item.tokens = count_tokens(item.text)
+            item.truncated = True
+            truncated += 1
+        selected.append(best)
+        remaining -= item.tokens
+        if has_vectors:
+            redundancy = np.maximum(redundancy, similarity[best])
+
+    items = [candidates[i] for i in selected]
+    return PackResult(items, {
+        "retrieved_chunks": len(chunks),
+        "merged_chunks": merged,
+        "duplicates_dropped": duplicates,
+        "passages": len(items),
+        "truncated_passages": truncated,
+        "context_tokens": budget - remaining,
+        "context_budget": budget,
+        "diversity": has_vectors,
+    })
+
+
+class PromptStats:
+    """Rolling prompt-size figures across requests, for /stats (prompts are
+    composed on worker threads, hence the lock)"""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.duplicates_dropped = 0
+        self.merged_chunks = 0
+        self._prompt_tokens = deque(maxlen=window)
+        self._context_tokens = deque(maxlen=window)
+
+    def record(self, stats: Dict) -> None:
+        with self._lock:
+            self.requests += 1
+            self.duplicates_dropped += stats.get("duplicates_dropped", 0)
+            self.merged_chunks += stats.get("merged_chunks", 0)
+            self._prompt_tokens.append(stats.get("prompt_tokens", 0))
+            self._context_tokens.append(stats.get("context_tokens", 0))
+
+    def stats(self) -> Dict:
+        def summary(values):
+            if not values:
+                return None
+            return {"mean": float(np.mean(values)), "p50": float(np.percentile(values, 50)),
+                    "p95": float(np.percentile(values, 95)), "max": int(max(values))}
+
+        with self._lock:
+            prompt_tokens, context_tokens = list(self._prompt_tokens), list(self._context_tokens)
+            counts = {"requests": self.requests, "duplicates_dropped": self.duplicates_dropped,
+                      "merged_chunks": self.merged_chunks}
+        return dict(counts, prompt_tokens=summary(prompt_tokens), context_tokens=summary(context_tokens))
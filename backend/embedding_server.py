@@ -0,0 +1,287 @@
+"""Shared embedding server: one process owns the model for every API worker.
+
+With several uvicorn workers each one would otherwise load its own copy of
+the model (and PyTorch) and run its own thread pool on the same cores. In
+this mode a single process loads the model with EMBEDDING_THREADS threads,
+and the workers send it their queries over a Unix socket:
+
+    python embedding_server.py --socket /tmp/rag-embed.sock
+    EMBEDDING_SERVER_SOCKET=/tmp/rag-embed.sock uvicorn main:app --workers 4
+
+Texts from all connections go through one EmbeddingBatcher, so queries of
+different workers share a forward pass. Vectors don't travel over the
+socket: each connection gets a buffer file under --buffer-dir (/dev/shm by
+default), mapped by both sides, that the server writes the rows into; the
+reply only says how many rows are ready.
+
+Wire format, both directions: a 4-byte big-endian length, then UTF-8 JSON.
+The server opens with {"identity", "dim", "buffer", "max_rows"}; requests
+are {"texts": [...]} (answered with {"rows": n} or {"error": ...}) or
+{"op": "stats"}.
+"""
+import os
+import json
+import uuid
+import struct
+import signal
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+from batcher import EmbeddingBatcher
+from embeddings import get_embedder, EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND
+
+DEFAULT_SOCKET = os.getenv("EMBEDDING_SERVER_SOCKET", "/tmp/rag-embed.sock")
+DEFAULT_BUFFER_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+# Rows per connection buffer; longer requests are split by the client
+MAX_ROWS = int(os.getenv("EMBEDDING_SERVER_MAX_ROWS", "256"))
+
+HEADER = struct.Struct("!I")
+
+
+def _frame(message: dict) -> bytes:
+    data = json.dumps(message).encode("utf-8")
+    return HEADER.pack(len(data)) + data
+
+
+async def _read_message(reader: asyncio.StreamReader) -> dict:
+    (length,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return json.loads(await reader.readexactly(length))
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        part = sock.recv(size - len(data))
+        if not part:
+            raise ConnectionError("embedding server closed the connection")
+        data += part
+    return bytes(data)
+
+
+def _recv_message(sock: socket.socket) -> dict:
+    (length,) = HEADER.unpack(_recv_exactly(sock, HEADER.size))
+    return json.loads(_recv_exactly(sock, length))
+
+
+class EmbeddingServer:
+    """Serves one embedder to any number of Unix socket connections"""
+
+    def __init__(self, embedder, identity: str, buffer_dir=DEFAULT_BUFFER_DIR, max_rows: int = MAX_ROWS,
+                 max_batch_size: int = 64, max_wait_ms: float = 2.0):
+        self.embedder = embedder
+        self.identity = identity
+        self.buffer_dir = Path(buffer_dir)
+        self.max_rows = max_rows
+        self.connections = 0
+        self.requests = 0
+        self.buffers = set()
+        # One encode at a time: the model's own thread pool is the parallelism
+        self.batcher = EmbeddingBatcher(
+            self._encode,
+            executor=ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed"),
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+        )
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        return self.embedder.encode(texts, batch_size=len(texts))
+
+    def stats(self) -> dict:
+        return {"identity": self.identity, "connections": self.connections, "requests": self.requests,
+                **self.batcher.stats()}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        path = self.buffer_dir / f"rag-embed-{os.getpid()}-{uuid.uuid4().hex[:8]}.bin"
+        # Owner-only: the buffers hold query embeddings. memmap's "w+" keeps
+        # the mode of the file it resizes
+        os.close(os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600))
+        buffer = np.memmap(path, dtype=np.float32, mode="w+", shape=(self.max_rows, self.embedder.dim))
+        self.buffers.add(path)
+        self.connections += 1
+        try:
+            writer.write(_frame({"identity": self.identity, "dim": self.embedder.dim,
+                                 "buffer": str(path), "max_rows": self.max_rows}))
+            await writer.drain()
+            while True:
+                try:
+                    request = await _read_message(reader)
+                except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+                    # Client gone, or the server is shutting down
+                    break
+                if request.get("op") == "stats":
+                    reply = self.stats()
+                else:
+                    reply = await self._encode_into(buffer, request.get("texts", []))
+                writer.write(_frame(reply))
+                await writer.drain()
+        finally:
+            self.connections -= 1
+            writer.close()
+            del buffer
+            path.unlink(missing_ok=True)
+            self.buffers.discard(path)
+
+    async def _encode_into(self, buffer: np.memmap, texts: List[str]) -> dict:
+        if len(texts) > self.max_rows:
+            return {"error": f"at most {self.max_rows} texts per request"}
+        self.requests += 1
+        try:
+            vectors = await self.batcher.encode_many(texts)
+        except Exception as e:
+            return {"error": str(e) or type(e).__name__}
+        if vectors:
+            buffer[:len(vectors)] = np.stack(vectors)
+        return {"rows": len(vectors)}
+
+    async def serve(self, socket_path: str) -> None:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        # Bind the socket owner-only; the API workers run as the same user
+        umask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(self.handle, path=socket_path)
+        finally:
+            os.umask(umask)
+        print(f"Embedding server ({self.identity}) listening on {socket_path}")
+        serving = asyncio.ensure_future(server.serve_forever())
+        # Stop cleanly on SIGTERM too, so the buffer files don't outlive the server
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, serving.cancel)
+        try:
+            await serving
+        except asyncio.CancelledError:
+            pass
+        finally:
+            server.close()
+            for path in list(self.buffers):
+                path.unlink(missing_ok=True)
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+
+
+class _Connection:
+    def __init__(self, socket_path: str, timeout: float):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.connect(socket_path)
+            self.hello = _recv_message(self.sock)
+        except OSError:
+            self.sock.close()
+            raise
+        self.buffer = np.memmap(self.hello["buffer"], dtype=np.float32, mode="r",
+                                shape=(self.hello["max_rows"], self.hello["dim"]))
+
+    def request(self, message: dict) -> dict:
+        self.sock.sendall(_frame(message))
+        return _recv_message(self.sock)
+
+    def close(self) -> None:
+        self.sock.close()
+
+
+class RemoteEmbedder:
+    """Embedder interface backed by an embedding server.
+
+    Each calling thread gets its own connection (and buffer), so the
+    embedding executor can have several threads; ``stats()`` uses one extra
+    connection of its own, whichever thread calls it. A broken connection is
+    reopened once per request; encoding is idempotent, so a retried request
+    is harmless.
+    """
+
+    backend = "remote"
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET, expected_identity: Optional[str] = None,
+                 timeout: float = 30.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._stats_connection: Optional[_Connection] = None
+        self._stats_lock = threading.Lock()
+        hello = self._connection().hello
+        if expected_identity and hello["identity"] != expected_identity:
+            # Vectors of another model would silently poison the caches and the index
+            raise ValueError(f"Embedding server serves {hello['identity']}, expected {expected_identity}")
+        self.identity = hello["identity"]
+        self.dim = hello["dim"]
+
+    @property
+    def name(self) -> str:
+        return f"{self.identity}@{self.backend}"
+
+    def _connection(self) -> _Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = _Connection(self.socket_path, self.timeout)
+        return connection
+
+    def _request(self, message: dict) -> tuple:
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                return connection, connection.request(message)
+            except OSError:
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+
+    def encode(self, texts: List[str], batch_size: int = 32, show_progress_bar: bool = False) -> np.ndarray:
+        out = np.empty((len(texts), self.dim), dtype=np.float32)
+        start = 0
+        while start < len(texts):
+            connection = self._connection()
+            part = texts[start:start + connection.hello["max_rows"]]
+            connection, reply = self._request({"texts": part})
+            if "error" in reply:
+                raise RuntimeError(f"Embedding server error: {reply['error']}")
+            # The only copy: out of the shared buffer before it is reused
+            out[start:start + reply["rows"]] = connection.buffer[:reply["rows"]]
+            start += len(part)
+        return out
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            for attempt in range(2):
+                if self._stats_connection is None:
+                    self._stats_connection = _Connection(self.socket_path, self.timeout)
+                try:
+                    return self._stats_connection.request({"op": "stats"})
+                except OSError:
+                    self._stats_connection.close()
+                    self._stats_connection = None
+                    if attempt:
+                        raise
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", default=DEFAULT_SOCKET)
+    parser.add_argument("--embedding-backend", default=EMBEDDING_BACKEND, choices=["torch", "onnx", "onnx-int8", "hash"])
+    parser.add_argument("--threads", type=int, default=None, help="model threads (default EMBEDDING_THREADS or all cores)")
+    parser.add_argument("--buffer-dir", default=DEFAULT_BUFFER_DIR, help="where the shared result buffers live")
+    parser.add_argument("--max-batch", type=int, default=int(os.getenv("EMBEDDING_SERVER_MAX_BATCH", "64")))
+    parser.add_argument("--batch-window-ms", type=float, default=float(os.getenv("EMBEDDING_SERVER_BATCH_WINDOW_MS", "2")))
+    args = parser.parse_args()
+
+    print(f"Loading embedding model ({EMBEDDING_MODEL_NAME}, {args.embedding_backend} backend)...")
+    embedder = get_embedder(args.embedding_backend, threads=args.threads)
+    # Same identity the API derives from EMBEDDING_MODEL / EMBEDDING_BACKEND
+    server = EmbeddingServer(embedder, f"{EMBEDDING_MODEL_NAME}@{args.embedding_backend}", args.buffer_dir,
+                             max_batch_size=args.max_batch, max_wait_ms=args.batch_window_ms)
+    try:
+        asyncio.run(server.serve(args.socket))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+import os
+import re
+import json
+import zlib
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL", "intfloat/e5-base-v2")
+# "torch" (sentence-transformers), "onnx" (fp32 ONNX Runtime), "onnx-int8", or
+# "hash" (no model; for offline benchmarks only)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+DEFAULT_ONNX_DIR = Path(__file__).parent / "data" / "onnx"
+
+
+def _threads_from_env() -> Optional[int]:
+    threads = os.getenv("EMBEDDING_THREADS")
+    return int(threads) if threads else None
+
+
+class TorchEmbedder:
+    """The reference backend: full-precision PyTorch through sentence-transformers"""
+
+    backend = "torch"
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME, threads: Optional[int] = None):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if threads:
+            torch.set_num_threads(threads)
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    @property
+    def name(self) -> str:
+        return f"{self.model_name}@{self.backend}"
+
+    def encode(self, texts: List[str], batch_size: int = 32, show_progress_bar: bool = False) -> np.ndarray:
+        return self.model.encode(texts, batch_size=batch_size, show_progress_bar=show_progress_bar)
+
+
+def export_onnx(model_name: str = EMBEDDING_MODEL_NAME, out_dir=None, quantize: bool = True) -> Path:
+    """Export a sentence-transformers model's encoder to ONNX.
+
+    Writes ``model.onnx`` (and ``model.int8.onnx`` with dynamic int8 weight
+    quantization), the tokenizer, and ``embedding_config.json`` describing the
+    pooling so OnnxEmbedder reproduces the PyTorch output.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+
+    out_dir = Path(out_dir or DEFAULT_ONNX_DIR / model_name.replace("/", "__"))
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    st_model = SentenceTransformer(model_name, device="cpu")
+    transformer = st_model[0]
+    pooling = next(m for m in st_model if isinstance(m, Pooling))
+    if not pooling.pooling_mode_mean_tokens:
+        raise ValueError(f"{model_name} does not use mean pooling; only mean pooling is supported")
+    hf_model = transformer.auto_model.eval()
+    tokenizer = transformer.tokenizer
+
+    sample = tokenizer(["query: export sample"], return_tensors="pt")
+    input_names = list(sample.keys())
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    class Encoder(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs))).last_hidden_state
+
+    with torch.no_grad():
+        torch.onnx.export(
+            Encoder(hf_model),
+            tuple(sample[name] for name in input_names),
+            str(out_dir / "model.onnx"),
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+    tokenizer.save_pretrained(out_dir)
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(str(out_dir / "model.onnx"), str(out_dir / "model.int8.onnx"), weight_type=QuantType.QInt8)
+
+    with open(out_dir / "embedding_config.json", "w", encoding="utf-8") as f:
+        json.dump({
+            "model_name": model_name,
+            "input_names": input_names,
+            "max_seq_length": st_model.max_seq_length,
+            "normalize": any(isinstance(m, Normalize) for m in st_model),
+            "dim": st_model.get_sentence_embedding_dimension(),
+        }, f, indent=2)
+    print(f"Exported {model_name} to {out_dir}")
+    return out_dir
+
+
+class OnnxEmbedder:
+    """ONNX Runtime encoder with mean pooling, optionally int8-quantized.
+
+    The model is exported on first use if ``onnx_dir`` has no export yet.
+    ``threads`` sets ONNX Runtime's intra-op pool; leave it unset to use all
+    cores, or lower it when several processes share the host.
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME, quantized: bool = False,
+                 threads: Optional[int] = None, onnx_dir=None):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.backend = "onnx-int8" if quantized else "onnx"
+        onnx_dir = Path(onnx_dir or os.getenv("ONNX_MODEL_DIR") or DEFAULT_ONNX_DIR / model_name.replace("/", "__"))
+        model_file = onnx_dir / ("model.int8.onnx" if quantized else "model.onnx")
+        if not model_file.exists() or not (onnx_dir / "embedding_config.json").exists():
+            export_onnx(model_name, onnx_dir, quantize=quantized)
+
+        with open(onnx_dir / "embedding_config.json", "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+        self.dim = self.config["dim"]
+        self.tokenizer = AutoTokenizer.from_pretrained(onnx_dir)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(str(model_file), options, providers=["CPUExecutionProvider"])
+
+    @property
+    def name(self) -> str:
+        return f"{self.model_name}@{self.backend}"
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        tokens = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.config["max_seq_length"],
+            return_tensors="np",
+        )
+        feeds = {name: tokens[name].astype(np.int64) for name in self.config["input_names"]}
+        hidden = self.session.run(None, feeds)[0]
+        mask = feeds["attention_mask"][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.config["normalize"]:
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.astype(np.float32)
+
+    def encode(self, texts: List[str], batch_size: int = 32, show_progress_bar: bool = False) -> np.ndarray:
+        if not texts:
+            return np.empty((0, self.dim), dtype=np.float32)
+        # Sort by length so each batch pads to similar lengths, then restore order
+        order = np.argsort([len(t) for t in texts])
+        out = np.empty((len(texts), self.dim), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            rows = order[start:start + batch_size]
+            out[rows] = self._encode_batch([texts[i] for i in rows])
+        return out
+
+
+class HashingEmbedder:
+    """Feature-hashed bag of words: no model and no downloads.
+
+    Only for running benchmarks and the pipeline offline. Similar texts get
+    similar vectors, but retrieval quality is nowhere near a real model.
+    """
+
+    backend = "hash"
+
+    def __init__(self, model_name: str = "hashing", dim: int = 768):
+        self.model_name = model_name
+        self.dim = dim
+
+    @property
+    def name(self) -> str:
+        return f"{self.model_name}@{self.backend}"
+
+    def encode(self, texts: List[str], batch_size: int = 32, show_progress_bar: bool = False) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in re.findall(r"[a-z0-9']+", text.lower()):
+                digest = zlib.crc32(word.encode("utf-8"))
+                out[row, digest % self.dim] += 1.0 if digest & 1 << 31 else -1.0
+        out /= np.clip(np.linalg.norm(out, axis=1, keepdims=True), 1e-12, None)
+        return out
+
+
+def get_embedder(backend: Optional[str] = None, model_name: str = EMBEDDING_MODEL_NAME, threads: Optional[int] = None):
+    """Build the embedding backend selected by ``backend`` or EMBEDDING_BACKEND"""
+    backend = backend or EMBEDDING_BACKEND
+    threads = threads or _threads_from_env()
+    if backend == "torch":
+        return TorchEmbedder(model_name, threads=threads)
+    if backend in ("onnx", "onnx-int8"):
+        return OnnxEmbedder(model_name, quantized=backend == "onnx-int8", threads=threads)
+    if backend == "hash":
+        return HashingEmbedder()
+    raise ValueError(f"Unknown embedding backend '{backend}' (expected torch, onnx, onnx-int8 or hash)")
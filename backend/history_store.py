@@ -0,0 +1,300 @@
+import os
+import re
+import logging
+import time
+import uuid
+import asyncio
+from typing import Dict, List, Optional
+
+from cache import LRUCache
+from limits import limiter
+
+logger = logging.getLogger(__name__)
+
+# Prepended to the history returned by HistoryStore.get when older turns have
+# been folded into a summary; compose_prompt keeps it ahead of the recent turns
+SUMMARY_PREFIX = "Summary of earlier conversation: "
+
+# Deletes the compaction lock only if it still holds our token, so a worker
+# whose lock expired mid-compaction can't release another worker's lock
+RELEASE_LOCK = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token for English)"""
+    return max(1, len(text) // 4)
+
+
+def _first_sentence(text: str, max_chars: int = 200) -> str:
+    match = re.match(r"(.+?[.!?])(\s|$)", text, flags=re.S)
+    sentence = (match.group(1) if match else text).strip()
+    return sentence if len(sentence) <= max_chars else sentence[:max_chars].rsplit(" ", 1)[0] + "..."
+
+
+def summarize_extractive(previous: str, messages: List[str], max_tokens: int) -> str:
+    """Fold messages into a running summary without a model call.
+
+    Keeps the first sentence of each message and drops the oldest lines once
+    the summary exceeds ``max_tokens``.
+    """
+    lines = [line for line in previous.split("\n") if line] if previous else []
+    lines += [_first_sentence(m) for m in messages if m.strip()]
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+async def summarize_with_llm(previous: str, messages: List[str], max_tokens: int) -> str:
+    """Ask the LLM for a rolling summary; falls back to the extractive one"""
+    from llm import generate_async, LLMError
+
+    prompt = (
+        f"Summarize this conversation about the Mahabharata in at most {max_tokens * 3 // 4} words. "
+        "Keep names, the questions asked and the key facts given.\n\n"
+        + (f"Earlier summary:\n{previous}\n\n" if previous else "")
+        + "New messages:\n" + "\n".join(messages)
+    )
+    try:
+        summary = (await generate_async(prompt)).strip()
+    except LLMError:
+        return summarize_extractive(previous, messages, max_tokens)
+    if estimate_tokens(summary) > max_tokens:
+        summary = summary[:max_tokens * 4].rsplit(" ", 1)[0]
+    return summary
+
+
+SUMMARIZERS = {"extractive": summarize_extractive, "llm": summarize_with_llm}
+
+
+class HistoryStore:
+    """Per-session chat history in Redis with a local fallback.
+
+    Every read and every turn's write is a single pipelined round-trip, and
+    both refresh the session TTL so abandoned sessions expire. Writes are
+    mirrored into a bounded in-process LRU; while Redis is unreachable reads
+    and writes use that copy instead of silently dropping history, and Redis
+    is only retried every ``redis_retry`` seconds.
+
+    With summarization on (it is off by default), once ``compact_batch``
+    messages have accumulated beyond the ``keep_messages`` most recent, the
+    older ones are folded into a rolling summary in the background; the
+    batch is large so that compaction (a few round-trips, maybe an LLM call)
+    runs every few turns rather than on each one. The history handed to the
+    prompt is then the summary plus recent turns, trimmed to ``token_budget``.
+    """
+
+    def __init__(self, redis_client, max_messages: int = 50, ttl: Optional[int] = 7 * 86400,
+                 local_sessions: int = 10000, redis_timeout: float = 0.5, redis_retry: float = 5.0,
+                 summarize: bool = False, summarizer: str = "extractive", keep_messages: int = 4,
+                 compact_batch: int = 10, summary_tokens: int = 300, token_budget: int = 800):
+        if summarizer not in SUMMARIZERS:
+            raise ValueError(f"Unknown summarizer '{summarizer}' (expected {', '.join(SUMMARIZERS)})")
+        self.redis = redis_client
+        self.max_messages = max_messages
+        self.ttl = ttl or None
+        self.local = LRUCache(max_size=local_sessions, ttl=self.ttl)
+        self.redis_timeout = redis_timeout
+        self.redis_retry = redis_retry
+        self.summarize = summarize
+        self.summarizer = summarizer
+        self.keep_messages = keep_messages
+        self.compact_batch = max(1, compact_batch)
+        self.summary_tokens = summary_tokens
+        self.token_budget = token_budget
+        self._redis_down_until = 0.0
+        self._compacting = set()
+        self._tasks = set()
+        self.redis_errors = 0
+        self.fallback_reads = 0
+        self.fallback_writes = 0
+        self.compactions = 0
+
+    @staticmethod
+    def _key(session_id: str) -> str:
+        return f"history:{session_id}"
+
+    @staticmethod
+    def _summary_key(session_id: str) -> str:
+        return f"history:{session_id}:summary"
+
+    def _redis_usable(self) -> bool:
+        return self.redis is not None and time.monotonic() >= self._redis_down_until
+
+    def _redis_failed(self, error: Exception) -> None:
+        self.redis_errors += 1
+        if time.monotonic() >= self._redis_down_until:
+            logger.warning("History store falling back to local memory: %r", error)
+        self._redis_down_until = time.monotonic() + self.redis_retry
+
+    async def _execute(self, pipe) -> list:
+        return await asyncio.wait_for(pipe.execute(), timeout=self.redis_timeout)
+
+    def _fit(self, summary: str, messages: List[str]) -> List[str]:
+        """Summary plus the most recent messages that fit the token budget"""
+        history = []
+        budget = self.token_budget
+        if summary:
+            history.append(SUMMARY_PREFIX + summary.replace("\n", " "))
+            budget -= estimate_tokens(history[0])
+        recent = []
+        for message in reversed(messages):
+            cost = estimate_tokens(message)
+            if recent and cost > budget:
+                break
+            recent.append(message)
+            budget -= cost
+        return history + recent[::-1]
+
+    async def get(self, session_id: str, limit: int = 10) -> List[str]:
+        """Recent history for a session (oldest first), led by the summary if any"""
+        async with limiter("history").slot():
+            if self._redis_usable():
+                try:
+                    async with self.redis.pipeline(transaction=False) as pipe:
+                        pipe.lrange(self._key(session_id), -limit, -1)
+                        pipe.get(self._summary_key(session_id))
+                        messages, summary = await self._execute(pipe)
+                    return self._fit((summary or b"").decode(), [m.decode() for m in messages])
+                except Exception as e:
+                    self._redis_failed(e)
+            self.fallback_reads += 1
+            entry = self.local.get(session_id)
+            if entry is None:
+                return []
+            return self._fit(entry["summary"], entry["messages"][-limit:])
+
+    def _mirror(self, session_id: str, messages: tuple) -> Dict:
+        entry = self.local.get(session_id) or {"summary": "", "messages": []}
+        entry = {"summary": entry["summary"], "messages": (entry["messages"] + list(messages))[-self.max_messages:]}
+        self.local.set(session_id, entry)
+        return entry
+
+    async def append(self, session_id: str, *messages: str) -> None:
+        """Append messages (usually one user/bot turn) in a single round-trip"""
+        if not messages:
+            return
+        entry = self._mirror(session_id, messages)
+        length = len(entry["messages"])
+        async with limiter("history").slot():
+            if self._redis_usable():
+                try:
+                    key = self._key(session_id)
+                    async with self.redis.pipeline(transaction=False) as pipe:
+                        pipe.rpush(key, *messages)
+                        pipe.ltrim(key, -self.max_messages, -1)
+                        if self.ttl:
+                            pipe.expire(key, self.ttl)
+                            pipe.expire(self._summary_key(session_id), self.ttl)
+                        results = await self._execute(pipe)
+                    length = min(results[0], self.max_messages)
+                except Exception as e:
+                    self._redis_failed(e)
+                    self.fallback_writes += 1
+            else:
+                self.fallback_writes += 1
+
+        if (self.summarize and length >= self.keep_messages + self.compact_batch
+                and session_id not in self._compacting):
+            self._compacting.add(session_id)
+            task = asyncio.create_task(self._compact(session_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _compact(self, session_id: str) -> None:
+        """Fold everything but the newest keep_messages into the summary.
+
+        Only the head of the list is trimmed, so turns appended meanwhile are
+        kept; the lock key stops two workers folding the same messages.
+        """
+        try:
+            if self._redis_usable():
+                try:
+                    await self._compact_redis(session_id)
+                    return
+                except Exception as e:
+                    self._redis_failed(e)
+            entry = self.local.get(session_id)
+            if entry and len(entry["messages"]) > self.keep_messages:
+                old, recent = entry["messages"][:-self.keep_messages], entry["messages"][-self.keep_messages:]
+                summary = summarize_extractive(entry["summary"], old, self.summary_tokens)
+                self.local.set(session_id, {"summary": summary, "messages": recent})
+                self.compactions += 1
+        finally:
+            self._compacting.discard(session_id)
+
+    async def _compact_redis(self, session_id: str) -> None:
+        key, summary_key, lock_key = self._key(session_id), self._summary_key(session_id), f"history:{session_id}:lock"
+        token = uuid.uuid4().hex
+        if not await asyncio.wait_for(self.redis.set(lock_key, token, nx=True, ex=30), timeout=self.redis_timeout):
+            return
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.lrange(key, 0, -1)
+                pipe.get(summary_key)
+                messages, previous = await self._execute(pipe)
+            fold = len(messages) - self.keep_messages
+            if fold <= 0:
+                return
+            old = [m.decode() for m in messages[:fold]]
+            summary = SUMMARIZERS[self.summarizer](
+                (previous or b"").decode(), old, self.summary_tokens)
+            if asyncio.iscoroutine(summary):
+                summary = await summary
+
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.ltrim(key, fold, -1)
+                pipe.set(summary_key, summary, ex=self.ttl)
+                await self._execute(pipe)
+            self.compactions += 1
+
+            entry = self.local.get(session_id)
+            if entry is not None:
+                self.local.set(session_id, {"summary": summary, "messages": entry["messages"][-self.keep_messages:]})
+        finally:
+            try:
+                await asyncio.wait_for(self.redis.eval(RELEASE_LOCK, 1, lock_key, token), timeout=self.redis_timeout)
+            except Exception as e:
+                # The lock expires on its own
+                self._redis_failed(e)
+
+    async def clear(self, session_id: str) -> None:
+        self.local.pop(session_id)
+        if self._redis_usable():
+            try:
+                await asyncio.wait_for(self.redis.delete(self._key(session_id), self._summary_key(session_id)),
+                                       timeout=self.redis_timeout)
+            except Exception as e:
+                self._redis_failed(e)
+
+    def stats(self) -> Dict:
+        return {
+            "redis_available": self._redis_usable(),
+            "redis_errors": self.redis_errors,
+            "fallback_reads": self.fallback_reads,
+            "fallback_writes": self.fallback_writes,
+            "compactions": self.compactions,
+            "summarize": self.summarize,
+            "local": self.local.stats(),
+        }
+
+
+def history_store_from_env(redis_client) -> HistoryStore:
+    return HistoryStore(
+        redis_client,
+        max_messages=int(os.getenv("HISTORY_MAX_MESSAGES", "50")),
+        ttl=int(os.getenv("HISTORY_TTL", str(7 * 86400))),
+        local_sessions=int(os.getenv("HISTORY_LOCAL_SESSIONS", "10000")),
+        redis_timeout=float(os.getenv("HISTORY_REDIS_TIMEOUT", "0.5")),
+        redis_retry=float(os.getenv("HISTORY_REDIS_RETRY", "5")),
+        summarize=os.getenv("HISTORY_SUMMARIZE", "false").lower() == "true",
+        summarizer=os.getenv("HISTORY_SUMMARIZER", "extractive"),
+        keep_messages=int(os.getenv("HISTORY_KEEP_MESSAGES", "4")),
+        compact_batch=int(os.getenv("HISTORY_COMPACT_BATCH", "10")),
+        summary_tokens=int(os.getenv("HISTORY_SUMMARY_TOKENS", "300")),
+        token_budget=int(os.getenv("HISTORY_TOKEN_BUDGET", "800")),
+    )
@@ -0,0 +1,138 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Dict
+
+
+class StageOverloaded(Exception):
+    """Raised when a pipeline stage cannot accept more work"""
+
+    def __init__(self, stage: str, reason: str):
+        super().__init__(f"{stage} stage is overloaded ({reason})")
+        self.stage = stage
+        self.reason = reason
+
+
+class StageLimiter:
+    """Caps in-flight work for one pipeline stage and queues the overflow.
+
+    Callers beyond ``max_concurrency`` wait for a slot. Once ``max_queue``
+    callers are already waiting, new ones are rejected straight away, and a
+    waiter that does not get a slot within ``queue_timeout`` seconds gives up.
+    Both cases raise StageOverloaded so the API can answer with a 429.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise StageOverloaded(self.name, "queue full")
+
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise StageOverloaded(self.name, "queue timeout")
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self._semaphore.release()
+
+    def stats(self) -> Dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+
+class RateLimiter:
+    """Token bucket: ``rate`` acquisitions per second on average, with bursts
+    of up to ``burst``. A rate of 0 disables limiting."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = None
+        self._lock = asyncio.Lock()
+        self.waited = 0.0
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        # The lock keeps waiters in arrival order
+        async with self._lock:
+            now = loop.time()
+            if self._updated is not None:
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1:
+                delay = (1 - self._tokens) / self.rate
+                self.waited += delay
+                await asyncio.sleep(delay)
+                self._tokens = 1.0
+                self._updated = loop.time()
+            self._tokens -= 1
+
+
+# Default concurrency per stage. Embedding callers are coalesced by the
+# batcher, so this bounds how many queries can wait for the next batch; the
+# rest are network bound and can overlap a lot.
+DEFAULT_CONCURRENCY = {
+    "embedding": 64,
+    "vector": 16,
+    "llm": 32,
+    "history": 64,
+}
+
+DEFAULT_MAX_QUEUE = int(os.getenv("STAGE_MAX_QUEUE", "100"))
+DEFAULT_QUEUE_TIMEOUT = float(os.getenv("STAGE_QUEUE_TIMEOUT", "10"))
+
+
+def _limiter_from_env(name: str, default_concurrency: int) -> StageLimiter:
+    prefix = name.upper()
+    return StageLimiter(
+        name,
+        max_concurrency=int(os.getenv(f"{prefix}_CONCURRENCY", str(default_concurrency))),
+        max_queue=int(os.getenv(f"{prefix}_MAX_QUEUE", str(DEFAULT_MAX_QUEUE))),
+        queue_timeout=float(os.getenv(f"{prefix}_QUEUE_TIMEOUT", str(DEFAULT_QUEUE_TIMEOUT))),
+    )
+
+
+LIMITERS: Dict[str, StageLimiter] = {
+    name: _limiter_from_env(name, concurrency) for name, concurrency in DEFAULT_CONCURRENCY.items()
+}
+
+
+def limiter(name: str) -> StageLimiter:
+    """Get the limiter for a pipeline stage"""
+    return LIMITERS[name]
+
+
+def limiter_stats() -> Dict[str, Dict]:
+    return {name: lim.stats() for name, lim in LIMITERS.items()}
@@ -0,0 +1,471 @@
+import os
+import time
+import asyncio
+import logging
+import importlib.util
+from collections import deque
+from typing import Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+from limits import limiter
+from resources import Component, ComponentUnavailable, register
+from telemetry import counter
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = "You are an expert on the Mahabharata. Provide accurate, helpful responses based on the epic. When responding as a character, stay true to their personality and perspective."
+TOGETHER_MODEL = "meta-llama/Llama-3-70b-chat-hf"
+COHERE_MODEL = "command-r-plus"
+MAX_TOKENS = 512
+TEMPERATURE = 0.7
+
+# Send the same request to the secondary provider when the primary hasn't
+# answered within its recent p95 latency, and take whichever answers first
+HEDGING_ENABLED = os.getenv("LLM_HEDGING", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1.0"))
+# Used until a provider has enough latency samples for a percentile
+HEDGE_DEFAULT_DELAY = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "8.0"))
+HEDGE_MIN_SAMPLES = 20
+
+
+class LLMError(Exception):
+    """No provider produced an answer; the message is safe to show to users"""
+
+
+class ProviderUnavailable(Exception):
+    """The provider is not configured or its circuit is open"""
+
+
+class CircuitBreaker:
+    """Stops sending traffic to a provider after repeated failures.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    calls are refused immediately. After ``reset_timeout`` seconds one trial
+    call is let through (half-open); success closes the circuit, failure
+    opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._trial_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            self._trial_in_flight = False
+        if self.state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        self._trial_in_flight = False
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                self.times_opened += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """A call was abandoned (e.g. lost a hedge) without an outcome"""
+        self._trial_in_flight = False
+
+
+class ProviderStats:
+    def __init__(self, window: int = 500):
+        self.requests = 0
+        self.successes = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.hedges_won = 0
+        self._latencies = deque(maxlen=window)
+
+    def record_latency(self, seconds: float) -> None:
+        self._latencies.append(seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if len(self._latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return float(np.percentile(self._latencies, pct))
+
+    def as_dict(self) -> Dict:
+        latencies = np.array(self._latencies) * 1000 if self._latencies else None
+        return {
+            "requests": self.requests,
+            "successes": self.successes,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "rejected_by_breaker": self.rejected,
+            "cancelled": self.cancelled,
+            "hedges_won": self.hedges_won,
+            "latency_ms_p50": float(np.percentile(latencies, 50)) if latencies is not None else None,
+            "latency_ms_p95": float(np.percentile(latencies, 95)) if latencies is not None else None,
+        }
+
+
+class LLMProvider:
+    """One LLM API behind a long-lived client, a timeout and a circuit breaker"""
+
+    name = "base"
+    display_name = "AI"
+
+    def __init__(self, client_component: Component, api_key_env: str, sdk_available: bool, timeout: float,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.client_component = client_component
+        self.api_key_env = api_key_env
+        self.sdk_available = sdk_available
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker(
+            failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+            reset_timeout=float(os.getenv("LLM_BREAKER_RESET", "30")),
+        )
+        self.stats = ProviderStats()
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.sdk_available and os.getenv(self.api_key_env))
+
+    @property
+    def client(self):
+        return self.client_component.get()
+
+    def _admit(self) -> None:
+        if not self.configured:
+            raise ProviderUnavailable(f"{self.display_name} is not configured")
+        if not self.breaker.allow():
+            self.stats.rejected += 1
+            raise ProviderUnavailable(f"{self.display_name} circuit is open")
+        self.stats.requests += 1
+
+    async def _generate(self, prompt: str) -> str:
+        raise NotImplementedError
+
+    def _stream(self, prompt: str):
+        raise NotImplementedError
+
+    async def generate(self, prompt: str) -> str:
+        self._admit()
+        started = time.perf_counter()
+        try:
+            text = await asyncio.wait_for(self._generate(prompt), timeout=self.timeout)
+        except asyncio.CancelledError:
+            self.stats.cancelled += 1
+            self.breaker.release()
+            raise
+        except asyncio.TimeoutError:
+            self.stats.timeouts += 1
+            self.stats.failures += 1
+            self.breaker.record_failure()
+            raise TimeoutError(f"{self.display_name} did not answer within {self.timeout:.0f}s")
+        except Exception:
+            self.stats.failures += 1
+            self.breaker.record_failure()
+            raise
+        self.stats.record_latency(time.perf_counter() - started)
+        self.stats.successes += 1
+        self.breaker.record_success()
+        return text
+
+    async def stream(self, prompt: str):
+        """Yield tokens; the timeout applies to the wait for each token"""
+        self._admit()
+        started = time.perf_counter()
+        stream = self._stream(prompt)
+        try:
+            while True:
+                try:
+                    token = await asyncio.wait_for(stream.__anext__(), timeout=self.timeout)
+                except StopAsyncIteration:
+                    break
+                yield token
+        except (asyncio.CancelledError, GeneratorExit):
+            self.stats.cancelled += 1
+            self.breaker.release()
+            raise
+        except asyncio.TimeoutError:
+            self.stats.timeouts += 1
+            self.stats.failures += 1
+            self.breaker.record_failure()
+            raise TimeoutError(f"{self.display_name} stream stalled for {self.timeout:.0f}s")
+        except Exception:
+            self.stats.failures += 1
+            self.breaker.record_failure()
+            raise
+        finally:
+            await _aclose(stream)
+        self.stats.record_latency(time.perf_counter() - started)
+        self.stats.successes += 1
+        self.breaker.record_success()
+
+    def status(self) -> Dict:
+        return dict(self.stats.as_dict(), configured=self.configured, circuit=self.breaker.state,
+                    circuit_opened=self.breaker.times_opened, timeout=self.timeout)
+
+
+async def _aclose(stream) -> None:
+    """Close an upstream stream so the provider stops generating"""
+    close = getattr(stream, "aclose", None) or getattr(stream, "close", None)
+    if close is None:
+        return
+    try:
+        result = close()
+        if asyncio.iscoroutine(result):
+            await result
+    except Exception:
+        pass
+
+
+class TogetherProvider(LLMProvider):
+    name = "together"
+    display_name = "Together"
+
+    def _request(self, prompt: str, stream: bool):
+        return self.client.chat.completions.create(
+            model=TOGETHER_MODEL,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            max_tokens=MAX_TOKENS,
+            temperature=TEMPERATURE,
+            stream=stream
+        )
+
+    async def _generate(self, prompt: str) -> str:
+        response = await self._request(prompt, stream=False)
+        return response.choices[0].message.content
+
+    async def _stream(self, prompt: str):
+        stream = await self._request(prompt, stream=True)
+        try:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                token = chunk.choices[0].delta.content
+                if token:
+                    yield token
+        finally:
+            await _aclose(stream)
+
+
+class CohereProvider(LLMProvider):
+    name = "cohere"
+    display_name = "Cohere"
+
+    async def _generate(self, prompt: str) -> str:
+        co_response = await self.client.generate(
+            model=COHERE_MODEL,
+            prompt=prompt,
+            max_tokens=MAX_TOKENS,
+            temperature=TEMPERATURE
+        )
+        return co_response.generations[0].text
+
+    async def _stream(self, prompt: str):
+        stream = self.client.generate_stream(
+            model=COHERE_MODEL,
+            prompt=prompt,
+            max_tokens=MAX_TOKENS,
+            temperature=TEMPERATURE
+        )
+        try:
+            async for event in stream:
+                if getattr(event, "event_type", None) == "text-generation" and event.text:
+                    yield event.text
+        finally:
+            await _aclose(stream)
+
+
+# Long-lived async clients: created once, so HTTP connections and TLS sessions
+# are pooled across requests. Base URLs can point at local stub servers.
+TOGETHER_AVAILABLE = importlib.util.find_spec("together") is not None
+COHERE_AVAILABLE = importlib.util.find_spec("cohere") is not None
+
+
+def _create_async_together():
+    from together import AsyncTogether
+
+    kwargs = {"api_key": os.getenv("TOGETHER_API_KEY"), "max_retries": 0,
+              "timeout": float(os.getenv("TOGETHER_TIMEOUT", "30"))}
+    if os.getenv("TOGETHER_BASE_URL"):
+        kwargs["base_url"] = os.getenv("TOGETHER_BASE_URL")
+    return AsyncTogether(**kwargs)
+
+
+def _create_async_cohere():
+    import cohere
+
+    kwargs = {"timeout": float(os.getenv("COHERE_TIMEOUT", "30"))}
+    if os.getenv("COHERE_BASE_URL"):
+        kwargs["base_url"] = os.getenv("COHERE_BASE_URL")
+    return cohere.AsyncClient(os.getenv("COHERE_API_KEY"), **kwargs)
+
+
+together_component = register(Component("together_client", _create_async_together, required=False))
+cohere_component = register(Component("cohere_client", _create_async_cohere, required=False))
+
+together_provider = TogetherProvider(together_component, "TOGETHER_API_KEY", TOGETHER_AVAILABLE,
+                                     timeout=float(os.getenv("TOGETHER_TIMEOUT", "30")))
+cohere_provider = CohereProvider(cohere_component, "COHERE_API_KEY", COHERE_AVAILABLE,
+                                 timeout=float(os.getenv("COHERE_TIMEOUT", "30")))
+# Tried in order: primary first, the rest as fallbacks (and hedges)
+PROVIDERS: List[LLMProvider] = [together_provider, cohere_provider]
+
+
+def error_message(errors: Dict[str, Exception]) -> str:
+    """User-facing message when every provider failed"""
+    if not errors:
+        return "No AI service is available. Please check your API configuration."
+    if len(errors) == 1:
+        name, error = next(iter(errors.items()))
+        service = "AI service" if name == "Together" else f"{name} AI service"
+        return f"I apologize, but I'm having trouble accessing the {service}. Error: {str(error)}"
+    details = ", ".join(f"{name}: {str(error)}" for name, error in errors.items())
+    return f"I apologize, but I'm having trouble accessing the AI services. Errors: {details}"
+
+
+def _candidates() -> List[LLMProvider]:
+    return [p for p in PROVIDERS if p.configured]
+
+
+LLM_ANSWERS = counter("llm_answers", "Answers generated, by the provider that produced them", ("provider", "role"))
+
+
+def _answered(provider: LLMProvider) -> None:
+    candidates = _candidates()
+    LLM_ANSWERS.inc(provider.name, "primary" if candidates and provider is candidates[0] else "fallback")
+
+
+def hedge_delay(provider: LLMProvider) -> float:
+    observed = provider.stats.percentile(HEDGE_PERCENTILE)
+    return max(HEDGE_MIN_DELAY, observed if observed is not None else HEDGE_DEFAULT_DELAY)
+
+
+async def _call(provider: LLMProvider, prompt: str, errors: Dict[str, Exception]) -> Optional[str]:
+    try:
+        text = await provider.generate(prompt)
+        _answered(provider)
+        return text
+    except ProviderUnavailable as e:
+        errors.setdefault(provider.display_name, e)
+    except (ComponentUnavailable, Exception) as e:
+        logger.warning("Error calling %s API: %s", provider.display_name, e)
+        errors[provider.display_name] = e
+    return None
+
+
+async def _hedged(primary: LLMProvider, secondary: LLMProvider, prompt: str, errors: Dict[str, Exception]) -> Optional[str]:
+    first = asyncio.ensure_future(_call(primary, prompt, errors))
+    pending = {first}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=hedge_delay(primary))
+        if done:
+            result = first.result()
+            return result if result is not None else await _call(secondary, prompt, errors)
+
+        second = asyncio.ensure_future(_call(secondary, prompt, errors))
+        pending.add(second)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.result() is not None:
+                    if task is second:
+                        secondary.stats.hedges_won += 1
+                    return task.result()
+        return None
+    finally:
+        # The loser is cancelled, which closes its HTTP request; that is not
+        # a provider failure so it doesn't count against its breaker
+        for task in pending:
+            task.cancel()
+
+
+async def generate_async(prompt: str, hedge: bool = True) -> str:
+    """Generate an answer from the first healthy provider; raises LLMError.
+
+    Providers whose circuit is open are skipped without waiting. With
+    LLM_HEDGING (and ``hedge``) the next provider is also asked once the
+    primary is slower than its recent p95.
+    """
+    errors: Dict[str, Exception] = {}
+    providers = _candidates()
+    async with limiter("llm").slot():
+        i = 0
+        while i < len(providers):
+            provider = providers[i]
+            if hedge and HEDGING_ENABLED and i + 1 < len(providers) and providers[i + 1].breaker.state != "open":
+                result = await _hedged(provider, providers[i + 1], prompt, errors)
+                i += 2
+            else:
+                result = await _call(provider, prompt, errors)
+                i += 1
+            if result is not None:
+                return result
+    raise LLMError(error_message({k: v for k, v in errors.items() if not isinstance(v, ProviderUnavailable)} or errors))
+
+
+# Yielded by stream_llm when it abandons a partial answer and restarts on the
+# next provider, so clients know to discard the text shown so far.
+STREAM_RESET = object()
+
+
+async def stream_llm(prompt: str):
+    """Stream answer tokens from the first healthy provider, falling back in order.
+
+    If the consumer stops iterating (e.g. the client disconnected) the
+    upstream request is closed so no more tokens are generated.
+    """
+    errors: Dict[str, Exception] = {}
+    async with limiter("llm").slot():
+        for provider in _candidates():
+            emitted = False
+            try:
+                async for token in provider.stream(prompt):
+                    emitted = True
+                    yield token
+                _answered(provider)
+                return
+            except ProviderUnavailable as e:
+                errors.setdefault(provider.display_name, e)
+                continue
+            except (ComponentUnavailable, Exception) as e:
+                logger.warning("Error streaming from %s API: %s", provider.display_name, e)
+                errors[provider.display_name] = e
+            if emitted:
+                yield STREAM_RESET
+    raise LLMError(error_message({k: v for k, v in errors.items() if not isinstance(v, ProviderUnavailable)} or errors))
+
+
+def warm_up_clients() -> None:
+    for provider in PROVIDERS:
+        if provider.configured:
+            try:
+                provider.client
+            except ComponentUnavailable:
+                pass
+
+
+def llm_stats() -> Dict:
+    return {
+        "hedging": HEDGING_ENABLED,
+        "providers": {p.name: p.status() for p in PROVIDERS},
+    }
@@ -1,12 +1,59 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from models import ChatRequest, ChatResponse
-from utils import get_history, add_to_history
-from rag import retrieve_chunks, build_prompt, call_llm
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from models import ChatRequest, ChatResponse, BatchChatRequest
+from utils import get_history_async, add_to_history_async, history_store, ar as redis_async
+from rag import (
+    retrieve_with_vector_async, compose_prompt, CONTEXT_CANDIDATES, prompt_stats,
+    embedding_batcher, embedding_server_stats, cache_stats, answer_cache, ANSWER_CACHE_ENABLED, warm_up,
+)
+from llm import generate_async, LLMError, stream_llm, STREAM_RESET, llm_stats
+from answer_cache import depends_on_history
+from batch_chat import run_batch, BATCH_MAX_ITEMS
+from characters import character_registry
+from context_packer import count_tokens
+from resources import readiness
+from contextlib import asynccontextmanager
+from limits import StageOverloaded, limiter_stats
+from telemetry import (
+    configure_logging, RequestContextMiddleware, render_metrics, register_collector, counter, span, traced,
+)
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
 import json
+import logging
+import os
+import time
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 
-app = FastAPI()
+# "background": warm up after startup while /ready reports progress,
+# "blocking": finish warming up before accepting traffic, "off": load lazily
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "background")
+
+async def run_warm_up():
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(warm_up)
+        logger.info("Warm-up finished in %.1fs", time.perf_counter() - started)
+    except Exception as e:
+        logger.warning("Warm-up failed: %s", e)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warm_up_task = None
+    if STARTUP_WARMUP == "blocking":
+        await run_warm_up()
+    elif STARTUP_WARMUP == "background":
+        warm_up_task = asyncio.create_task(run_warm_up())
+    yield
+    if warm_up_task is not None and not warm_up_task.done():
+        warm_up_task.cancel()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -15,59 +62,285 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
     # Do NOT set allow_credentials=True if you use allow_origins=["*"]
 )
+# Added last so it wraps everything: request IDs, request latency, span logs
+app.add_middleware(RequestContextMiddleware)
+
 
+@app.exception_handler(StageOverloaded)
+async def stage_overloaded_handler(request: Request, exc: StageOverloaded):
+    """Shed load with a 429 instead of queueing without bound"""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc), "stage": exc.stage, "reason": exc.reason},
+        headers={"Retry-After": "1"},
+    )
 
 
 @app.get("/")
 async def root():
     return {"message": "Mahabharata RAG API is running"}
 
+@app.get("/ready")
+async def ready():
+    """Readiness probe: 200 once every required component is loaded, else 503"""
+    status = readiness()
+    try:
+        await asyncio.wait_for(redis_async.ping(), timeout=0.5)
+        status["components"]["redis"] = {"state": "ready", "required": False}
+    except Exception as e:
+        status["components"]["redis"] = {"state": "failed", "required": False, "error": str(e) or type(e).__name__}
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
 @app.get("/characters")
 async def get_characters():
     """Get available characters for character mode"""
-    try:
-        with open("character_profiles.json", "r", encoding="utf-8") as f:
-            data = json.load(f)
-        return [{"name": k, "description": v.get("summary", "")} for k, v in data.items()]
-    except FileNotFoundError:
-        return [
-            {"name": "Karna", "description": "Generous warrior"},
-            {"name": "Krishna", "description": "Divine guide"},
-            {"name": "Arjuna", "description": "Skilled archer"},
-            {"name": "Draupadi", "description": "Powerful queen"},
-            {"name": "Bhishma", "description": "Grand patriarch"},
-            {"name": "Yudhishthira", "description": "King of dharma"},
-            {"name": "Duryodhana", "description": "Rival king"}
-        ]
+    return character_registry.listing()
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(req: ChatRequest):
-    history = get_history(req.session_id)
-    retrieved_chunks = retrieve_chunks(req.message)
+@app.get("/stats")
+async def get_stats():
+    """Per-stage concurrency, queueing, batching, cache, LLM provider, history and prompt-size counters"""
+    return {
+        "stages": limiter_stats(),
+        "embedding_batcher": embedding_batcher.stats(),
+        "embedding_server": await asyncio.to_thread(embedding_server_stats),
+        "caches": cache_stats(),
+        "llm": llm_stats(),
+        "history": history_store.stats(),
+        "prompt": prompt_stats.stats(),
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint: stage and request latency histograms,
+    pipeline counters and the /stats counters as gauges and counters"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def runtime_metrics():
+    """Counters the components already keep, exported at scrape time"""
+    stages = limiter_stats()
+    yield ("stage_in_flight", "gauge", "Requests currently inside each stage",
+           [({"stage": name}, s["in_flight"]) for name, s in stages.items()])
+    yield ("stage_waiting", "gauge", "Requests queued for each stage",
+           [({"stage": name}, s["waiting"]) for name, s in stages.items()])
+    yield ("stage_rejected", "counter", "Requests shed with a 429 by each stage",
+           [({"stage": name, "reason": reason}, s[reason]) for name, s in stages.items()
+            for reason in ("rejected", "timed_out")])
+    yield ("embedding_batcher_queue_depth", "gauge", "Queries waiting for the next embedding batch",
+           [({}, embedding_batcher.stats()["queued"])])
+
+    caches = cache_stats()
+    lookups = []
+    for name in ("embedding", "retrieval"):
+        local, shared = caches[name]["local"], caches[name]["redis"]
+        lookups += [({"cache": name, "tier": "local", "result": "hit"}, local["hits"]),
+                    ({"cache": name, "tier": "local", "result": "miss"}, local["misses"]),
+                    ({"cache": name, "tier": "redis", "result": "hit"}, shared["hits"]),
+                    ({"cache": name, "tier": "redis", "result": "miss"}, shared["misses"])]
+    lookups += [({"cache": "answer", "tier": "local", "result": "hit"}, caches["answer"]["hits"]),
+                ({"cache": "answer", "tier": "local", "result": "miss"}, caches["answer"]["misses"])]
+    yield ("cache_lookups", "counter", "Cache lookups by cache, tier and result", lookups)
+
+    providers = llm_stats()["providers"]
+    yield ("llm_provider_calls", "counter", "LLM provider calls by outcome",
+           [({"provider": name, "outcome": outcome}, p[key]) for name, p in providers.items()
+            for outcome, key in (("success", "successes"), ("failure", "failures"), ("timeout", "timeouts"),
+                                 ("rejected", "rejected_by_breaker"), ("cancelled", "cancelled"))])
+    yield ("llm_hedges_won", "counter", "Hedged requests answered first by this provider",
+           [({"provider": name}, p["hedges_won"]) for name, p in providers.items()])
+    yield ("llm_circuit_open", "gauge", "1 while the provider's circuit breaker is open",
+           [({"provider": name}, int(p["circuit"] == "open")) for name, p in providers.items()])
+
+    history = history_store.stats()
+    yield ("history_fallbacks", "counter", "History reads and writes served from local memory",
+           [({"op": "read"}, history["fallback_reads"]), ({"op": "write"}, history["fallback_writes"])])
+    yield ("history_redis_errors", "counter", "Redis errors seen by the history store", [({}, history["redis_errors"])])
+
+register_collector(runtime_metrics)
+
+CHAT_ANSWERS = counter("chat_answers", "Chat answers by source (llm, cache, error)", ("source",))
+LLM_TOKENS = counter("llm_tokens", "Tokens sent to and generated by the LLM", ("kind",))
+
+def count_generated(ctx: "ChatContext", response: str) -> None:
+    LLM_TOKENS.inc("prompt", amount=(ctx.prompt_stats or {}).get("prompt_tokens", 0))
+    LLM_TOKENS.inc("completion", amount=count_tokens(response))
+
+@dataclass
+class ChatContext:
+    prompt: str
+    confidence: float
+    sources: Optional[List[Dict]]
+    query_vector: Optional[Any] = None
+    prompt_stats: Optional[Dict] = None
+    cache_scope: Optional[Tuple] = None  # set when the answer cache applies
+    cached: Optional[Dict] = None  # answer cache hit
+    cacheable: bool = False  # the answer may be stored for other sessions
+
+async def prepare_chat(req: ChatRequest) -> ChatContext:
+    """Fetch history and context for a request, check the semantic answer
+    cache and, on a miss, build the LLM prompt"""
+    history, (retrieved_chunks, query_vector) = await asyncio.gather(
+        traced("history_read", get_history_async(req.session_id)),
+        traced("retrieval", retrieve_with_vector_async(req.message, CONTEXT_CANDIDATES, req.mode, req.character)),
+    )
+    
+    cache_scope = None
+    if (ANSWER_CACHE_ENABLED and not req.bypass_cache and query_vector is not None
+            and not depends_on_history(req.message, history)):
+        with span("answer_cache"):
+            cache_scope = answer_cache.scope_key(req.mode, req.character)
+            cached = answer_cache.lookup(cache_scope, query_vector)
+        if cached is not None:
+            # The cached answer carries its own sources; no prompt to pack
+            return ChatContext("", cached["confidence"], cached["sources"], query_vector,
+                               cache_scope=cache_scope, cached=cached)
     
+    # Packing (tokenizing, MMR) is CPU work; keep it off the event loop
+    with span("prompt"):
+        prompt, passages, stats = await asyncio.to_thread(
+            compose_prompt, req.message, history, req.mode, req.character, retrieved_chunks or None, query_vector
+        )
     if not retrieved_chunks:
-        prompt = build_prompt(req.message, history, req.mode, req.character, None)
         confidence = 0.0
         sources = None
     else:
-        prompt = build_prompt(req.message, history, req.mode, req.character, retrieved_chunks)
         confidence = max(chunk.get("similarity_score", 0.0) for chunk in retrieved_chunks)
+        # Cite the passages that made it into the prompt
         sources = [
             {
-                "title": chunk.get("document_title", "Mahabharata"),
-                "source": f"Page {chunk.get('page_number', 'Unknown')}",
+                "title": passage.document_title,
+                "source": passage.page_label,
                 "isWebSource": False
             }
-            for chunk in retrieved_chunks
+            for passage in passages
         ]
+    # Any history in the prompt may have shaped the answer ("and his
+    # brothers?"), so only answers generated without it are shared
+    return ChatContext(prompt, confidence, sources, query_vector, prompt_stats=stats, cache_scope=cache_scope,
+                       cacheable=cache_scope is not None and not history)
+
+def remember_answer(ctx: ChatContext, response: str) -> None:
+    """Store a freshly generated answer in the semantic answer cache"""
+    if ctx.cacheable and ctx.cached is None:
+        answer_cache.store(ctx.cache_scope, ctx.query_vector, {
+            "response": response,
+            "confidence": ctx.confidence,
+            "sources": ctx.sources,
+        })
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat_endpoint(req: ChatRequest):
+    ctx = await prepare_chat(req)
     
-    response = call_llm(prompt)
-    add_to_history(req.session_id, f"User: {req.message}")
-    add_to_history(req.session_id, f"Bot: {response}")
+    if ctx.cached is not None:
+        response = ctx.cached["response"]
+        confidence = ctx.cached["confidence"]
+        sources = ctx.cached["sources"]
+        CHAT_ANSWERS.inc("cache")
+    else:
+        confidence, sources = ctx.confidence, ctx.sources
+        try:
+            with span("llm"):
+                response = await generate_async(ctx.prompt)
+            remember_answer(ctx, response)
+            count_generated(ctx, response)
+            CHAT_ANSWERS.inc("llm")
+        except LLMError as e:
+            response = str(e)
+            CHAT_ANSWERS.inc("error")
+    with span("history_write"):
+        await add_to_history_async(req.session_id, f"User: {req.message}", f"Bot: {response}")
     
     return ChatResponse(
         response=response,
         character=req.character if req.mode == "character" else None,
         confidenceScore=confidence,
-        sources=sources
+        sources=sources,
+        promptStats=ctx.prompt_stats
     )
+
+def sse_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(req: ChatRequest):
+    """Stream the answer as Server-Sent Events.
+
+    Events: ``meta`` (sources, confidenceScore and promptStats, sent once
+    retrieval is done), ``token`` (answer text as it is generated), ``reset`` (discard the
+    text so far, the answer restarts on the fallback provider), ``error`` and
+    finally ``done``. History is only written once the answer is complete.
+    """
+    ctx = await prepare_chat(req)
+    
+    async def events():
+        cached = ctx.cached
+        yield sse_event("meta", {
+            "character": req.character if req.mode == "character" else None,
+            "confidenceScore": cached["confidence"] if cached else ctx.confidence,
+            "sources": cached["sources"] if cached else ctx.sources,
+            "promptStats": ctx.prompt_stats,
+        })
+        
+        if cached is not None:
+            response = cached["response"]
+            CHAT_ANSWERS.inc("cache")
+            yield sse_event("token", {"text": response})
+            with span("history_write"):
+                await add_to_history_async(req.session_id, f"User: {req.message}", f"Bot: {response}")
+            yield sse_event("done", {"response": response})
+            return
+        
+        parts = []
+        try:
+            with span("llm"):
+                async for token in stream_llm(ctx.prompt):
+                    if token is STREAM_RESET:
+                        parts = []
+                        yield sse_event("reset", {})
+                        continue
+                    parts.append(token)
+                    yield sse_event("token", {"text": token})
+        except StageOverloaded as e:
+            CHAT_ANSWERS.inc("error")
+            yield sse_event("error", {"detail": str(e), "stage": e.stage, "reason": e.reason})
+            return
+        except Exception as e:
+            logger.error("Error streaming response: %s", e)
+            CHAT_ANSWERS.inc("error")
+            yield sse_event("error", {"detail": f"I apologize, but I'm having trouble accessing the AI services. Error: {str(e)}"})
+            return
+        
+        # Only reached when the stream finished; a client disconnect cancels
+        # this generator (and the upstream call) before history is written.
+        response = "".join(parts)
+        remember_answer(ctx, response)
+        count_generated(ctx, response)
+        CHAT_ANSWERS.inc("llm")
+        with span("history_write"):
+            await add_to_history_async(req.session_id, f"User: {req.message}", f"Bot: {response}")
+        yield sse_event("done", {"response": response})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/chat/batch")
+async def chat_batch_endpoint(req: BatchChatRequest):
+    """Answer many independent questions (evaluation sets) in one request.
+
+    Questions are embedded and retrieved in large batches and the LLM calls
+    fan out up to ``concurrency`` at a time, at most ``rate_limit`` per
+    second. Results stream back as NDJSON, one line per item in completion
+    order (matched up by ``index``/``id``), then a ``summary`` line. No
+    session history is read or written.
+    """
+    if len(req.items) > BATCH_MAX_ITEMS:
+        return JSONResponse(status_code=413, content={"detail": f"At most {BATCH_MAX_ITEMS} items per batch"})
+    
+    async def lines():
+        async for result in run_batch(req.items, req.concurrency, req.rate_limit, req.bypass_cache):
+            yield json.dumps(result) + "\n"
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
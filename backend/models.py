@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Dict
 
 class Source(BaseModel):
     title: str
@@ -12,9 +12,23 @@ class ChatRequest(BaseModel):
     mode: str  # 'ai' or 'character'
     character: Optional[str] = None
     session_id: str
+    bypass_cache: bool = False  # skip the semantic answer cache for this request
 
 class ChatResponse(BaseModel):
     response: str
     character: Optional[str] = None
     confidenceScore: Optional[float] = None
     sources: Optional[List[Source]] = None
+    promptStats: Optional[Dict] = None  # prompt/context token counts and what the context packer dropped
+
+class BatchChatItem(BaseModel):
+    message: str
+    mode: str = "ai"
+    character: Optional[str] = None
+    id: Optional[str] = None  # echoed back so results can be matched up
+
+class BatchChatRequest(BaseModel):
+    items: List[BatchChatItem]
+    concurrency: Optional[int] = None  # LLM calls in flight (default BATCH_LLM_CONCURRENCY)
+    rate_limit: Optional[float] = None  # LLM calls per second, 0 for no limit (default BATCH_RATE_LIMIT)
+    bypass_cache: bool = False
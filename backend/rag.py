@@ -1,140 +1,298 @@
 import os
-import json
+import asyncio
+import logging
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional
 from dotenv import load_dotenv
-from sentence_transformers import SentenceTransformer
+from limits import limiter, StageOverloaded
+from embeddings import get_embedder, EMBEDDING_MODEL_NAME, EMBEDDING_BACKEND
+from batcher import EmbeddingBatcher
+from embedding_server import RemoteEmbedder
+from cache import LRUCache, TwoTierCache, normalize_query, cache_key, dump_vector, load_vector, dump_chunks, load_chunks
+from answer_cache import SemanticAnswerCache
+from resources import Component, ComponentUnavailable, register
+from utils import ar as redis_async
+from history_store import SUMMARY_PREFIX
+from context_packer import pack_context, count_tokens_many, tokenizer_component, PromptStats
+from vector_store import PineconeVectorStore, local_store_from_env
+from chunk_store import chunk_store_from_env
+from llm import warm_up_clients as warm_up_llm_clients, TOGETHER_AVAILABLE, COHERE_AVAILABLE
+from characters import character_registry
+from telemetry import counter, span
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 
-# Debug prints
-print("TOGETHER_API_KEY from env:", os.getenv("TOGETHER_API_KEY"))
+# Heavy resources are built on first use (or by the warm-up in main.py's
+# lifespan), never at import time, so importing this module stays cheap.
 
-# Initialize Sentence Transformers model (same as ingestion)
-print("Loading sentence-transformers model for retrieval...")
-embedding_model = SentenceTransformer("intfloat/e5-base-v2")
+# Only check that the optional SDKs are installed; they are imported when the
+# component that needs them is first built.
+PINECONE_AVAILABLE = importlib.util.find_spec("pinecone") is not None
+for _name, _available in (("Pinecone", PINECONE_AVAILABLE), ("Together AI", TOGETHER_AVAILABLE), ("Cohere", COHERE_AVAILABLE)):
+    if not _available:
+        logger.warning("%s not available", _name)
 
-# Try to import required packages with fallbacks
-try:
+# Embedding model (same as ingestion); backend (torch / onnx / onnx-int8) is
+# chosen by EMBEDDING_BACKEND. With EMBEDDING_SERVER_SOCKET set, queries are
+# encoded by a shared embedding_server.py process instead of a model loaded
+# in every worker.
+EMBEDDING_SERVER_SOCKET = os.getenv("EMBEDDING_SERVER_SOCKET")
+
+def _load_embedding_model():
+    if EMBEDDING_SERVER_SOCKET:
+        logger.info("Connecting to the embedding server at %s", EMBEDDING_SERVER_SOCKET)
+        return RemoteEmbedder(EMBEDDING_SERVER_SOCKET, expected_identity=EMBEDDING_IDENTITY)
+    logger.info("Loading embedding model for retrieval")
+    return get_embedder()
+
+embedding_component = register(Component("embedding_model", _load_embedding_model))
+
+def embedding_server_stats() -> Optional[Dict]:
+    """Batching counters of the shared embedding server, when one is used"""
+    if not EMBEDDING_SERVER_SOCKET or not embedding_component.ready:
+        return None
+    try:
+        return embedding_component.get().stats()
+    except OSError as e:
+        return {"error": str(e) or type(e).__name__}
+
+# Encoding is CPU bound, so it gets its own small pool instead of competing
+# with network-bound work in the default executor.
+EMBEDDING_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("EMBED_WORKERS", "1")),
+    thread_name_prefix="embed",
+)
+
+def encode_batch(texts: List[str]):
+    """Encode a batch of queries in one forward pass"""
+    return embedding_component.get().encode(texts, batch_size=len(texts))
+
+# Concurrent queries arriving within a short window share one forward pass
+embedding_batcher = EmbeddingBatcher(
+    encode_batch,
+    executor=EMBEDDING_EXECUTOR,
+    max_batch_size=int(os.getenv("EMBED_MAX_BATCH", "32")),
+    max_wait_ms=float(os.getenv("EMBED_BATCH_WINDOW_MS", "5")),
+)
+
+# Vector index backend: "pinecone" (remote) or "local" (memory-mapped, in-process)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone")
+
+def _load_vector_store():
+    if VECTOR_BACKEND == "local":
+        store = local_store_from_env()
+        logger.info("Local vector index loaded (%d vectors, %s search)", len(store), store.mode)
+        return store
+    if not PINECONE_AVAILABLE:
+        raise RuntimeError("Pinecone not available")
     from pinecone import Pinecone
-    PINECONE_AVAILABLE = True
-except ImportError:
-    PINECONE_AVAILABLE = False
-    print("Warning: Pinecone not available")
-
-try:
-    from together import Together
-    TOGETHER_AVAILABLE = True
-except ImportError:
-    TOGETHER_AVAILABLE = False
-    print("Warning: Together AI not available")
-
-try:
-    import cohere
-    COHERE_AVAILABLE = True
-except ImportError:
-    COHERE_AVAILABLE = False
-    print("Warning: Cohere not available")
-
-# Initialize Pinecone if available
-if PINECONE_AVAILABLE:
+    
+    pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+    index = pc.Index("mahabharat")
+    logger.info("Pinecone initialized")
+    # Chunk text comes from the local chunk store when ingestion wrote one
+    # (slim Pinecone metadata); otherwise from the Pinecone metadata itself
+    chunk_store = chunk_store_from_env()
+    store = PineconeVectorStore(index, "mahabharat", chunk_store=chunk_store)
+    if chunk_store is not None:
+        logger.info("Chunk store loaded (%d chunks)", len(chunk_store))
+        # A re-ingestion swaps in a new store: serve it and move the caches
+        # to the new version without a restart
+        chunk_store.on_reload = lambda _: _on_vector_store_ready(store)
+    return store
+
+def _on_vector_store_ready(store) -> None:
+    version = cache_key(EMBEDDING_IDENTITY, store.version)[:12]
+    retrieval_cache.set_version(version)
+    # Answers were generated from the old index's chunks
+    answer_cache.set_version(version)
+
+vector_store_component = register(Component("vector_store", _load_vector_store, on_ready=_on_vector_store_ready))
+
+async def get_vector_store_async():
+    """The vector store, or None if it could not be initialized"""
     try:
-        pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-        index = pc.Index("mahabharat")
-        print("Pinecone initialized successfully")
-    except Exception as e:
-        print(f"Warning: Could not initialize Pinecone: {e}")
-        PINECONE_AVAILABLE = False
-
-# Load character profiles with proper error handling
-CHARACTER_PROFILES = {}
-try:
-    with open("character_profiles.json", "r", encoding="utf-8") as f:
-        content = f.read().strip()
-        if content:
-            CHARACTER_PROFILES = json.loads(content)
-            print(f"Loaded {len(CHARACTER_PROFILES)} character profiles")
-        else:
-            raise FileNotFoundError("Empty file")
-except (FileNotFoundError, json.JSONDecodeError) as e:
-    print(f"Warning: Could not load character_profiles.json ({e}), using fallback profiles")
-    # Fallback character profiles
-    CHARACTER_PROFILES = {
-        "Karna": {
-            "persona_prompt": "Respond as Karna: noble, generous, proud, and fiercely loyal to Duryodhana.",
-            "traits": ["Generous", "Loyal", "Courageous", "Proud"],
-            "summary": "Karna, son of Kunti and Surya, is known for his unwavering loyalty and generosity."
-        },
-        "Krishna": {
-            "persona_prompt": "Respond as Krishna: wise, compassionate, strategic, and divine guide.",
-            "traits": ["Wise", "Compassionate", "Strategic", "Divine"],
-            "summary": "Krishna, the divine guide, is known for his wisdom and compassion."
-        },
-        "Arjuna": {
-            "persona_prompt": "Respond as Arjuna: skilled archer, devoted student, conflicted warrior.",
-            "traits": ["Skilled", "Devoted", "Conflicted", "Noble"],
-            "summary": "Arjuna, the great archer, is known for his skill and moral dilemmas."
-        },
-        "Draupadi": {
-            "persona_prompt": "Respond as Draupadi: strong, intelligent, proud, and seeking justice.",
-            "traits": ["Strong", "Intelligent", "Proud", "Justice-seeking"],
-            "summary": "Draupadi, the queen of the Pandavas, is known for her strength and quest for justice."
-        },
-        "Bhishma": {
-            "persona_prompt": "Respond as Bhishma: wise grandfather, bound by vows, tragic figure.",
-            "traits": ["Wise", "Honorable", "Bound by duty", "Tragic"],
-            "summary": "Bhishma, the grand patriarch, is known for his wisdom and unwavering commitment to his vows."
-        },
-        "Yudhishthira": {
-            "persona_prompt": "Respond as Yudhishthira: righteous king, follower of dharma, sometimes conflicted.",
-            "traits": ["Righteous", "Dharmic", "Just", "Sometimes naive"],
-            "summary": "Yudhishthira, the eldest Pandava, is known for his commitment to dharma and righteousness."
-        },
-        "Duryodhana": {
-            "persona_prompt": "Respond as Duryodhana: proud prince, jealous of Pandavas, believes in his righteousness.",
-            "traits": ["Proud", "Jealous", "Strong-willed", "Ambitious"],
-            "summary": "Duryodhana, the Kaurava prince, is known for his pride and rivalry with the Pandavas."
-        }
+        return await vector_store_component.aget()
+    except ComponentUnavailable:
+        return None
+
+# Query caches: embeddings keyed on the normalized query, retrieved chunks on
+# the normalized query and top_k. Both keys carry a version so a new model or
+# re-ingested index never serves stale entries.
+CACHE_REDIS_ENABLED = os.getenv("CACHE_REDIS_ENABLED", "true").lower() == "true"
+
+embedding_cache = TwoTierCache(
+    "embedding",
+    LRUCache(int(os.getenv("EMBEDDING_CACHE_SIZE", "10000")), float(os.getenv("EMBEDDING_CACHE_TTL", "86400"))),
+    redis_async if CACHE_REDIS_ENABLED else None,
+    redis_ttl=int(os.getenv("EMBEDDING_CACHE_REDIS_TTL", "86400")),
+    dumps=dump_vector,
+    loads=load_vector,
+)
+retrieval_cache = TwoTierCache(
+    "retrieval",
+    LRUCache(int(os.getenv("RETRIEVAL_CACHE_SIZE", "2000")), float(os.getenv("RETRIEVAL_CACHE_TTL", "3600"))),
+    redis_async if CACHE_REDIS_ENABLED else None,
+    redis_ttl=int(os.getenv("RETRIEVAL_CACHE_REDIS_TTL", "3600")),
+    dumps=dump_chunks,
+    loads=load_chunks,
+)
+# Known without loading the model; the retrieval version is set once the
+# vector store is up (see _on_vector_store_ready)
+EMBEDDING_IDENTITY = f"{EMBEDDING_MODEL_NAME}@{EMBEDDING_BACKEND}"
+embedding_cache.set_version(cache_key(EMBEDDING_IDENTITY)[:12])
+
+# Answers for paraphrased questions within the same (mode, character)
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+answer_cache = SemanticAnswerCache(
+    max_entries=int(os.getenv("ANSWER_CACHE_SIZE", "20000")),
+    ttl=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+)
+
+# Retrieval fetches more chunks than fit in the prompt so the context packer
+# can skip overlapping ones and still fill its token budget
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "12"))
+prompt_stats = PromptStats()
+
+# Character mode searches the chunks that mention the character (entity
+# index built at ingestion): "filter" restricts the search to them, "boost"
+# ranks them CHARACTER_BOOST above the rest, "off" searches everything. The
+# scoped candidate set is focused enough to need fewer candidates.
+CHARACTER_RETRIEVAL = os.getenv("CHARACTER_RETRIEVAL", "filter")
+CHARACTER_BOOST = float(os.getenv("CHARACTER_BOOST", "0.05"))
+CHARACTER_CONTEXT_CANDIDATES = int(os.getenv("CHARACTER_CONTEXT_CANDIDATES", "8"))
+
+def retrieval_scope(vector_store, mode: str, character: Optional[str]) -> Optional[str]:
+    """The character to scope retrieval to, or None to search everything
+    (not character mode, unknown character, or an entity index built from
+    different aliases than the registry now has)"""
+    if CHARACTER_RETRIEVAL == "off" or mode != "character" or character_registry.get(character) is None:
+        return None
+    indexed = vector_store.indexed_characters()
+    if indexed is not None and indexed.get(character) != character_registry.signature(character):
+        return None
+    return character
+
+def character_boost() -> float:
+    return CHARACTER_BOOST if CHARACTER_RETRIEVAL == "boost" else 0.0
+
+def retrieval_cache_key(query: str, top_k: int, scope: Optional[str] = None) -> str:
+    return retrieval_cache.key(normalize_query(query), top_k, "embeddings",
+                               *((scope, CHARACTER_RETRIEVAL) if scope else ()))
+
+def cache_stats() -> Dict:
+    return {
+        "embedding": embedding_cache.stats(),
+        "retrieval": retrieval_cache.stats(),
+        "answer": answer_cache.stats(),
     }
 
-def retrieve_chunks(query: str, top_k: int = 5) -> List[Dict]:
-    """Retrieve relevant chunks from Pinecone using sentence transformers"""
-    if not PINECONE_AVAILABLE:
-        print("Pinecone not available, returning empty chunks")
-        return []
+def query_index(query_vector, top_k: int = 5, include_values: bool = False, character: Optional[str] = None) -> List[Dict]:
+    """Query the vector store and extract chunk metadata with similarity scores
+    (and the stored chunk embeddings, under ``embedding``, with include_values).
+    ``character`` scopes the search as set by CHARACTER_RETRIEVAL."""
+    matches = vector_store_component.get().query(query_vector, top_k, include_values=include_values,
+                                                 character=character, boost=character_boost())
+    return matches_to_chunks(matches)
+
+def query_index_many(query_vectors, top_k: int = 5, include_values: bool = False,
+                     character: Optional[str] = None) -> List[List[Dict]]:
+    """query_index for several query vectors in one vector store call"""
+    results = vector_store_component.get().query_many(query_vectors, top_k, include_values=include_values,
+                                                      character=character, boost=character_boost())
+    return [matches_to_chunks(matches) for matches in results]
+
+def matches_to_chunks(matches: List[Dict]) -> List[Dict]:
+    # Extract metadata from results with source information
+    chunks = []
+    for match in matches:
+        if match.get('metadata'):
+            chunk_data = dict(match['metadata'])
+            # Add similarity score for ranking
+            chunk_data['similarity_score'] = match.get('score', 0.0)
+            if match.get('values') is not None:
+                chunk_data['embedding'] = match['values']
+            chunks.append(chunk_data)
+    return chunks
+
+async def embed_query_async(query: str):
+    """Query embedding from the embedding cache, or via the batcher on a miss"""
+    with span("embed"):
+        embedding_key = embedding_cache.key(normalize_query(query))
+        query_vector = await embedding_cache.get(embedding_key)
+        if query_vector is None:
+            async with limiter("embedding").slot():
+                query_vector = await embedding_batcher.encode(query)
+            await embedding_cache.set(embedding_key, query_vector)
+    return query_vector
+
+RETRIEVALS = counter("rag_retrievals", "Context retrievals by outcome (cached, hit, empty, error)", ("result",))
+RETRIEVED_CHUNKS = counter("rag_retrieved_chunks", "Chunks returned by the vector store")
+
+async def retrieve_with_vector_async(query: str, top_k: int = 5, mode: str = "ai", character: Optional[str] = None):
+    """Retrieve relevant chunks and the query embedding (or None) without
+    blocking the event loop: encoding goes through the embedding batcher and the vector query
+    runs on a worker thread, each behind its stage limiter, and results and
+    query embeddings are served from the query caches when possible. In
+    character mode the search is scoped to the character's chunks and fetches
+    at most CHARACTER_CONTEXT_CANDIDATES."""
+    vector_store = await get_vector_store_async()
+    if vector_store is None:
+        logger.warning("Vector store not available, returning empty chunks")
+        RETRIEVALS.inc("error")
+        return [], None
+    
+    scope = retrieval_scope(vector_store, mode, character)
+    if scope is not None:
+        top_k = min(top_k, CHARACTER_CONTEXT_CANDIDATES)
     
     try:
-        # Generate embedding for the query using same model as ingestion
-        query_vector = embedding_model.encode([query])[0]
-        
-        # Query Pinecone
-        results = index.query(
-            vector=query_vector.tolist(),
-            top_k=top_k,
-            include_metadata=True
-        )
-        
-        # Extract metadata from results with source information
-        chunks = []
-        for match in results.get('matches', []):
-            if 'metadata' in match:
-                chunk_data = match['metadata']
-                # Add similarity score for ranking
-                chunk_data['similarity_score'] = match.get('score', 0.0)
-                chunks.append(chunk_data)
-        
-        print(f"Retrieved {len(chunks)} chunks from Pinecone")
-        return chunks
+        query_vector = await embed_query_async(query)
+    except StageOverloaded:
+        raise
     except Exception as e:
-        print(f"Error retrieving chunks: {e}")
-        return []
+        logger.error("Error encoding query: %s", e)
+        RETRIEVALS.inc("error")
+        return [], None
+    
+    retrieval_key = retrieval_cache_key(query, top_k, scope)
+    chunks = await retrieval_cache.get(retrieval_key)
+    if chunks is not None:
+        RETRIEVALS.inc("cached")
+        return chunks, query_vector
+    
+    async with limiter("vector").slot():
+        try:
+            with span("vector_search"):
+                chunks = await asyncio.to_thread(query_index, query_vector, top_k, True, scope)
+        except Exception as e:
+            logger.error("Error retrieving chunks: %s", e)
+            RETRIEVALS.inc("error")
+            return [], query_vector
+    
+    logger.debug("Retrieved %d chunks from %s", len(chunks), vector_store.name)
+    RETRIEVALS.inc("hit" if chunks else "empty")
+    RETRIEVED_CHUNKS.inc(amount=len(chunks))
+    await retrieval_cache.set(retrieval_key, chunks)
+    return chunks, query_vector
 
-def build_prompt(message: str, history: List[str], mode: str, character: Optional[str] = None, retrieved_chunks: Optional[List[Dict]] = None) -> str:
-    """Build the prompt for the LLM with character persona handling"""
+def compose_prompt(message: str, history: List[str], mode: str, character: Optional[str] = None,
+                   retrieved_chunks: Optional[List[Dict]] = None, query_vector=None):
+    """Build the prompt for the LLM with character persona handling.
+
+    Retrieved chunks go through the context packer (adjacent chunks merged,
+    near-duplicates dropped, filled to CONTEXT_TOKEN_BUDGET by relevance and
+    diversity). Returns the prompt, the context passages it includes and
+    prompt-size statistics.
+    """
     prompt_parts = []
     
     # Add character persona if in character mode
-    if mode == "character" and character and character in CHARACTER_PROFILES:
-        character_data = CHARACTER_PROFILES[character]
+    character_data = character_registry.get(character) if mode == "character" else None
+    if character_data is not None:
         persona = character_data['persona_prompt']
         traits = ", ".join(character_data['traits'])
         
@@ -144,24 +302,24 @@ def build_prompt(message: str, history: List[str], mode: str, character: Optiona
         prompt_parts.append("")
     
     # Add chat history if available
+    history_lines = []
     if history:
+        # A summary of older turns, if any, leads the history
+        if history[0].startswith(SUMMARY_PREFIX):
+            history_lines.append(history[0])
+            history = history[1:]
+        history_lines.extend(history[-5:])  # Last 5 messages
         prompt_parts.append("CHAT HISTORY:")
-        for hist_msg in history[-5:]:  # Last 5 messages
-            prompt_parts.append(hist_msg)
+        prompt_parts.extend(history_lines)
         prompt_parts.append("")
     
     # Add retrieved context if available
-    if retrieved_chunks:
+    packed = pack_context(retrieved_chunks, query_vector) if retrieved_chunks else None
+    if packed and packed.items:
         prompt_parts.append("RELEVANT CONTEXT FROM MAHABHARATA:")
-        for i, chunk in enumerate(retrieved_chunks):
+        for i, item in enumerate(packed.items):
             # Include source information for citation
-            page_info = chunk.get('page_number', 'Unknown')
-            source_text = f"[Source: Page {page_info}]"
-            
-            if 'summary' in chunk:
-                prompt_parts.append(f"{i+1}. {chunk['summary']} {source_text}")
-            elif 'text' in chunk:
-                prompt_parts.append(f"{i+1}. {chunk['text'][:200]}... {source_text}")
+            prompt_parts.append(f"{i+1}. {item.text} [Source: {item.page_label}]")
         prompt_parts.append("")
     
     # Add the user's message
@@ -174,55 +332,26 @@ def build_prompt(message: str, history: List[str], mode: str, character: Optiona
     else:
         prompt_parts.append("Please provide a helpful and accurate response based on the Mahabharata context provided above. Include source references when possible.")
     
-    return "\n".join(prompt_parts)
+    prompt = "\n".join(prompt_parts)
+    prompt_tokens, *history_tokens = count_tokens_many([prompt] + history_lines)
+    stats = dict(packed.stats if packed else {}, prompt_tokens=prompt_tokens, history_tokens=sum(history_tokens))
+    stats.setdefault("context_tokens", 0)
+    prompt_stats.record(stats)
+    return prompt, (packed.items if packed else []), stats
 
-def call_llm(prompt: str) -> str:
-    """Call the LLM API to generate a response, with fallback to Cohere if Together fails"""
-    # Try Together AI first
-    if TOGETHER_AVAILABLE and os.getenv("TOGETHER_API_KEY"):
-        try:
-            client = Together(api_key=os.getenv("TOGETHER_API_KEY"))
-            response = client.chat.completions.create(
-                model="meta-llama/Llama-3-70b-chat-hf",
-                messages=[
-                    {"role": "system", "content": "You are an expert on the Mahabharata. Provide accurate, helpful responses based on the epic. When responding as a character, stay true to their personality and perspective."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=512,
-                temperature=0.7
-            )
-            return response.choices[0].message.content
-        except Exception as e:
-            print(f"Error calling Together API: {e}")
-            # Fallback to Cohere if available
-            if COHERE_AVAILABLE and os.getenv("COHERE_API_KEY"):
-                try:
-                    co = cohere.Client(os.getenv("COHERE_API_KEY"))
-                    co_response = co.generate(
-                        model="command-r-plus",
-                        prompt=prompt,
-                        max_tokens=512,
-                        temperature=0.7
-                    )
-                    return co_response.generations[0].text
-                except Exception as e2:
-                    print(f"Error calling Cohere API: {e2}")
-                    return f"I apologize, but I'm having trouble accessing the AI services. Errors: Together: {str(e)}, Cohere: {str(e2)}"
-            else:
-                return f"I apologize, but I'm having trouble accessing the AI service. Error: {str(e)}"
-    # If Together is not available, try Cohere
-    elif COHERE_AVAILABLE and os.getenv("COHERE_API_KEY"):
+def warm_up() -> None:
+    """Build every component now and run a dummy encode so the first real
+    query doesn't pay for model loading or kernel JIT/allocation. A component
+    that fails is left for /ready to report; the others still load."""
+    steps = [
+        lambda: embedding_component.get().encode(["query: warm up"], batch_size=1),
+        vector_store_component.get,
+        character_registry.profiles,
+        tokenizer_component.get,
+        warm_up_llm_clients,
+    ]
+    for step in steps:
         try:
-            co = cohere.Client(os.getenv("COHERE_API_KEY"))
-            co_response = co.generate(
-                model="command-r-plus",
-                prompt=prompt,
-                max_tokens=512,
-                temperature=0.7
-            )
-            return co_response.generations[0].text
-        except Exception as e:
-            print(f"Error calling Cohere API: {e}")
-            return f"I apologize, but I'm having trouble accessing the Cohere AI service. Error: {str(e)}"
-    else:
-        return "No AI service is available. Please check your API configuration."
\ No newline at end of file
+            step()
+        except ComponentUnavailable:
+            pass
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ComponentUnavailable(Exception):
+    """A lazily initialized component failed to load"""
+
+
+class Component:
+    """A heavy resource (model, index, client) built on first use.
+
+    ``get()`` is thread safe and builds the value at most once; concurrent
+    callers wait for the first build. A failed build is remembered and retried
+    at most every ``retry_after`` seconds so a broken dependency doesn't make
+    every request pay the failing load again. ``on_ready`` runs under the
+    lock before the value is published, and a failure there fails the build.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Any], required: bool = True,
+                 retry_after: float = 30.0, on_ready: Optional[Callable[[Any], None]] = None):
+        self.name = name
+        self.factory = factory
+        self.required = required
+        self.retry_after = retry_after
+        self.on_ready = on_ready
+        self.state = "not_loaded"
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self._value = None
+        self._failed_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def get(self):
+        if self.state == "ready":
+            return self._value
+        with self._lock:
+            if self.state == "ready":
+                return self._value
+            if self.state == "failed" and time.monotonic() - self._failed_at < self.retry_after:
+                raise ComponentUnavailable(f"{self.name} unavailable: {self.error}")
+
+            self.state = "loading"
+            started = time.perf_counter()
+            try:
+                value = self.factory()
+                # Before the value is published: callers that see "ready"
+                # must find whatever on_ready sets up (e.g. cache versions)
+                if self.on_ready is not None:
+                    self.on_ready(value)
+            except Exception as e:
+                self.state = "failed"
+                self.error = str(e)
+                self._failed_at = time.monotonic()
+                logger.warning("Could not initialize %s: %s", self.name, e)
+                raise ComponentUnavailable(f"{self.name} unavailable: {e}") from e
+            self.load_seconds = time.perf_counter() - started
+            self._value = value
+            self.error = None
+            self.state = "ready"
+        return value
+
+    async def aget(self):
+        """get() that loads on a worker thread instead of the event loop"""
+        if self.state == "ready":
+            return self._value
+        return await asyncio.to_thread(self.get)
+
+    def status(self) -> Dict:
+        return {
+            "state": self.state,
+            "required": self.required,
+            "load_seconds": round(self.load_seconds, 3) if self.load_seconds is not None else None,
+            "error": self.error,
+        }
+
+
+COMPONENTS: Dict[str, Component] = {}
+
+
+def register(component: Component) -> Component:
+    COMPONENTS[component.name] = component
+    return component
+
+
+def readiness() -> Dict:
+    """Overall readiness plus the state of every registered component"""
+    components = {name: c.status() for name, c in COMPONENTS.items()}
+    ready = all(c.ready for c in COMPONENTS.values() if c.required)
+    return {"ready": ready, "components": components}
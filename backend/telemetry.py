@@ -0,0 +1,230 @@
+import os
+import json
+import time
+import uuid
+import random
+import logging
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Fraction of requests whose full span breakdown is logged; requests slower
+# than TRACE_SLOW_MS are always logged. Histograms and counters see every
+# request regardless.
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "5000"))
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Spans kept per request for the trace log (a batch request has one per item)
+MAX_TRACE_SPANS = 200
+
+# Seconds; spans range from sub-millisecond cache hits to multi-second LLM calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+# Spans of the current request: list of (stage, start offset s, duration s)
+_trace_var: ContextVar[Optional[list]] = ContextVar("trace", default=None)
+
+
+def _label_pairs(labelnames: Tuple[str, ...], labels: Tuple) -> str:
+    if not labelnames:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in labels)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labelnames, escaped)) + "}"
+
+
+class Counter:
+    """Monotonic counter with optional labels (Prometheus counter)"""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1.0) -> None:
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield self.name + "_total", _label_pairs(self.labelnames, labels), value
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels (Prometheus histogram)"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple, list] = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels) -> None:
+        if not METRICS_ENABLED:
+            return
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield self.name + "_bucket", _label_pairs(self.labelnames + ("le",), labels + (le,)), cumulative
+            yield self.name + "_count", _label_pairs(self.labelnames, labels), cumulative
+            yield self.name + "_sum", _label_pairs(self.labelnames, labels), series[-1]
+
+
+METRICS: List = []
+# Called at scrape time; each returns (name, type, help, [(labels dict, value)])
+COLLECTORS: List[Callable[[], Iterable[Tuple[str, str, str, List[Tuple[Dict, float]]]]]] = []
+
+
+def counter(name: str, help: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+    metric = Counter(name, help, labelnames)
+    METRICS.append(metric)
+    return metric
+
+
+def histogram(name: str, help: str, labelnames: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS) -> Histogram:
+    metric = Histogram(name, help, labelnames, buckets)
+    METRICS.append(metric)
+    return metric
+
+
+def register_collector(collector: Callable) -> None:
+    COLLECTORS.append(collector)
+
+
+def render_metrics() -> str:
+    """Everything in the Prometheus text exposition format"""
+    lines = []
+    for metric in METRICS:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(f"{name}{labels} {value}" for name, labels, value in metric.samples())
+    for collector in COLLECTORS:
+        for name, kind, help, samples in collector():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                pairs = _label_pairs(tuple(labels), tuple(labels.values()))
+                lines.append(f"{name}{'_total' if kind == 'counter' else ''}{pairs} {float(value)}")
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = histogram("rag_stage_duration_seconds", "Time spent in each pipeline stage", ("stage",))
+REQUEST_SECONDS = histogram("http_request_duration_seconds", "HTTP request latency", ("path", "status"))
+
+
+@contextmanager
+def span(stage: str):
+    """Time a pipeline stage: always into the stage histogram, and into the
+    request's trace so sampled or slow requests can be logged in full"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage)
+        trace = _trace_var.get()
+        if trace is not None and len(trace) < MAX_TRACE_SPANS:
+            trace.append((stage, started, elapsed))
+
+
+async def traced(stage: str, awaitable):
+    """Await under a span, e.g. for each branch of an asyncio.gather"""
+    with span(stage):
+        return await awaitable
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+def configure_logging() -> None:
+    """Log lines carry the request ID of the request that produced them"""
+    handler = logging.StreamHandler()
+    handler.addFilter(RequestIdFilter())
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+
+
+trace_log = logging.getLogger("trace")
+
+
+class RequestContextMiddleware:
+    """ASGI middleware: assigns each request an ID (or keeps the caller's
+    X-Request-ID), returns it as a response header, records request latency
+    and logs the span breakdown of sampled or slow requests."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", ()):
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex[:16]
+        id_token = request_id_var.set(request_id)
+        trace = []
+        trace_token = _trace_var.set(trace)
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                message = dict(message, headers=list(message.get("headers", [])) + [(b"x-request-id", request_id.encode())])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            elapsed = time.perf_counter() - started
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "other"
+            REQUEST_SECONDS.observe(elapsed, path, status[0])
+            if trace and (elapsed * 1000 >= TRACE_SLOW_MS or random.random() < TRACE_SAMPLE_RATE):
+                trace_log.info(json.dumps({
+                    "request_id": request_id,
+                    "path": scope.get("path"),
+                    "status": status[0],
+                    "duration_ms": round(elapsed * 1000, 2),
+                    "spans": [{"stage": stage, "start_ms": round((start - started) * 1000, 2),
+                               "duration_ms": round(duration * 1000, 2)} for stage, start, duration in sorted(trace, key=lambda s: s[1])],
+                }))
+            _trace_var.reset(trace_token)
+            request_id_var.reset(id_token)
@@ -0,0 +1,45 @@
+import numpy as np
+
+from answer_cache import SemanticAnswerCache, depends_on_history
+
+
+def test_paraphrase_hits_within_its_scope_only():
+    cache = SemanticAnswerCache(threshold=0.9)
+    scope = cache.scope_key("ai", None)
+    cache.store(scope, np.array([1.0, 0.0, 0.0]), {"response": "Surya"})
+
+    hit = cache.lookup(scope, np.array([0.99, 0.05, 0.0]))
+    assert hit["response"] == "Surya" and hit["similarity"] > 0.9
+    assert cache.lookup(scope, np.array([0.0, 1.0, 0.0])) is None
+    assert cache.lookup(cache.scope_key("character", "Karna"), np.array([1.0, 0.0, 0.0])) is None
+
+
+def test_entries_expire_and_evict(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("answer_cache.time.monotonic", lambda: now[0])
+    cache = SemanticAnswerCache(max_entries=2, ttl=10, threshold=0.9)
+    scope = cache.scope_key("ai", None)
+    for i in range(3):
+        cache.store(scope, np.eye(3)[i], {"response": i})
+    assert cache.lookup(scope, np.eye(3)[0]) is None
+    assert cache.stats()["evictions"] == 1
+    now[0] = 20
+    assert cache.lookup(scope, np.eye(3)[1]) is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_new_version_drops_answers_and_refuses_stale_stores():
+    cache = SemanticAnswerCache(threshold=0.9)
+    old_scope = cache.scope_key("ai", None)
+    cache.store(old_scope, np.array([1.0, 0.0]), {"response": "old"})
+    cache.set_version("v2")
+    assert cache.lookup(cache.scope_key("ai", None), np.array([1.0, 0.0])) is None
+    # An answer generated under the old version arrives late
+    cache.store(old_scope, np.array([1.0, 0.0]), {"response": "old"})
+    assert cache.stats()["entries"] == 0
+
+
+def test_depends_on_history():
+    assert not depends_on_history("What did he do next?", [])
+    assert depends_on_history("What did he do next?", ["Tell me about Karna"])
+    assert not depends_on_history("Who was Karna?", ["Tell me about Arjuna"])
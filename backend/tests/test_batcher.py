@@ -0,0 +1,67 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from batcher import EmbeddingBatcher
+
+
+def encode_lengths(texts):
+    return np.array([[len(t), 1.0] for t in texts], dtype=np.float32)
+
+
+def test_concurrent_requests_share_a_batch():
+    calls = []
+
+    def encode(texts):
+        calls.append(list(texts))
+        return encode_lengths(texts)
+
+    async def scenario():
+        batcher = EmbeddingBatcher(encode, max_batch_size=8, max_wait_ms=20)
+        vectors = await batcher.encode_many(["a", "bb", "ccc"])
+        return batcher, vectors
+
+    batcher, vectors = asyncio.run(scenario())
+    assert calls == [["a", "bb", "ccc"]]
+    assert [v[0] for v in vectors] == [1, 2, 3]
+    assert batcher.stats()["batches"] == 1 and batcher.stats()["items"] == 3
+
+
+def test_batches_are_capped():
+    calls = []
+
+    def encode(texts):
+        calls.append(len(texts))
+        return encode_lengths(texts)
+
+    async def scenario():
+        batcher = EmbeddingBatcher(encode, max_batch_size=2, max_wait_ms=20)
+        return await batcher.encode_many(["x"] * 5)
+
+    assert len(asyncio.run(scenario())) == 5
+    assert max(calls) == 2 and sum(calls) == 5
+
+
+def test_row_count_mismatch_fails_every_caller():
+    async def scenario():
+        batcher = EmbeddingBatcher(lambda texts: encode_lengths(texts[:-1]), max_wait_ms=20)
+        return await asyncio.gather(batcher.encode("a"), batcher.encode("b"), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_encoder_errors_reach_the_caller_and_the_worker_keeps_going():
+    def encode(texts):
+        if "bad" in texts:
+            raise ValueError("boom")
+        return encode_lengths(texts)
+
+    async def scenario():
+        batcher = EmbeddingBatcher(encode, max_wait_ms=1)
+        with pytest.raises(ValueError):
+            await batcher.encode("bad")
+        return await batcher.encode("good")
+
+    assert asyncio.run(scenario())[0] == 4
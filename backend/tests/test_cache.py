@@ -0,0 +1,139 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from cache import LRUCache, TwoTierCache, dump_chunks, load_chunks, normalize_query
+
+
+class FakeRedis:
+    """Just the async Redis calls TwoTierCache makes"""
+
+    def __init__(self, fail: bool = False):
+        self.data = {}
+        self.fail = fail
+
+    def _check(self):
+        if self.fail:
+            raise ConnectionError("redis down")
+
+    async def get(self, key):
+        self._check()
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        self._check()
+        self.data[key] = value
+
+    async def mget(self, keys):
+        self._check()
+        return [self.data.get(key) for key in keys]
+
+    def pipeline(self, transaction=False):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def set(self, key, value, ex=None):
+        self.calls.append((key, value))
+
+    async def execute(self):
+        self.redis._check()
+        for key, value in self.calls:
+            self.redis.data[key] = value
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lru_expires_entries(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("cache.time.monotonic", lambda: now[0])
+    cache = LRUCache(max_size=10, ttl=5)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=60)
+    now[0] += 10
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    assert cache.stats()["expirations"] == 1
+
+
+def test_normalize_query():
+    assert normalize_query("  Who was  KARNA? ") == normalize_query("who was karna")
+
+
+def test_two_tier_reads_through_and_fills_the_local_tier():
+    redis = FakeRedis()
+    shared = TwoTierCache("test", LRUCache(10), redis)
+    other_worker = TwoTierCache("test", LRUCache(10), redis)
+
+    async def run():
+        key = shared.key("q")
+        await shared.set(key, {"answer": 42})
+        assert await other_worker.get(key) == {"answer": 42}
+        assert other_worker.redis_hits == 1
+        # Now served locally
+        redis.data.clear()
+        assert await other_worker.get(key) == {"answer": 42}
+
+        await shared.set_many([(shared.key("x"), 1), (shared.key("y"), 2)])
+        assert await other_worker.get_many([shared.key("x"), shared.key("z"), shared.key("y")]) == [1, None, 2]
+
+    asyncio.run(run())
+
+
+def test_two_tier_version_bump_orphans_old_entries():
+    cache = TwoTierCache("test", LRUCache(10), FakeRedis())
+
+    async def run():
+        await cache.set(cache.key("q"), "old")
+        cache.set_version("v2")
+        assert await cache.get(cache.key("q")) is None
+
+    asyncio.run(run())
+
+
+def test_two_tier_treats_redis_errors_as_misses():
+    cache = TwoTierCache("test", LRUCache(10), FakeRedis(fail=True))
+
+    async def run():
+        await cache.set(cache.key("q"), "local")
+        assert await cache.get(cache.key("q")) == "local"
+        assert await cache.get(cache.key("other")) is None
+        assert await cache.get_many([cache.key("q"), cache.key("other")]) == ["local", None]
+
+    asyncio.run(run())
+    assert cache.redis_errors == 3
+
+
+@pytest.mark.parametrize("with_vectors", [True, False])
+def test_chunks_round_trip(with_vectors):
+    chunks = [{"text": "a", "chunk_id": 1}, {"text": "b", "chunk_id": 2}]
+    if with_vectors:
+        for i, chunk in enumerate(chunks):
+            chunk["embedding"] = np.full(3, i, dtype=np.float32)
+    loaded = load_chunks(dump_chunks(chunks))
+    assert [{k: v for k, v in c.items() if k != "embedding"} for c in loaded] == [
+        {"text": "a", "chunk_id": 1}, {"text": "b", "chunk_id": 2}]
+    if with_vectors:
+        np.testing.assert_array_equal(loaded[1]["embedding"], np.full(3, 1))
+    else:
+        assert all("embedding" not in c for c in loaded)
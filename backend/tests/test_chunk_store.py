@@ -0,0 +1,85 @@
+import shutil
+
+import numpy as np
+
+from chunk_store import ChunkStore, ChunkStoreWriter, ReloadingChunkStore, read_partial_chunk_store
+
+
+def write_store(path, ids, dim=4, dtype="float32"):
+    vectors = np.arange(len(ids) * dim, dtype=np.float32).reshape(len(ids), dim)
+    writer = ChunkStoreWriter(path, dtype=dtype)
+    writer.add(ids, vectors, [{"text": f"text of {i}", "chunk_id": n} for n, i in enumerate(ids)])
+    writer.close()
+    return vectors
+
+
+def test_round_trip(tmp_path):
+    ids = ["c-b", "c-a", "c-ccc"]
+    vectors = write_store(tmp_path / "chunks", ids)
+    store = ChunkStore(tmp_path / "chunks")
+    assert len(store) == 3
+
+    records = store.get_many(["c-ccc", "missing", "c-b", "c-cccc"], include_values=True)
+    assert records[0]["metadata"] == {"text": "text of c-ccc", "chunk_id": 2}
+    np.testing.assert_array_equal(records[0]["values"], vectors[2])
+    assert records[1] is None
+    np.testing.assert_array_equal(records[2]["values"], vectors[0])
+    # Longer than any stored ID: must not match a truncated one
+    assert records[3] is None
+
+    row_ids, row_vectors, metadata = store.rows()
+    assert row_ids == ids
+    np.testing.assert_array_equal(row_vectors, vectors)
+    assert [m["chunk_id"] for m in metadata] == [0, 1, 2]
+
+
+def test_writer_skips_repeated_ids_and_stores_float16(tmp_path):
+    writer = ChunkStoreWriter(tmp_path / "chunks", dtype="float16")
+    writer.add(["a", "b"], np.ones((2, 3)), [{"n": 1}, {"n": 2}])
+    writer.add(["b", "c"], np.zeros((2, 3)), [{"n": 3}, {"n": 4}])
+    writer.close()
+    store = ChunkStore(tmp_path / "chunks")
+    assert len(store) == 3
+    b, c = store.get_many(["b", "c"], include_values=True)
+    assert b["metadata"] == {"n": 2} and b["values"].dtype == np.float32
+    np.testing.assert_array_equal(c["values"], np.zeros(3))
+
+
+def test_empty_store(tmp_path):
+    ChunkStoreWriter(tmp_path / "chunks").close()
+    assert ChunkStore(tmp_path / "chunks").get_many(["a"]) == [None]
+
+
+def test_interrupted_build_can_be_salvaged(tmp_path):
+    writer = ChunkStoreWriter(tmp_path / "chunks")
+    writer.add(["a", "b"], np.ones((2, 3)), [{"n": 1}, {"n": 2}])
+    writer.flush()
+    assert not (tmp_path / "chunks" / "manifest.json").exists()
+
+    ids, vectors, metadata = read_partial_chunk_store(tmp_path / "chunks")
+    assert ids == ["a", "b"]
+    np.testing.assert_array_equal(vectors, np.ones((2, 3)))
+    assert metadata == [{"n": 1}, {"n": 2}]
+
+    writer.close()
+    assert read_partial_chunk_store(tmp_path / "chunks") is None
+
+
+def test_reloading_store_picks_up_a_swapped_in_store(tmp_path):
+    path = tmp_path / "chunks"
+    write_store(path, ["old"])
+    reloaded = []
+    store = ReloadingChunkStore(path, reload_interval=0, on_reload=lambda s: reloaded.append(store.version))
+    first_version = store.version
+    assert store.get_many(["new"]) == [None]
+
+    # What chunk_and_ingest's swap_in does
+    write_store(tmp_path / "chunks.building", ["old", "new"])
+    shutil.rmtree(path)
+    assert store.get_many(["old"])[0] is not None  # mid-swap: keeps serving the loaded store
+    (tmp_path / "chunks.building").rename(path)
+
+    assert store.get_many(["new"])[0]["metadata"]["text"] == "text of new"
+    assert store.version != first_version
+    # on_reload already sees the new store
+    assert reloaded == [store.version]
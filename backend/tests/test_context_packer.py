@@ -0,0 +1,52 @@
+import numpy as np
+
+from context_packer import join_overlapping, merge_adjacent, pack_context
+
+
+def chunk(chunk_id, text, score=0.5, page=1, doc_id="mahabharata", embedding=None):
+    return {"chunk_id": chunk_id, "text": text, "similarity_score": score, "page_number": page,
+            "doc_id": doc_id, "document_title": "Mahabharata", "embedding": embedding}
+
+
+def test_join_overlapping_drops_shared_text():
+    left = "Arjuna drew his bow and aimed at the eye of the wooden bird on the pole."
+    right = "aimed at the eye of the wooden bird on the pole. Drona asked what he saw."
+    assert join_overlapping(left, right) == (
+        "Arjuna drew his bow and aimed at the eye of the wooden bird on the pole. Drona asked what he saw.")
+
+
+def test_join_overlapping_ignores_coincidental_overlap():
+    # Only the "t" is shared: that is not an overlap, the chunks must not be glued
+    joined = join_overlapping("Arjuna drew his bow and aimed at the target", "then Karna rose to answer")
+    assert joined == "Arjuna drew his bow and aimed at the target then Karna rose to answer"
+
+
+def test_merge_adjacent_joins_consecutive_chunks_of_a_document():
+    items = merge_adjacent([
+        chunk(3, "Karna was the son of Surya."),
+        chunk(1, "Bhishma vowed never to marry.", score=0.9),
+        chunk(2, "Kunti received a boon from Durvasa.", page=2),
+        chunk(7, "Bhishma vowed never to marry.", doc_id="other"),
+    ])
+    assert len(items) == 2
+    merged = items[0]
+    assert merged.chunk_ids == [1, 2, 3]
+    assert merged.text == "Bhishma vowed never to marry. Kunti received a boon from Durvasa. Karna was the son of Surya."
+    assert merged.page_label == "Pages 1-2"
+    assert merged.score == 0.9
+
+
+def test_pack_context_drops_duplicates_and_keeps_to_budget():
+    vector = np.array([1.0, 0.0], dtype=np.float32)
+    chunks = [
+        chunk(1, "Yudhishthira lost his kingdom at dice. " * 20, score=0.9, embedding=vector),
+        chunk(10, "Yudhishthira lost his kingdom at dice. " * 20, score=0.8, embedding=vector),
+        chunk(20, "Bhima vowed to break Duryodhana's thigh. " * 20, score=0.7,
+              embedding=np.array([0.0, 1.0], dtype=np.float32)),
+    ]
+    result = pack_context(chunks, query_vector=vector, budget=1000)
+    assert [item.chunk_ids for item in result.items] == [[1], [20]]
+
+    small = pack_context(chunks, query_vector=vector, budget=100, min_partial_tokens=10)
+    assert sum(item.tokens for item in small.items) <= 100
+    assert small.items[0].truncated
@@ -0,0 +1,18 @@
+import pytest
+
+pytest.importorskip("onnxruntime")
+pytest.importorskip("sentence_transformers")
+
+from benchmarks.embedding_parity import BUILTIN_PASSAGES, BUILTIN_QUERIES, compare, parity_failures
+from embeddings import get_embedder
+
+
+@pytest.fixture(scope="module")
+def reference():
+    return get_embedder("torch")
+
+
+@pytest.mark.parametrize("backend", ["onnx", "onnx-int8"])
+def test_onnx_backend_matches_torch(reference, backend):
+    result = compare(reference, get_embedder(backend), BUILTIN_PASSAGES, BUILTIN_QUERIES, top_k=5)
+    assert parity_failures(result) == []
@@ -0,0 +1,78 @@
+import os
+import stat
+import sys
+import time
+import signal
+import subprocess
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from embeddings import HashingEmbedder
+from embedding_server import RemoteEmbedder
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture
+def server(tmp_path):
+    """An embedding server with the hashing backend on a private socket"""
+    socket_path = str(tmp_path / "embed.sock")
+    buffer_dir = tmp_path / "buffers"
+    buffer_dir.mkdir()
+    process = subprocess.Popen(
+        [sys.executable, "embedding_server.py", "--socket", socket_path, "--embedding-backend", "hash",
+         "--buffer-dir", str(buffer_dir)],
+        cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    deadline = time.monotonic() + 30
+    while not os.path.exists(socket_path):
+        if process.poll() is not None or time.monotonic() > deadline:
+            process.kill()
+            pytest.fail(f"Embedding server did not start: {process.stderr.read().decode()}")
+        time.sleep(0.05)
+    yield socket_path, buffer_dir
+    process.send_signal(signal.SIGTERM)
+    process.wait(timeout=10)
+    # SIGTERM shuts down cleanly: no socket or buffer left behind
+    assert not os.path.exists(socket_path)
+    assert list(buffer_dir.iterdir()) == []
+
+
+def test_remote_vectors_match_the_local_embedder(server):
+    socket_path, _ = server
+    embedder = RemoteEmbedder(socket_path, timeout=10)
+    texts = ["Who is Karna?", "Arjuna and Krishna at Kurukshetra", ""]
+    np.testing.assert_allclose(embedder.encode(texts), HashingEmbedder().encode(texts), atol=1e-6)
+    assert embedder.dim == 768 and embedder.name.endswith("@hash@remote")
+
+
+def test_long_requests_are_split_across_the_buffer(server):
+    socket_path, _ = server
+    embedder = RemoteEmbedder(socket_path, timeout=10)
+    texts = [f"text number {i}" for i in range(600)]
+    np.testing.assert_allclose(embedder.encode(texts), HashingEmbedder().encode(texts), atol=1e-6)
+
+
+def test_socket_and_buffers_are_owner_only(server):
+    socket_path, buffer_dir = server
+    RemoteEmbedder(socket_path, timeout=10).encode(["hello"])
+    assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+    buffers = list(buffer_dir.iterdir())
+    assert buffers and all(stat.S_IMODE(path.stat().st_mode) == 0o600 for path in buffers)
+
+
+def test_identity_mismatch_is_refused(server):
+    socket_path, _ = server
+    with pytest.raises(ValueError):
+        RemoteEmbedder(socket_path, expected_identity="another-model@torch", timeout=10)
+
+
+def test_stats_reuse_one_connection(server):
+    socket_path, _ = server
+    embedder = RemoteEmbedder(socket_path, timeout=10)
+    for _ in range(3):
+        stats = embedder.stats()
+    # The embedder's own connection plus the one for stats
+    assert stats["connections"] == 2
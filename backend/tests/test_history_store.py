@@ -0,0 +1,55 @@
+import asyncio
+
+from history_store import SUMMARY_PREFIX, HistoryStore, estimate_tokens, summarize_extractive
+
+
+def test_local_fallback_without_redis():
+    async def scenario():
+        store = HistoryStore(None, max_messages=4)
+        await store.append("s1", "User: hi", "Bot: hello")
+        await store.append("s1", "User: who is Arjuna?", "Bot: A Pandava prince.")
+        await store.append("s1", "User: and Bhima?", "Bot: His brother.")
+        return store, await store.get("s1"), await store.get("other")
+
+    store, history, empty = asyncio.run(scenario())
+    assert history == ["User: who is Arjuna?", "Bot: A Pandava prince.", "User: and Bhima?", "Bot: His brother."]
+    assert empty == []
+    assert store.stats()["fallback_writes"] == 3 and store.stats()["redis_available"] is False
+
+
+def test_clear():
+    async def scenario():
+        store = HistoryStore(None)
+        await store.append("s1", "User: hi")
+        await store.clear("s1")
+        return await store.get("s1")
+
+    assert asyncio.run(scenario()) == []
+
+
+def test_local_compaction_folds_old_turns_into_a_summary():
+    async def scenario():
+        store = HistoryStore(None, summarize=True, keep_messages=2, compact_batch=2)
+        await store.append("s1", "User: Who is Karna? Tell me more.", "Bot: The son of Kunti.")
+        await store.append("s1", "User: Who is Drona?", "Bot: A teacher.")
+        await asyncio.gather(*store._tasks)
+        return store, await store.get("s1")
+
+    store, history = asyncio.run(scenario())
+    assert store.compactions == 1
+    assert history[0] == SUMMARY_PREFIX + "User: Who is Karna? Bot: The son of Kunti."
+    assert history[1:] == ["User: Who is Drona?", "Bot: A teacher."]
+
+
+def test_fit_keeps_the_newest_messages_within_budget():
+    store = HistoryStore(None, token_budget=10)
+    messages = ["a" * 20, "b" * 20, "c" * 20]
+    assert store._fit("", messages) == ["b" * 20, "c" * 20]
+    # The newest message is always kept, even over budget
+    assert store._fit("", ["d" * 100]) == ["d" * 100]
+
+
+def test_summarize_extractive_drops_oldest_lines():
+    summary = summarize_extractive("", ["First. Extra.", "Second one.", "Third."], max_tokens=5)
+    assert summary.split("\n")[-1] == "Third."
+    assert estimate_tokens(summary) <= 5
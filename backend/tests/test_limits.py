@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from limits import RateLimiter, StageLimiter, StageOverloaded
+
+
+def test_stage_limiter_rejects_when_the_queue_is_full():
+    async def scenario():
+        stage = StageLimiter("test", max_concurrency=1, max_queue=1, queue_timeout=5)
+        release = asyncio.Event()
+
+        async def hold():
+            async with stage.slot():
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(hold())
+        await asyncio.sleep(0.01)
+        assert stage.in_flight == 1 and stage.waiting == 1
+
+        with pytest.raises(StageOverloaded) as excinfo:
+            async with stage.slot():
+                pass
+        assert excinfo.value.reason == "queue full"
+
+        release.set()
+        await asyncio.gather(holder, waiter)
+        return stage.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["completed"] == 2 and stats["rejected"] == 1
+    assert stats["in_flight"] == 0 and stats["waiting"] == 0
+
+
+def test_stage_limiter_times_out_waiters():
+    async def scenario():
+        stage = StageLimiter("test", max_concurrency=1, max_queue=10, queue_timeout=0.05)
+        release = asyncio.Event()
+
+        async def hold():
+            async with stage.slot():
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0.01)
+        with pytest.raises(StageOverloaded) as excinfo:
+            async with stage.slot():
+                pass
+        release.set()
+        await holder
+        return stage, excinfo.value
+
+    stage, error = asyncio.run(scenario())
+    assert error.reason == "queue timeout" and stage.timed_out == 1
+    assert stage.waiting == 0
+
+
+def test_rate_limiter_paces_after_the_burst():
+    async def scenario():
+        limiter = RateLimiter(rate=50, burst=2)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for _ in range(4):
+            await limiter.acquire()
+        return loop.time() - started, limiter.waited
+
+    elapsed, waited = asyncio.run(scenario())
+    # Two tokens are free, the next two wait about 20ms each
+    assert waited == pytest.approx(0.04, abs=0.01)
+    assert elapsed >= 0.035
+
+
+def test_rate_limiter_disabled():
+    limiter = RateLimiter(rate=0)
+    asyncio.run(limiter.acquire())
+    assert limiter.waited == 0
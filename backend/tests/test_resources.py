@@ -0,0 +1,54 @@
+import threading
+import time
+
+import pytest
+
+from resources import Component, ComponentUnavailable
+
+
+def test_get_builds_once_for_concurrent_callers():
+    calls = []
+
+    def factory():
+        calls.append(1)
+        time.sleep(0.05)
+        return object()
+
+    component = Component("slow", factory)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(component.get())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert all(r is results[0] for r in results)
+
+
+def test_on_ready_runs_before_the_value_is_published():
+    seen = []
+    component = None
+
+    def on_ready(value):
+        time.sleep(0.05)
+        seen.append(component.ready)
+
+    component = Component("versioned", lambda: "value", on_ready=on_ready)
+    assert component.get() == "value"
+    assert seen == [False]
+    assert component.ready
+
+
+def test_failed_build_is_retried_after_retry_after():
+    attempts = []
+
+    def factory():
+        attempts.append(1)
+        raise RuntimeError("down")
+
+    component = Component("broken", factory, retry_after=60)
+    for _ in range(3):
+        with pytest.raises(ComponentUnavailable):
+            component.get()
+    assert len(attempts) == 1
+    assert component.status()["state"] == "failed"
@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+
+from vector_store import (LocalIndexWriter, LocalVectorStore, PineconeVectorStore, merge_character_matches,
+                          read_partial_index, top_k_indices, write_local_index)
+
+
+def corpus(count=400, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((count, dim)).astype(np.float32)
+    ids = [f"c-{i}" for i in range(count)]
+    metadata = [{"text": f"chunk {i}", "chunk_id": i, "characters": ["Karna"] if i % 10 == 0 else []}
+                for i in range(count)]
+    return ids, vectors, metadata
+
+
+def brute_force(vectors, query, k):
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    return list(np.argsort(-(normalized @ (query / np.linalg.norm(query))))[:k])
+
+
+@pytest.fixture
+def index_dir(tmp_path):
+    ids, vectors, metadata = corpus()
+    write_local_index(tmp_path / "index", ids, vectors, metadata, entity_signatures={"Karna": "sig"})
+    return tmp_path / "index", vectors
+
+
+def test_top_k_indices():
+    scores = np.array([0.1, 0.9, 0.5, 0.7])
+    assert list(top_k_indices(scores, 2)) == [1, 3]
+    assert list(top_k_indices(scores, 10)) == [1, 3, 2, 0]
+
+
+def test_exact_search_matches_brute_force(index_dir):
+    path, vectors = index_dir
+    store = LocalVectorStore(path)
+    query = np.random.default_rng(1).standard_normal(16)
+    matches = store.query(query, top_k=5, include_values=True)
+    assert [m["id"] for m in matches] == [f"c-{i}" for i in brute_force(vectors, query, 5)]
+    assert matches[0]["metadata"]["text"] == matches[0]["id"].replace("c-", "chunk ")
+    assert matches[0]["values"].shape == (16,)
+    assert matches[0]["score"] >= matches[-1]["score"]
+
+
+def test_query_many_matches_single_queries(index_dir):
+    store = LocalVectorStore(index_dir[0])
+    queries = np.random.default_rng(2).standard_normal((3, 16))
+    many = store.query_many(queries, top_k=4)
+    assert [[m["id"] for m in ms] for ms in many] == [[m["id"] for m in store.query(q, 4)] for q in queries]
+
+
+def test_ivf_search_with_every_list_probed_is_exact(tmp_path):
+    ids, vectors, metadata = corpus()
+    write_local_index(tmp_path / "index", ids, vectors, metadata, nlist=8)
+    store = LocalVectorStore(tmp_path / "index", mode="ivf", nprobe=8)
+    assert store.centroids is not None
+    query = np.random.default_rng(3).standard_normal(16)
+    assert [m["id"] for m in store.query(query, 5)] == [f"c-{i}" for i in brute_force(vectors, query, 5)]
+
+    # Fewer probes only ever search a subset
+    narrow = LocalVectorStore(tmp_path / "index", mode="ivf", nprobe=1)
+    rows, _ = narrow.search(query, 5)
+    assert set(rows) <= set(range(len(ids)))
+
+
+def test_ivf_mode_without_lists_falls_back_to_exact(index_dir):
+    assert LocalVectorStore(index_dir[0], mode="ivf").mode == "exact"
+
+
+def test_character_scoped_query(index_dir):
+    store = LocalVectorStore(index_dir[0])
+    query = np.random.default_rng(4).standard_normal(16)
+    scoped = store.query(query, top_k=5, character="Karna")
+    assert all("Karna" in m["metadata"]["characters"] for m in scoped)
+    # Unknown characters are mentioned nowhere: filled from the whole corpus
+    assert len(store.query(query, top_k=5, character="Nobody")) == 5
+
+
+def test_merge_character_matches_boost():
+    scoped = [{"id": "a", "score": 0.5}]
+    others = [{"id": "b", "score": 0.7}, {"id": "a", "score": 0.5}, {"id": "c", "score": 0.55}]
+    assert [m["id"] for m in merge_character_matches(scoped, others, 3)] == ["a", "b", "c"]
+    assert [m["id"] for m in merge_character_matches(scoped, others, 2, boost=0.1)] == ["b", "a"]
+    assert [m["id"] for m in merge_character_matches(scoped, others, 2, boost=0.3)] == ["a", "b"]
+
+
+def test_partial_index_can_be_salvaged(tmp_path):
+    ids, vectors, metadata = corpus(count=10)
+    writer = LocalIndexWriter(tmp_path / "index")
+    writer.add(ids, vectors, metadata)
+    writer.flush()
+    salvaged_ids, salvaged = read_partial_index(tmp_path / "index")
+    assert salvaged_ids == ids and salvaged.shape == (10, 16)
+    writer.close()
+    assert read_partial_index(tmp_path / "index") is None
+
+
+class FakeIndex:
+    def __init__(self, matches):
+        self.matches = matches
+        self.kwargs = None
+
+    def query(self, **kwargs):
+        self.kwargs = kwargs
+        return {"matches": self.matches}
+
+
+def test_pinecone_store_hydrates_from_the_chunk_store():
+    class Store:
+        version = "v1"
+
+        def get_many(self, ids, include_values=False):
+            return [{"metadata": {"text": f"text of {i}"}, "values": np.ones(2)} if i != "gone" else None
+                    for i in ids]
+
+    index = FakeIndex([{"id": "a", "score": 0.9}, {"id": "gone", "score": 0.8}])
+    store = PineconeVectorStore(index, chunk_store=Store())
+    matches = store.query(np.ones(2), top_k=2, include_values=True)
+    assert [m["metadata"]["text"] for m in matches] == ["text of a"]
+    assert index.kwargs["include_metadata"] is False and index.kwargs["include_values"] is False
+    assert store.version.endswith(":v1")
@@ -1,27 +1,25 @@
-import redis
+import redis.asyncio as aioredis
 import os
 from dotenv import load_dotenv
+from history_store import history_store_from_env
 
 load_dotenv()
 
-# Initialize Redis connection
-r = redis.Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 
-def get_history(session_id: str, limit: int = 10) -> list:
-    """Get chat history for a session"""
-    try:
-        history = r.lrange(f"history:{session_id}", -limit, -1)
-        return [h.decode() for h in history]
-    except:
-        # Fallback if Redis is not available
-        return []
+# Async client for the request path
+ar = aioredis.Redis.from_url(REDIS_URL)
 
-def add_to_history(session_id: str, message: str) -> None:
-    """Add a message to chat history"""
-    try:
-        r.rpush(f"history:{session_id}", message)
-        # Optional: Limit history to last 50 messages
-        r.ltrim(f"history:{session_id}", -50, -1)
-    except:
-        # Fallback if Redis is not available
-        pass
+# Session history for the request path: one pipelined round-trip per read or
+# turn, session TTLs, a local fallback and rolling summarization (see
+# history_store.HistoryStore)
+history_store = history_store_from_env(ar)
+
+async def get_history_async(session_id: str, limit: int = 10) -> list:
+    """Get chat history for a session without blocking the event loop.
+    Starts with a summary line when older turns have been summarized."""
+    return await history_store.get(session_id, limit)
+
+async def add_to_history_async(session_id: str, *messages: str) -> None:
+    """Append one or more messages to chat history in a single round-trip"""
+    await history_store.append(session_id, *messages)
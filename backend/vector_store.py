@@ -0,0 +1,473 @@
+import os
+import json
+import time
+import uuid
+import logging
+from pathlib import Path
+from typing import List, Dict, Optional, Iterable
+
+import numpy as np
+
+# Rows scored per block so a float16 index is never upcast in one piece
+SCORE_BLOCK_ROWS = 65536
+
+DEFAULT_LOCAL_INDEX_DIR = Path(__file__).parent / "data" / "index"
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize rows so cosine similarity becomes a dot product"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Indices of the top_k scores, best first, without a full sort"""
+    if top_k >= len(scores):
+        return np.argsort(-scores)
+    candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    return candidates[np.argsort(-scores[candidates])]
+
+
+def merge_character_matches(scoped: List[Dict], others: List[Dict], top_k: int, boost: float = 0.0) -> List[Dict]:
+    """Combine the matches of a character-scoped query with unscoped ones.
+
+    With no boost the scoped matches come first and the best other matches
+    fill any remaining places; with a boost both are ranked together, scoped
+    ones as if their score were ``boost`` higher (reported scores are not
+    changed).
+    """
+    seen = {m["id"] for m in scoped}
+    others = [m for m in others if m["id"] not in seen]
+    if boost <= 0:
+        return (scoped + others)[:top_k]
+    ranked = sorted([(m["score"] + boost, i, m) for i, m in enumerate(scoped)]
+                    + [(m["score"], len(scoped) + i, m) for i, m in enumerate(others)], key=lambda r: (-r[0], r[1]))
+    return [m for _, _, m in ranked[:top_k]]
+
+
+class VectorStore:
+    """Minimal interface shared by the Pinecone and local backends.
+
+    ``query`` returns Pinecone-style matches: dicts with ``id``, ``score`` and
+    ``metadata``, plus ``values`` (the stored vector) with include_values.
+    With ``character`` the search is restricted to chunks that mention the
+    character (topped up from the whole corpus if there are too few), or,
+    with a ``boost``, those chunks are favoured over the rest.
+    """
+
+    name = "base"
+    # True when query_many scores several queries in one pass; otherwise
+    # callers are better off issuing the single queries concurrently
+    multi_query = False
+
+    @property
+    def version(self) -> str:
+        return self.name
+
+    def indexed_characters(self) -> Optional[Dict[str, str]]:
+        """Character -> alias signature of the entity index, or None when the
+        store can't tell (its metadata is then trusted as current)"""
+        return None
+
+    def _query(self, vector, top_k: int, include_values: bool, character: Optional[str] = None) -> List[Dict]:
+        raise NotImplementedError
+
+    def query(self, vector, top_k: int = 5, include_values: bool = False,
+              character: Optional[str] = None, boost: float = 0.0) -> List[Dict]:
+        if not character:
+            return self._query(vector, top_k, include_values)
+        scoped = self._query(vector, top_k, include_values, character)
+        if boost <= 0 and len(scoped) >= top_k:
+            return scoped
+        others = self._query(vector, top_k if boost > 0 else top_k + len(scoped), include_values)
+        return merge_character_matches(scoped, others, top_k, boost)
+
+    def query_many(self, vectors, top_k: int = 5, include_values: bool = False,
+                   character: Optional[str] = None, boost: float = 0.0) -> List[List[Dict]]:
+        """Matches for each of several query vectors"""
+        return [self.query(vector, top_k, include_values, character, boost) for vector in vectors]
+
+
+class PineconeVectorStore(VectorStore):
+    """Pinecone index, optionally paired with a local ChunkStore.
+
+    With a chunk store the index only has to return IDs and scores: chunk
+    text, metadata and (for MMR) the vectors are read from the memory-mapped
+    store in one bulk lookup instead of travelling with every query.
+    """
+
+    name = "pinecone"
+
+    def __init__(self, index, index_name: str = "mahabharat", chunk_store=None):
+        self.index = index
+        self.index_name = index_name
+        self.chunk_store = chunk_store
+
+    @property
+    def version(self) -> str:
+        # Pinecone has no content version; bump INDEX_VERSION after re-ingesting
+        version = f"pinecone:{self.index_name}:{os.getenv('INDEX_VERSION', '0')}"
+        if self.chunk_store is not None:
+            version += f":{self.chunk_store.version}"
+        return version
+
+    def _query(self, vector, top_k: int, include_values: bool, character: Optional[str] = None) -> List[Dict]:
+        kwargs = {}
+        if character:
+            # Ingestion stores the characters each chunk mentions as a list
+            kwargs["filter"] = {"characters": {"$in": [character]}}
+        hydrate = self.chunk_store is not None
+        results = self.index.query(
+            vector=np.asarray(vector, dtype=np.float32).tolist(),
+            top_k=top_k,
+            include_metadata=not hydrate,
+            include_values=include_values and not hydrate,
+            **kwargs
+        )
+        if hydrate:
+            return self._hydrate(results.get("matches", []), include_values)
+        matches = []
+        for m in results.get("matches", []):
+            match = {"id": m.get("id"), "score": m.get("score", 0.0), "metadata": m.get("metadata")}
+            if include_values and m.get("values"):
+                match["values"] = np.asarray(m.get("values"), dtype=np.float32)
+            matches.append(match)
+        missing = sum(1 for m in matches if not (m["metadata"] or {}).get("text"))
+        if missing:
+            # Ingested with slim metadata but this host has no chunk store:
+            # without the text these matches never reach the prompt
+            logger.warning("%d of %d Pinecone matches have no text and there is no chunk store; "
+                           "set CHUNK_STORE_DIR or re-ingest with --pinecone-metadata full", missing, len(matches))
+        return matches
+
+    def _hydrate(self, results: List[Dict], include_values: bool) -> List[Dict]:
+        records = self.chunk_store.get_many([m.get("id") for m in results], include_values)
+        matches = []
+        for m, record in zip(results, records):
+            if record is None:
+                # Upserted after the chunk store was built, or a stale store
+                logger.warning("Chunk %s is not in the chunk store; skipping it", m.get("id"))
+                continue
+            match = {"id": m.get("id"), "score": m.get("score", 0.0), "metadata": record["metadata"]}
+            if "values" in record:
+                match["values"] = record["values"]
+            matches.append(match)
+        return matches
+
+
+class LocalVectorStore(VectorStore):
+    """In-process index over a memory-mapped matrix of normalized embeddings.
+
+    The matrix is opened read-only with np.memmap, so every worker process on
+    the host shares the same page-cache pages. ``exact`` mode scores every row;
+    ``ivf`` mode only scores the rows in the ``nprobe`` inverted lists closest
+    to the query (requires an index written with ``nlist > 0``).
+    """
+
+    name = "local"
+    multi_query = True
+
+    def __init__(self, path=DEFAULT_LOCAL_INDEX_DIR, mode: str = "exact", nprobe: int = 8):
+        self.path = Path(path)
+        with open(self.path / "manifest.json", "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+
+        count, dim = self.manifest["count"], self.manifest["dim"]
+        dtype = np.dtype(self.manifest["dtype"])
+        if count:
+            self.vectors = np.memmap(self.path / "vectors.bin", dtype=dtype, mode="r", shape=(count, dim))
+        else:
+            # mmap cannot map an empty file
+            self.vectors = np.empty((0, dim), dtype=dtype)
+
+        self.ids: List[str] = []
+        self.metadata: List[Optional[Dict]] = []
+        with open(self.path / "metadata.jsonl", "r", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                self.ids.append(record["id"])
+                self.metadata.append(record.get("metadata"))
+
+        self.mode = mode
+        self.nprobe = nprobe
+        self.centroids = None
+        if self.manifest.get("nlist"):
+            self.centroids = np.load(self.path / "ivf_centroids.npy")
+            self.list_offsets = np.load(self.path / "ivf_offsets.npy")
+            self.list_rows = np.load(self.path / "ivf_rows.npy", mmap_mode="r")
+        elif mode == "ivf":
+            logger.warning("Local index at %s has no IVF lists, using exact search", self.path)
+            self.mode = "exact"
+
+        # Entity index: rows of the chunks that mention each character
+        self.entity_rows: Dict[str, np.ndarray] = {}
+        self.entity_signatures: Optional[Dict[str, str]] = None
+        if (self.path / "entities.json").exists():
+            with open(self.path / "entities.json", "r", encoding="utf-8") as f:
+                entities = json.load(f)["characters"]
+            self.entity_signatures = {name: entry["signature"] for name, entry in entities.items()}
+            self.entity_rows = {name: np.asarray(entry["rows"], dtype=np.int64) for name, entry in entities.items()}
+
+    @property
+    def version(self) -> str:
+        return f"local:{self.manifest['version']}"
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _score_rows(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        if rows is not None:
+            # Fancy indexing a memmap reads just these rows; keep them sorted
+            return self.vectors[rows].astype(np.float32, copy=False) @ query
+        scores = np.empty(len(self.vectors), dtype=np.float32)
+        for start in range(0, len(self.vectors), SCORE_BLOCK_ROWS):
+            block = self.vectors[start:start + SCORE_BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32, copy=False) @ query
+        return scores
+
+    def indexed_characters(self) -> Optional[Dict[str, str]]:
+        # An index written without entities can't scope any character
+        return self.entity_signatures if self.entity_signatures is not None else {}
+
+    def search(self, vector, top_k: int = 5, nprobe: Optional[int] = None, rows: Optional[np.ndarray] = None):
+        """Return (row indices, scores) of the best matches, among ``rows``
+        (sorted row indices) only if given"""
+        query = normalize_rows(vector)[0]
+        if len(self.vectors) == 0 or (rows is not None and len(rows) == 0):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        if rows is not None:
+            scores = self._score_rows(query, rows)
+            best = top_k_indices(scores, top_k)
+            return rows[best], scores[best]
+
+        if self.mode == "ivf" and self.centroids is not None:
+            probes = top_k_indices(self.centroids @ query, nprobe or self.nprobe)
+            rows = np.concatenate([
+                self.list_rows[self.list_offsets[p]:self.list_offsets[p + 1]] for p in probes
+            ])
+            rows = np.sort(rows)
+            scores = self._score_rows(query, rows)
+            best = top_k_indices(scores, top_k)
+            return rows[best], scores[best]
+
+        scores = self._score_rows(query)
+        best = top_k_indices(scores, top_k)
+        return best, scores[best]
+
+    def search_many(self, vectors, top_k: int = 5):
+        """search() for several queries; exact mode reads each block of the
+        index once for all of them instead of once per query"""
+        queries = normalize_rows(vectors)
+        if self.mode == "ivf" and self.centroids is not None:
+            return [self.search(query, top_k) for query in queries]
+        scores = np.empty((len(self.vectors), len(queries)), dtype=np.float32)
+        for start in range(0, len(self.vectors), SCORE_BLOCK_ROWS):
+            block = self.vectors[start:start + SCORE_BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32, copy=False) @ queries.T
+        results = []
+        for column in scores.T:
+            best = top_k_indices(column, top_k)
+            results.append((best, column[best]))
+        return results
+
+    def _matches(self, rows, scores, include_values: bool) -> List[Dict]:
+        matches = [
+            {"id": self.ids[row], "score": float(score), "metadata": self.metadata[row]}
+            for row, score in zip(rows, scores)
+        ]
+        if include_values:
+            for match, row in zip(matches, rows):
+                match["values"] = np.asarray(self.vectors[row], dtype=np.float32)
+        return matches
+
+    def _query(self, vector, top_k: int, include_values: bool, character: Optional[str] = None) -> List[Dict]:
+        rows = None
+        if character:
+            # A character missing from the entity index is mentioned nowhere
+            rows = self.entity_rows.get(character, np.empty(0, dtype=np.int64))
+        return self._matches(*self.search(vector, top_k, rows=rows), include_values)
+
+    def query_many(self, vectors, top_k: int = 5, include_values: bool = False,
+                   character: Optional[str] = None, boost: float = 0.0) -> List[List[Dict]]:
+        if character:
+            # Entity row sets are small, so scoped queries are cheap one by one
+            return super().query_many(vectors, top_k, include_values, character, boost)
+        return [self._matches(rows, scores, include_values) for rows, scores in self.search_many(vectors, top_k)]
+
+
+def kmeans(vectors: np.ndarray, k: int, iterations: int = 10, sample_size: int = 50000, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on a sample of the rows; returns normalized centroids"""
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    sample_rows = np.sort(rng.choice(n, size=min(n, sample_size), replace=False))
+    sample = normalize_rows(np.asarray(vectors[sample_rows], dtype=np.float32))
+    k = min(k, len(sample))
+    centroids = sample[rng.choice(len(sample), size=k, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        counts = np.bincount(assignment, minlength=k)
+        empty = counts == 0
+        # Re-seed empty lists from random points so every list stays useful
+        sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+def build_ivf(path, nlist: int) -> None:
+    """Cluster the vectors of a written index into nlist inverted lists"""
+    path = Path(path)
+    with open(path / "manifest.json", "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    count, dim = manifest["count"], manifest["dim"]
+    if count == 0:
+        return
+    vectors = np.memmap(path / "vectors.bin", dtype=np.dtype(manifest["dtype"]), mode="r", shape=(count, dim))
+
+    centroids = kmeans(vectors, nlist)
+    assignment = np.empty(count, dtype=np.int32)
+    for start in range(0, count, SCORE_BLOCK_ROWS):
+        block = vectors[start:start + SCORE_BLOCK_ROWS].astype(np.float32, copy=False)
+        assignment[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+
+    rows = np.argsort(assignment, kind="stable").astype(np.int64)
+    offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(assignment, minlength=len(centroids)))
+
+    np.save(path / "ivf_centroids.npy", centroids.astype(np.float32))
+    np.save(path / "ivf_offsets.npy", offsets)
+    np.save(path / "ivf_rows.npy", rows)
+    manifest["nlist"] = len(centroids)
+    with open(path / "manifest.json", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+
+class LocalIndexWriter:
+    """Streams vectors and metadata into a LocalVectorStore directory.
+
+    Rows are appended to disk as they arrive, so memory use does not depend on
+    corpus size. The manifest is written last, which makes a half-written
+    index unreadable rather than silently truncated; until then a
+    ``partial.json`` marker lets read_partial_index salvage the rows already
+    flushed by an interrupted run.
+    """
+
+    def __init__(self, path=DEFAULT_LOCAL_INDEX_DIR, dtype: str = "float32", nlist: int = 0, model: str = "",
+                 entity_signatures: Optional[Dict[str, str]] = None):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.dtype = np.dtype(dtype)
+        self.nlist = nlist
+        self.model = model
+        self.dim = None
+        self.count = 0
+        self.written = set()  # IDs added so far
+        # With signatures, close() writes an entity index from the rows'
+        # ``characters`` metadata
+        self.entity_signatures = entity_signatures
+        self.entity_rows: Dict[str, List[int]] = {}
+        manifest = self.path / "manifest.json"
+        if manifest.exists():
+            manifest.unlink()
+        for stale in ("ivf_centroids.npy", "ivf_offsets.npy", "ivf_rows.npy", "entities.json"):
+            if (self.path / stale).exists():
+                (self.path / stale).unlink()
+        self._vectors = open(self.path / "vectors.bin", "wb")
+        self._metadata = open(self.path / "metadata.jsonl", "w", encoding="utf-8")
+
+    def add(self, ids: Iterable[str], vectors, metadata: Iterable[Optional[Dict]]) -> None:
+        vectors = normalize_rows(vectors)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+            with open(self.path / "partial.json", "w", encoding="utf-8") as f:
+                json.dump({"dim": self.dim, "dtype": self.dtype.name, "model": self.model}, f)
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dimensional vectors, got {vectors.shape[1]}")
+        self._vectors.write(vectors.astype(self.dtype).tobytes())
+        for row, (chunk_id, meta) in enumerate(zip(ids, metadata), start=self.count):
+            self._metadata.write(json.dumps({"id": chunk_id, "metadata": meta}) + "\n")
+            self.written.add(chunk_id)
+            for name in (meta or {}).get("characters", ()):
+                self.entity_rows.setdefault(name, []).append(row)
+        self.count += len(vectors)
+
+    def flush(self) -> None:
+        """Push buffered rows to disk so an interrupted run can salvage them"""
+        self._vectors.flush()
+        self._metadata.flush()
+
+    def close(self) -> None:
+        self._vectors.close()
+        self._metadata.close()
+        if (self.path / "partial.json").exists():
+            (self.path / "partial.json").unlink()
+        manifest = {
+            "count": self.count,
+            "dim": self.dim or 0,
+            "dtype": self.dtype.name,
+            "model": self.model,
+            "nlist": 0,
+            "version": f"{int(time.time())}-{uuid.uuid4().hex[:8]}",
+        }
+        if self.entity_signatures is not None:
+            with open(self.path / "entities.json", "w", encoding="utf-8") as f:
+                json.dump({"characters": {
+                    name: {"signature": signature, "rows": self.entity_rows.get(name, [])}
+                    for name, signature in self.entity_signatures.items()
+                }}, f)
+        with open(self.path / "manifest.json", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        if self.nlist and self.count:
+            build_ivf(self.path, self.nlist)
+
+
+def read_partial_index(path):
+    """Rows flushed by a LocalIndexWriter that never reached close().
+
+    Returns (ids, vectors) covering only rows whose vector and metadata were
+    both fully written, or None if there is nothing to salvage.
+    """
+    path = Path(path)
+    if not (path / "partial.json").exists():
+        return None
+    with open(path / "partial.json", "r", encoding="utf-8") as f:
+        info = json.load(f)
+    dtype = np.dtype(info["dtype"])
+    row_bytes = info["dim"] * dtype.itemsize
+
+    ids = []
+    with open(path / "metadata.jsonl", "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break
+            ids.append(json.loads(line)["id"])
+    rows = min(len(ids), (path / "vectors.bin").stat().st_size // row_bytes)
+    if rows == 0:
+        return None
+    vectors = np.memmap(path / "vectors.bin", dtype=dtype, mode="r", shape=(rows, info["dim"]))
+    return ids[:rows], vectors
+
+
+def write_local_index(path, ids: List[str], vectors, metadata: List[Optional[Dict]], dtype: str = "float32", nlist: int = 0, model: str = "",
+                      entity_signatures: Optional[Dict[str, str]] = None) -> None:
+    """Write a complete local index in one call"""
+    writer = LocalIndexWriter(path, dtype=dtype, nlist=nlist, model=model, entity_signatures=entity_signatures)
+    writer.add(ids, vectors, metadata)
+    writer.close()
+
+
+def local_store_from_env() -> LocalVectorStore:
+    return LocalVectorStore(
+        os.getenv("LOCAL_INDEX_DIR", str(DEFAULT_LOCAL_INDEX_DIR)),
+        mode=os.getenv("LOCAL_INDEX_MODE", "exact"),
+        nprobe=int(os.getenv("LOCAL_INDEX_NPROBE", "8")),
+    )